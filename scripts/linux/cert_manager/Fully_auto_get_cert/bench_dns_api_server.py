@@ -0,0 +1,678 @@
+#!/usr/bin/env python3
+# bench_dns_api_server.py - DNS API Server 压测工具
+#
+# 在临时目录中生成指定规模的区域文件，用桩程序代替 rndc 和 named-checkzone，
+# 启动 bind_dns_api_server.py，然后用多个并发客户端通过真实的 TCP 连接
+# 按配置的比例发送 add/update/delete/list_domains 请求。
+# 结束后报告吞吐量、各操作的 p50/p95/p99 延迟，并对照最终的区域文件
+# 检查已确认成功的写入是否丢失（丢失写入数不为 0 时退出码为 1）。
+# 指定 --check-ddns 时另加一个动态更新区域，由本机 UDP 上的模拟 named（独立实现 UPDATE 解析和
+# TSIG 校验、签名）应答，通过 API 检查 DNS UPDATE 后端，有失败时退出码也为 1。
+#
+# 示例：
+#   ./bench_dns_api_server.py --records 100000 --clients 32 --duration 20
+#   ./bench_dns_api_server.py --records 1000000 --mix add=50,update=30,delete=20 --mode framed --store sqlite
+#   ./bench_dns_api_server.py --records 100000 --clients 64 --workers 4 --engine asyncio
+#   ./bench_dns_api_server.py --records 100 --duration 1 --check-ddns
+
+import argparse
+import base64
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_ZONE = "bench.test"
+DEFAULT_MIX = "add=40,update=30,delete=10,list=20"
+OPERATIONS = ("add", "update", "delete", "list")
+# 压测客户端自己创建的域名前缀，用于在最终区域文件中找出需要核对的记录
+BENCH_PREFIX = "bench-"
+RECORD_PATTERN = re.compile(r'^([a-zA-Z0-9\-\.]+)\.\s+(?:\d+\s+)?IN\s+(A|AAAA)\s+(\S+)')
+
+# 在子进程中启动服务器：导入前先临时配置日志，使服务器模块导入时不去打开默认的 LOG_FILE；
+# 把配置指向临时目录后用 restart_logging 换成与生产相同的队列日志（QueueListener 写入 LOG_FILE，
+# 多进程模式下由监管进程和工作进程各自重建），最后按所选引擎监听
+SERVER_BOOTSTRAP = """
+import asyncio, json, logging, sys
+config = json.loads(sys.argv[1])
+logging.basicConfig(filename=config["log_file"], level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+sys.path.insert(0, config["server_dir"])
+import bind_dns_api_server as server
+server.ZONE_NAME = config["zone"]
+server.ZONE_FILE = config["zone_file"]
+server.NAMED_CONF_LOCAL = config["named_conf"]
+server.BACKUP_DIR = config["backup_dir"]
+server.SQLITE_DB = config["sqlite_db"]
+server.STORAGE_BACKEND = config["store"]
+server.RELOAD_BATCH_WINDOW = config["batch_window"]
+server.METRICS_PORT = config["metrics_port"]
+server.LOG_FILE = config["log_file"]
+server.ZONE_BACKENDS = config["zone_backends"]
+server.restart_logging(shared=False)
+# 所有压测客户端来自同一地址，不限流
+server.RATE_LIMITS = None
+server.zone_router = server.ZoneRouter(server.NAMED_CONF_LOCAL)
+if not server.check_zone_file_health():
+    sys.exit(1)
+if config["workers"] > 1:
+    server.SERVER_ENGINE = config["engine"]
+    server.ZONE_WATCHER = None
+    server.WorkerSupervisor("127.0.0.1", config["port"], config["workers"]).run()
+    sys.exit(0)
+if server.METRICS_PORT:
+    server.start_metrics_server()
+if config["engine"] == "asyncio":
+    asyncio.run(server.AsyncDNSAPIServer("127.0.0.1", config["port"]).serve())
+else:
+    with server.ThreadedTCPServer(("127.0.0.1", config["port"]), server.DNSRequestHandler) as tcp_server:
+        tcp_server.serve_forever()
+"""
+
+def parse_mix(text):
+    """解析 "add=40,update=30,..." 形式的操作比例，返回 [(操作, 权重)]"""
+    mix = []
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"未知操作: {name}（可选 {', '.join(OPERATIONS)}）")
+        try:
+            mix.append((name, float(weight)))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"无效的权重: {item}")
+    if not any(weight > 0 for _, weight in mix):
+        raise argparse.ArgumentTypeError("至少需要一个权重大于 0 的操作")
+    return mix
+
+def write_zone_file(path, zone, records):
+    """生成包含 records 条 A 记录的区域文件"""
+    with open(path, "w") as f:
+        f.write(f"$TTL 86400\n"
+                f"@   IN  SOA ns1.{zone}. admin.{zone}. (\n"
+                f"        2024010101 ; serial\n"
+                f"        3600 ; refresh\n"
+                f"        1800 ; retry\n"
+                f"        604800 ; expire\n"
+                f"        86400 ) ; minimum\n"
+                f"@   IN  NS  ns1.{zone}.\n"
+                f"ns1 IN  A   10.255.255.254\n")
+        chunk = []
+        for i in range(records):
+            chunk.append(f"host{i}.{zone}.   IN  A     10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}\n")
+            if len(chunk) >= 10000:
+                f.writelines(chunk)
+                chunk = []
+        f.writelines(chunk)
+
+def write_stub_binaries(bin_dir, reload_delay):
+    """生成 rndc 和 named-checkzone 桩程序；rndc 可以模拟重新加载的耗时"""
+    os.makedirs(bin_dir, exist_ok=True)
+    stubs = {
+        "rndc": f"#!/bin/sh\nsleep {reload_delay}\nexit 0\n" if reload_delay > 0 else "#!/bin/sh\nexit 0\n",
+        "named-checkzone": "#!/bin/sh\necho \"zone $1: loaded serial 0\"\necho OK\nexit 0\n",
+    }
+    for name, content in stubs.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        os.chmod(path, 0o755)
+
+def free_port():
+    """向系统申请一个空闲端口"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(args, work_dir, port, zone_backends=None):
+    """启动服务器子进程并等待端口可连接，返回 Popen 对象"""
+    config = {
+        "server_dir": SERVER_DIR,
+        "log_file": os.path.join(work_dir, "dns_api.log"),
+        "zone": BENCH_ZONE,
+        "zone_file": os.path.join(work_dir, f"db.{BENCH_ZONE}"),
+        # 不存在时只管理 BENCH_ZONE；--check-ddns 时由 write_ddns_zone 生成
+        "named_conf": os.path.join(work_dir, "named.conf.local"),
+        "backup_dir": os.path.join(work_dir, "backups"),
+        "sqlite_db": os.path.join(work_dir, "records.db"),
+        "store": args.store,
+        "engine": args.engine,
+        "workers": args.workers,
+        "batch_window": args.batch_window,
+        "metrics_port": args.metrics_port,
+        "port": port,
+        "zone_backends": zone_backends or {},
+    }
+    env = dict(os.environ)
+    env["PATH"] = os.path.join(work_dir, "bin") + os.pathsep + env.get("PATH", "")
+    output = open(os.path.join(work_dir, "server.out"), "w")
+    process = subprocess.Popen([sys.executable, "-c", SERVER_BOOTSTRAP, json.dumps(config)],
+                               env=env, stdout=output, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务器启动失败，退出码 {process.returncode}，详见 {output.name}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"服务器在 {args.startup_timeout} 秒内没有开始监听")
+
+def recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("连接已被服务器关闭")
+        data += chunk
+    return data
+
+class Client:
+    """一个压测连接：oneshot 模式每个请求新建连接，framed 模式复用一条长连接"""
+
+    def __init__(self, port, mode, timeout):
+        self.address = ("127.0.0.1", port)
+        self.mode = mode
+        self.timeout = timeout
+        self.sock = None
+
+    def call(self, request):
+        payload = json.dumps(request).encode("utf-8")
+        if self.mode == "oneshot":
+            with socket.create_connection(self.address, timeout=self.timeout) as sock:
+                sock.sendall(payload)
+                data = b""
+                while True:
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        break
+                    data += chunk
+            return json.loads(data.decode("utf-8"))
+
+        if self.sock is None:
+            self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        try:
+            self.sock.sendall(struct.pack("!I", len(payload)) + payload)
+            size = struct.unpack("!I", recv_exact(self.sock, 4))[0]
+            return json.loads(recv_exact(self.sock, size).decode("utf-8"))
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+class Worker(threading.Thread):
+    """
+    一个并发客户端。只修改自己名下的域名（bench-<编号>-<序号>），
+    因此可以精确记录每个域名最终应有的状态，用来核对丢失的写入。
+    """
+
+    def __init__(self, index, args, port, stop_at):
+        super().__init__(daemon=True)
+        self.index = index
+        self.args = args
+        self.client = Client(port, args.mode, args.timeout)
+        self.stop_at = stop_at
+        self.random = random.Random(args.seed * 1000003 + index)
+        self.operations = [name for name, _ in args.mix]
+        self.weights = [weight for _, weight in args.mix]
+        self.latencies = {name: [] for name in OPERATIONS}
+        self.errors = {name: 0 for name in OPERATIONS}
+        self.error_samples = []
+        self.expected = {}       # 域名 -> 应有的 IP（已删除的不在其中）
+        self.touched = set()     # 成功修改过的所有域名
+        self.uncertain = set()   # 请求超时或连接出错、结果未知的域名
+        self.counter = 0
+
+    def _random_ip(self):
+        return f"172.{self.index % 250 + 1}.{self.random.randrange(256)}.{self.random.randrange(1, 255)}"
+
+    def _next_request(self):
+        operation = self.random.choices(self.operations, self.weights)[0]
+        owned = list(self.expected) if operation in ("update", "delete") else None
+        if operation in ("update", "delete") and not owned:
+            operation = "add"
+        if operation == "add":
+            self.counter += 1
+            domain = f"{BENCH_PREFIX}{self.index}-{self.counter}.{BENCH_ZONE}"
+            return operation, domain, {"action": "add_domain", "domain": domain, "ip": self._random_ip()}
+        if operation == "update":
+            domain = self.random.choice(owned)
+            return operation, domain, {"action": "update_domain", "domain": domain, "ip": self._random_ip()}
+        if operation == "delete":
+            domain = self.random.choice(owned)
+            return operation, domain, {"action": "delete_domain", "domain": domain}
+        return operation, None, {"action": "list_domains"}
+
+    def run(self):
+        done = 0
+        while True:
+            if self.args.requests and done >= self.args.requests:
+                break
+            if not self.args.requests and time.monotonic() >= self.stop_at:
+                break
+            done += 1
+            operation, domain, request = self._next_request()
+            start = time.perf_counter()
+            try:
+                resp = self.client.call(request)
+            except Exception as e:
+                self.errors[operation] += 1
+                self._sample_error(operation, f"{type(e).__name__}: {e}")
+                if domain is not None:
+                    self.uncertain.add(domain)
+                continue
+            self.latencies[operation].append(time.perf_counter() - start)
+
+            if resp.get("status") != "success":
+                self.errors[operation] += 1
+                self._sample_error(operation, resp.get("message"))
+                continue
+            if operation in ("add", "update"):
+                self.expected[domain] = request["ip"]
+                self.touched.add(domain)
+            elif operation == "delete":
+                del self.expected[domain]
+                self.touched.add(domain)
+        self.client.close()
+
+    def _sample_error(self, operation, message):
+        if len(self.error_samples) < 5:
+            self.error_samples.append(f"{operation}: {message}")
+
+def read_zone_records(path):
+    """读取区域文件中由压测客户端创建的记录，返回 {域名: IP}"""
+    records = {}
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith(BENCH_PREFIX):
+                match = RECORD_PATTERN.match(line)
+                if match:
+                    records[match.group(1).lower()] = match.group(3)
+    return records
+
+def count_lost_writes(workers, zone_file):
+    """对照最终区域文件，统计已确认成功但没有体现出来的写入"""
+    actual = read_zone_records(zone_file)
+    lost = []
+    for worker in workers:
+        for domain in worker.touched - worker.uncertain:
+            if actual.get(domain.lower()) != worker.expected.get(domain):
+                lost.append((domain, worker.expected.get(domain), actual.get(domain.lower())))
+    return lost
+
+# --check-ddns 使用的动态更新区域和 TSIG 密钥（只在本机的模拟 named 与服务器之间使用）
+DDNS_ZONE = "ddns.bench.test"
+DDNS_KEY_NAME = "bench-key"
+DDNS_KEY_SECRET = "YmVuY2gtZGRucy1jaGVjay1zZWNyZXQtMDEyMzQ1Njc="
+DNS_TYPE_NAMES = {1: "A", 6: "SOA", 16: "TXT", 28: "AAAA", 250: "TSIG", 255: "ANY"}
+
+def read_dns_name(message, offset):
+    """读取报文中 offset 处的域名（支持压缩指针），返回 (小写域名, 其后的位置)"""
+    labels = []
+    end = None
+    while True:
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack("!H", message[offset:offset + 2])[0] & 0x3FFF
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(message[offset:offset + length].decode("ascii").lower())
+        offset += length
+    return ".".join(labels), end if end is not None else offset
+
+def dns_name_wire(name):
+    """域名的非压缩报文格式"""
+    return b"".join(bytes([len(label)]) + label.encode("ascii") for label in name.split(".") if label) + b"\0"
+
+class DDNSResponder:
+    """
+    本机 UDP 上的模拟 named，独立于服务器的实现按 RFC 2136/8945 解析 UPDATE 和 SOA 查询：
+    校验请求的 TSIG，按更新段修改内存中的 RRset 并递增序列号，返回带 TSIG 签名的响应。
+    mode 为 "refuse" 时拒绝更新（REFUSED），为 "badsig" 时用错误的密钥为响应签名。
+    """
+
+    def __init__(self, zone, key_name, secret):
+        self.zone = zone
+        self.key_name = key_name
+        self.secret = base64.b64decode(secret)
+        self.serial = 2024010101
+        self.rrsets = {}  # (域名, 类型) -> {rdata}
+        self.mode = "ok"
+        self.errors = []  # 请求本身的问题（格式、TSIG），检查时报告
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            data, address = self.sock.recvfrom(65535)
+            try:
+                response = self.handle(data)
+            except Exception as e:
+                self.errors.append(f"无法解析请求: {type(e).__name__}: {e}")
+                continue
+            self.sock.sendto(response, address)
+
+    def handle(self, message):
+        msg_id, flags, qdcount, ancount, nscount, arcount = struct.unpack("!HHHHHH", message[:12])
+        opcode = flags >> 11 & 0xF
+        zone, offset = read_dns_name(message, 12)
+        question_end = offset + 4
+        qtype = struct.unpack("!H", message[offset:offset + 2])[0]
+        offset = question_end
+        records = []
+        for _ in range(ancount + nscount + arcount):
+            start = offset
+            name, offset = read_dns_name(message, offset)
+            rtype, rclass, ttl, length = struct.unpack("!HHIH", message[offset:offset + 10])
+            records.append((start, name, rtype, rclass, offset + 10, message[offset + 10:offset + 10 + length]))
+            offset += 10 + length
+        if not records or records[-1][2] != 250:
+            self.errors.append("请求没有 TSIG 签名")
+            return self._reply(message[:question_end], msg_id, opcode, 9, b"", b"")
+        request_mac, error = self._verify(message, records[-1], arcount)
+        if error:
+            self.errors.append(error)
+            return self._reply(message[:question_end], msg_id, opcode, 9, b"", b"")
+        if zone != self.zone:
+            return self._reply(message[:question_end], msg_id, opcode, 10, b"", request_mac)
+
+        if opcode == 0 and qtype == 6:
+            rdata = (dns_name_wire(f"ns1.{self.zone}") + dns_name_wire(f"admin.{self.zone}")
+                     + struct.pack("!IIIII", self.serial, 3600, 1800, 604800, 86400))
+            answer = b"\xc0\x0c" + struct.pack("!HHIH", 6, 1, 300, len(rdata)) + rdata
+            return self._reply(message[:question_end], msg_id, opcode, 0, answer, request_mac)
+        if opcode != 5:
+            return self._reply(message[:question_end], msg_id, opcode, 4, b"", request_mac)
+        if self.mode == "refuse":
+            return self._reply(message[:question_end], msg_id, opcode, 5, b"", request_mac)
+        for _, name, rtype, rclass, _, rdata in records[ancount:ancount + nscount]:
+            if not (name == self.zone or name.endswith("." + self.zone)):
+                return self._reply(message[:question_end], msg_id, opcode, 10, b"", request_mac)
+            if rclass == 255:
+                # 删除整个 RRset（类型为 ANY 时删除该名称的全部记录）
+                for key in [key for key in self.rrsets if key[0] == name and rtype in (255, key[1])]:
+                    del self.rrsets[key]
+            elif rclass == 254:
+                self.rrsets.get((name, rtype), set()).discard(rdata)
+            else:
+                self.rrsets.setdefault((name, rtype), set()).add(rdata)
+        self.rrsets = {key: value for key, value in self.rrsets.items() if value}
+        self.serial += 1
+        return self._reply(message[:question_end], msg_id, opcode, 0, b"", request_mac)
+
+    def _verify(self, message, tsig, arcount):
+        """校验请求的 TSIG，返回 (请求的 MAC, 错误消息)"""
+        start, name, _, _, rdata_start, rdata = tsig
+        if name != self.key_name:
+            return b"", f"TSIG 密钥名不符: {name}"
+        algorithm, offset = read_dns_name(message, rdata_start)
+        if algorithm != "hmac-sha256":
+            return b"", f"不支持的 TSIG 算法: {algorithm}"
+        offset -= rdata_start
+        time_signed = rdata[offset:offset + 6]
+        fudge, mac_size = struct.unpack("!HH", rdata[offset + 6:offset + 10])
+        mac = rdata[offset + 10:offset + 10 + mac_size]
+        original_id, error, other_size = struct.unpack("!HHH", rdata[offset + 10 + mac_size:offset + 16 + mac_size])
+        signed = (struct.pack("!H", original_id) + message[2:10] + struct.pack("!H", arcount - 1)
+                  + message[12:start])
+        variables = (dns_name_wire(self.key_name) + struct.pack("!HI", 255, 0) + dns_name_wire(algorithm)
+                     + time_signed + struct.pack("!HHH", fudge, error, other_size)
+                     + rdata[offset + 16 + mac_size:])
+        if not hmac.compare_digest(mac, hmac.new(self.secret, signed + variables, hashlib.sha256).digest()):
+            return b"", "请求的 TSIG 签名不正确"
+        if abs(time.time() - int.from_bytes(time_signed, "big")) > fudge:
+            return b"", "请求的 TSIG 签名时间超出允许范围"
+        return mac, None
+
+    def _reply(self, question, msg_id, opcode, rcode, answer, request_mac):
+        """构造响应；request_mac 为空（请求的签名无效）时不签名"""
+        header = struct.pack("!HHHHHH", msg_id, 0x8000 | opcode << 11 | rcode, 1, 1 if answer else 0, 0, 0)
+        response = header + question[12:] + answer
+        if not request_mac:
+            return response
+        secret = b"wrong-secret" if self.mode == "badsig" else self.secret
+        now = int(time.time())
+        time_signed = struct.pack("!HI", now >> 32, now & 0xFFFFFFFF)
+        algorithm = dns_name_wire("hmac-sha256")
+        variables = (dns_name_wire(self.key_name) + struct.pack("!HI", 255, 0) + algorithm
+                     + time_signed + struct.pack("!HHH", 300, 0, 0))
+        mac = hmac.new(secret, struct.pack("!H", len(request_mac)) + request_mac + response + variables,
+                       hashlib.sha256).digest()
+        rdata = algorithm + time_signed + struct.pack("!HH", 300, len(mac)) + mac + struct.pack("!HHH", msg_id, 0, 0)
+        tsig = dns_name_wire(self.key_name) + struct.pack("!HHIH", 250, 255, 0, len(rdata)) + rdata
+        return response[:10] + struct.pack("!H", 1) + response[12:] + tsig
+
+    def records(self, name):
+        """返回名称的记录 {(类型, 文本)}"""
+        result = set()
+        for (owner, rtype), values in self.rrsets.items():
+            if owner != name:
+                continue
+            for rdata in values:
+                if rtype in (1, 28):
+                    text = str(ipaddress.ip_address(rdata))
+                elif rtype == 16:
+                    text = rdata[1:1 + rdata[0]].decode("ascii")
+                else:
+                    text = rdata.hex()
+                result.add((DNS_TYPE_NAMES.get(rtype, str(rtype)), text))
+        return result
+
+def write_ddns_zone(work_dir):
+    """生成 --check-ddns 的 named.conf.local（压测区域 + 动态更新区域）和动态更新区域的文件"""
+    zone_file = os.path.join(work_dir, f"db.{DDNS_ZONE}")
+    write_zone_file(zone_file, DDNS_ZONE, 0)
+    with open(os.path.join(work_dir, "named.conf.local"), "w") as f:
+        for zone in (BENCH_ZONE, DDNS_ZONE):
+            f.write(f'zone "{zone}" {{\n    type master;\n    file "{os.path.join(work_dir, "db." + zone)}";\n}};\n')
+
+def check_ddns(port, responder):
+    """
+    通过 API 对动态更新区域执行 add/update/set_txt/clear_txt/delete，核对模拟 named 收到的更新、
+    响应中的版本号与其序列号一致，以及更新被拒绝、响应签名错误时 API 报告失败。返回失败的检查项。
+    """
+    client = Client(port, "oneshot", 30)
+    domain = f"ddns-check.{DDNS_ZONE}"
+    txt_name = f"_acme-challenge.ddns-check.{DDNS_ZONE}"
+    steps = [
+        ("add", {"action": "add_domain", "domain": domain, "ip": "192.0.2.20"}, domain, {("A", "192.0.2.20")}),
+        ("update", {"action": "update_domain", "domain": domain, "ip": "2001:db8::20"}, domain,
+         {("AAAA", "2001:db8::20")}),
+        ("set_txt", {"action": "set_txt", "domain": txt_name, "values": ["tok-a", "tok-b"]}, txt_name,
+         {("TXT", "tok-a"), ("TXT", "tok-b")}),
+        ("clear_txt", {"action": "clear_txt", "domain": txt_name}, txt_name, set()),
+        ("delete", {"action": "delete_domain", "domain": domain}, domain, set()),
+    ]
+    failed = []
+
+    def report(name, problem):
+        print(f"  {name}: {'通过' if problem is None else '失败，' + problem}")
+        if problem is not None:
+            failed.append(name)
+
+    for name, request, owner, expected in steps:
+        resp = client.call(request)
+        problem = None
+        if resp.get("status") != "success":
+            problem = f"响应 {resp}"
+        elif responder.records(owner) != expected:
+            problem = f"模拟 named 中 {owner} 的记录为 {sorted(responder.records(owner))}，应为 {sorted(expected)}"
+        elif resp.get("version") != responder.serial:
+            problem = f"响应的版本号 {resp.get('version')} 与 named 的序列号 {responder.serial} 不一致"
+        report(name, problem)
+
+    for mode, keyword in (("refuse", "REFUSED"), ("badsig", "TSIG")):
+        responder.mode = mode
+        resp = client.call({"action": "add_domain", "domain": f"ddns-{mode}.{DDNS_ZONE}", "ip": "192.0.2.30"})
+        responder.mode = "ok"
+        problem = None
+        if resp.get("status") == "success" or keyword not in resp.get("message", ""):
+            problem = f"应报告 {keyword} 错误，实际响应 {resp}"
+        report(f"{mode} 时报告失败", problem)
+
+    report("请求格式和签名", "; ".join(responder.errors[:3]) if responder.errors else None)
+    return failed
+
+def percentile(sorted_values, fraction):
+    """最近秩法计算分位数"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def summarize(workers, elapsed, lost):
+    """汇总各客户端的结果"""
+    summary = {"elapsed": elapsed, "operations": {}, "lost_writes": len(lost),
+               "lost_samples": lost[:10], "uncertain": sum(len(w.uncertain) for w in workers)}
+    total = 0
+    for operation in OPERATIONS:
+        latencies = sorted(value for w in workers for value in w.latencies[operation])
+        errors = sum(w.errors[operation] for w in workers)
+        if not latencies and not errors:
+            continue
+        total += len(latencies)
+        summary["operations"][operation] = {
+            "responses": len(latencies),
+            "errors": errors,
+            "throughput": len(latencies) / elapsed if elapsed else 0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+        }
+    summary["total_requests"] = total
+    summary["throughput"] = total / elapsed if elapsed else 0
+    summary["error_samples"] = [sample for w in workers for sample in w.error_samples][:10]
+    return summary
+
+def print_report(args, summary):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.2f}"
+
+    print(f"区域记录数: {args.records}  客户端: {args.clients}  模式: {args.mode}  "
+          f"引擎: {args.engine}  工作进程: {args.workers}  存储: {args.store}  合并窗口: {args.batch_window}s")
+    print(f"耗时 {summary['elapsed']:.2f}s，共 {summary['total_requests']} 个请求，"
+          f"吞吐量 {summary['throughput']:.1f} req/s")
+    print(f"{'操作':<8}{'响应数':>9}{'错误':>7}{'req/s':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for operation, stats in summary["operations"].items():
+        print(f"{operation:<8}{stats['responses']:>9}{stats['errors']:>7}{stats['throughput']:>10.1f}"
+              f"{ms(stats['p50']):>10}{ms(stats['p95']):>10}{ms(stats['p99']):>10}{ms(stats['max']):>10}")
+    for sample in summary["error_samples"]:
+        print(f"  错误示例: {sample}")
+    print(f"丢失的写入: {summary['lost_writes']}（结果未知、未核对的域名: {summary['uncertain']}）")
+    for domain, expected, actual in summary["lost_samples"]:
+        print(f"  {domain}: 期望 {expected or '不存在'}，实际 {actual or '不存在'}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="DNS API Server 压测工具")
+    parser.add_argument("--records", type=int, default=1000, help="初始区域记录数（100 到 1000000）")
+    parser.add_argument("--clients", type=int, default=16, help="并发客户端数")
+    parser.add_argument("--duration", type=float, default=10, help="压测时长（秒）")
+    parser.add_argument("--requests", type=int, default=0, help="每个客户端发送的请求数（指定后忽略 --duration）")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"操作比例，默认 {DEFAULT_MIX}")
+    parser.add_argument("--mode", choices=("oneshot", "framed"), default="oneshot",
+                        help="oneshot: 每个请求一个连接；framed: 长连接分帧")
+    parser.add_argument("--engine", choices=("threaded", "asyncio"), default="threaded", help="服务器引擎")
+    parser.add_argument("--workers", type=int, default=1, help="服务器工作进程数（大于 1 时使用多进程模式）")
+    parser.add_argument("--store", choices=("zonefile", "sqlite"), default="zonefile", help="记录存储")
+    parser.add_argument("--batch-window", type=float, default=0, help="服务器的最大合并等待时间（秒），0 为纯组提交")
+    parser.add_argument("--reload-delay", type=float, default=0, help="桩 rndc 每次重新加载的模拟耗时（秒）")
+    parser.add_argument("--timeout", type=float, default=60, help="单个请求的超时（秒）")
+    parser.add_argument("--startup-timeout", type=float, default=300, help="等待服务器开始监听的时间（秒）")
+    parser.add_argument("--metrics-port", type=int, default=None, help="同时启用服务器的指标端点")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子")
+    parser.add_argument("--json", metavar="文件", help="把结果以 JSON 写入文件")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录（区域文件、日志、备份）")
+    parser.add_argument("--check-ddns", action="store_true",
+                        help="压测前通过本机的模拟 named 检查 DNS UPDATE 后端（报文编码和 TSIG）")
+    args = parser.parse_args(argv)
+    if not 100 <= args.records <= 1000000:
+        parser.error("--records 必须在 100 到 1000000 之间")
+    if args.clients < 1:
+        parser.error("--clients 至少为 1")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    work_dir = tempfile.mkdtemp(prefix="dns_api_bench.")
+    process = None
+    try:
+        zone_file = os.path.join(work_dir, f"db.{BENCH_ZONE}")
+        print(f"正在生成 {args.records} 条记录的区域文件: {zone_file}")
+        write_zone_file(zone_file, BENCH_ZONE, args.records)
+        write_stub_binaries(os.path.join(work_dir, "bin"), args.reload_delay)
+
+        responder = None
+        zone_backends = None
+        if args.check_ddns:
+            responder = DDNSResponder(DDNS_ZONE, DDNS_KEY_NAME, DDNS_KEY_SECRET)
+            write_ddns_zone(work_dir)
+            zone_backends = {DDNS_ZONE: {"backend": "ddns", "server": "127.0.0.1", "port": responder.port,
+                                         "tsig_name": DDNS_KEY_NAME, "tsig_secret": DDNS_KEY_SECRET,
+                                         "tsig_algorithm": "hmac-sha256", "ttl": 300}}
+
+        port = free_port()
+        started = time.monotonic()
+        process = start_server(args, work_dir, port, zone_backends)
+        print(f"服务器已在端口 {port} 监听（启动耗时 {time.monotonic() - started:.2f}s）")
+
+        ddns_failed = []
+        if responder is not None:
+            print(f"检查 DNS UPDATE 后端（模拟 named 在 UDP 端口 {responder.port}）:")
+            ddns_failed = check_ddns(port, responder)
+
+        start = time.monotonic()
+        workers = [Worker(i, args, port, start + args.duration) for i in range(args.clients)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - start
+
+        # 停止服务器后再核对区域文件，确保所有已确认的提交都已落盘
+        process.terminate()
+        process.wait(timeout=60)
+        lost = count_lost_writes(workers, zone_file)
+        summary = summarize(workers, elapsed, lost)
+        print_report(args, summary)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"config": {key: value for key, value in vars(args).items() if key != "json"},
+                           **summary}, f, ensure_ascii=False, indent=2)
+        return 1 if lost or ddns_failed else 0
+    finally:
+        if process is not None and process.poll() is None:
+            process.kill()
+        if args.keep:
+            print(f"临时目录已保留: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
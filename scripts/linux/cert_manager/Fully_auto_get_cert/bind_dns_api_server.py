@@ -6,221 +6,3930 @@
 # 2. 删除域名 (delete_domain)
 # 3. 更新域名 (update_domain)
 # 4. 列出所有域名 (list_domains)
-# 5. 自动更新SOA序列号
-# 6. 日志记录和错误处理
+# 5. 批量变更 (apply_changes) - 多项增删改一次提交，全部成功或全部不生效
+# 6. 自动更新SOA序列号
+# 7. 日志记录和错误处理
+# 8. 可按区域改用 RFC 2136 动态更新 (DNS UPDATE + 可选 TSIG) 代替重写文件 + rndc reload
+# 9. 连接方式：一次性 JSON（兼容 nc），或 4 字节长度前缀分帧的长连接（支持流水线）
+# 10. 可选 asyncio 服务器引擎：有界并发、排队上限（超出返回繁忙）和优雅关闭
+# 11. 可选 SQLite 记录存储：带索引的查找和事务，区域文件在提交时生成
+# 12. 变更日志 + 定期快照代替整份备份（快照按内容去重、gzip 压缩并增量清理），支持查看历史 (list_history) 和恢复到任意序列号 (rollback_to_serial)
+# 13. 一个进程管理 named.conf.local 中的所有 master 区域，各区域的锁、缓存和 reload 互相独立
+# 14. 可选指标端点 (METRICS_PORT)：请求数、耗时直方图、各提交阶段耗时、锁等待、进行中的请求数和记录数
+# 15. list_domains 支持过滤 (domain/prefix/suffix/type/ip/cidr)、游标分页 (limit/cursor) 和 NDJSON 流式输出 (stream)
+# 16. 日志经队列由后台线程写入：JSON 格式、按大小轮转、成功的高频请求按比例抽样
+# 17. 提交前在内存中校验变更（SOA、重复记录、CNAME 冲突、标签长度、TTL），不合法的变更在写文件和 reload 之前被拒绝
+# 18. upsert_domain：记录已一致时不做任何修改；所有响应（包括错误响应，限流拒绝的除外）带区域版本号 (version)，
+#     变更可用 if_version 做比较后写入
+# 19. 监视区域文件（inotify，不可用时轮询），外部修改后立即在后台重新解析，检测到与 API 提交冲突的修改时告警
+# 20. set_txt / clear_txt 管理 ACME DNS-01 的 _acme-challenge TXT 记录，批量形式一次提交、一次 reload
+# 21. 按客户端 IP 的令牌桶限流（读、写分别计额度，可按动作单独设置），超额请求在任何文件读写之前被拒绝
+# 22. 可选多进程模式 (WORKER_PROCESSES)：工作进程通过 SO_REUSEPORT 共享端口，由监管进程重启崩溃的进程；区域变更用 fcntl 文件锁跨进程串行化
+# 23. 预写日志 (WAL)：变更批次先追加并 fsync（同批请求共用一次 fsync），启动时重放未完成的批次；可在写入 WAL 后提前答复 (WAL_EARLY_ACK)
+# 24. 增量变更 (changes_since)：按序列号或变更日志序号返回之后的变更；从节点模式 (REPLICATION_PRIMARY) 持续拉取主节点的增量并在本地提交
+# 25. 多台 BIND (ZONE_TARGETS)：本地提交后并行经 rndc 或 DNS UPDATE 应用到其他主机，响应给出各目标的结果和耗时，按 quorum 判定成功
 
 import socketserver
+import http.server
+import asyncio
+import concurrent.futures
+import signal
+import socket
+import struct
+import hashlib
+import hmac
+import base64
+import copy
+import ctypes
+import ctypes.util
 import json
 import subprocess
 import os
 import re
 import logging
+import logging.handlers
+import atexit
+import random
 import time
 import ipaddress
 import threading
+import queue
+import collections
+import itertools
+import bisect
+import gzip
+import sqlite3
+import tempfile
+import fcntl
+from contextlib import contextmanager
 from datetime import datetime
 
 # 配置
+# 从 NAMED_CONF_LOCAL 加载所有 master 区域，按域名最长后缀匹配路由；
+# 文件不存在或没有 master 区域时只管理 ZONE_NAME / ZONE_FILE
+NAMED_CONF_LOCAL = "/etc/bind/named.conf.local"
+# named.conf 中相对路径的区域文件以 named 的 directory 选项为基准
+BIND_DIRECTORY = "/var/cache/bind"
+# 检查 NAMED_CONF_LOCAL 是否变化的最短间隔（秒）
+ZONE_CONFIG_CHECK_INTERVAL = 2
+ZONE_NAME = "uk.00-0.top"
 ZONE_FILE = "/etc/bind/db.uk.00-0.top"
 BACKUP_DIR = "/var/backups/dns_api"
 LOG_FILE = "/var/log/dns_api.log"
-SOA_PATTERN = r'(\s+\d+\s*;\s*serial)'
+SOA_PATTERN = re.compile(r'(\s+\d+\s*;\s*serial)', re.I)
+SERIAL_LINE_PATTERN = re.compile(r'(^|\s)(\d+)(\s*;\s*serial)', re.I)
+DOMAIN_PATTERN = re.compile(r'^[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?)*$')
+MAX_BATCH_CHANGES = 1000
+# list_domains 带过滤或分页参数时每页的最大记录数，以及流式输出时每次发送的记录数
+MAX_LIST_LIMIT = 10000
+LIST_STREAM_BATCH = 500
+# 单个请求的最大字节数，分帧模式下每个连接最多同时排队的请求数，以及连接空闲超时（秒）
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+PIPELINE_DEPTH = 256
+CONNECTION_IDLE_TIMEOUT = 300
+# 服务器引擎: "threaded"（每个连接一个线程）或 "asyncio"（有界线程池 + 背压）
+SERVER_ENGINE = "threaded"
+# asyncio 引擎：同时执行的请求数、额外允许排队的请求数（超出立即返回繁忙）、线程池大小、关闭时的等待时间（秒）
+# 同时执行的请求数不会超过线程池大小
+MAX_INFLIGHT_REQUESTS = 16
+MAX_QUEUED_REQUESTS = 256
+EXECUTOR_WORKERS = 16
+SHUTDOWN_TIMEOUT = 30
+# 工作进程数：大于 1 时主进程只做监管，预先派生多个工作进程，它们通过 SO_REUSEPORT 绑定同一端口，
+# 由内核分配新连接；崩溃的工作进程会被重新派生。同一区域的变更通过 BACKUP_DIR/locks 下的文件锁
+# 在进程间串行化，每次提交都在锁内读取最新的区域文件（及其序列号）、变更日志和备份清单。
+# 多进程时限流额度按进程计算，指标端点依次使用 METRICS_PORT、METRICS_PORT+1……，
+# 日志文件不再按大小轮转（多个进程同时写入），请改用 logrotate 轮转 LOG_FILE
+WORKER_PROCESSES = 1
+# 工作进程连续在 WORKER_MIN_UPTIME 秒内退出时，重新派生的延迟从 1 秒起翻倍，最长 WORKER_RESTART_MAX_DELAY 秒
+WORKER_MIN_UPTIME = 10
+WORKER_RESTART_MAX_DELAY = 60
+# 按客户端 IP 的令牌桶限流：每类请求为 (每秒补充的令牌数, 桶容量)，RATE_LIMITS 为 None 时不限流。
+# 写请求包括所有变更动作和 rollback_to_serial，其余为读请求；RATE_LIMIT_ACTIONS 为单个动作另设额度
+# （与所属类别的额度同时生效）；RATE_LIMIT_EXEMPT 中的客户端地址不限流
+RATE_LIMITS = {"read": (100, 200), "write": (20, 100)}
+RATE_LIMIT_ACTIONS = {"rollback_to_serial": (0.2, 3)}
+RATE_LIMIT_EXEMPT = ()
+# 限流表最多保留的桶数，超过时清理已经补满（空闲）的桶
+RATE_LIMIT_MAX_BUCKETS = 100000
+# 组提交：调度空闲时立即提交；提交（写文件 + reload）进行期间到达的变更合并为下一批，只写一次文件、只 reload 一次。
+# 大于 0 时，上一次提交结束后不到该时长（秒）内开始的批次再等到期满，让持续写入攒成更大的批次（单个请求最多多等这么久）
+RELOAD_BATCH_WINDOW = 0
+# 预写日志 (WAL)：每批被接受的变更在改写区域文件之前先追加到 BACKUP_DIR/wal/<区域>.wal 并 fsync，
+# 同一批次的所有请求共用一次 fsync；区域文件、reload 和变更日志都完成后清空。
+# 服务启动时先重放其中尚未完成的批次，再检查区域文件。动态更新的区域不使用 WAL
+WAL_ENABLED = True
+# 为真时变更写入 WAL 后立即答复客户端，改写区域文件和 reload 随后进行（读请求仍会等到提交完成）；
+# 答复后提交失败的批次保留在 WAL 中，每 WAL_RETRY_INTERVAL 秒重试一次
+WAL_EARLY_ACK = False
+WAL_RETRY_INTERVAL = 5
+# 从节点模式：REPLICATION_PRIMARY 为主节点 API 的 (地址, 端口) 时，每 REPLICATION_INTERVAL 秒向主节点请求
+# 各区域的 changes_since，按主节点的序列号在本地提交增量（一次写入、一次 reload）；无法增量同步时
+# （主节点的日志已清理、区域被外部修改或按序列号恢复过，或本地区域与主节点不一致）整份复制区域内容。
+# 从节点拒绝客户端的变更和恢复请求。REPLICATION_ZONES 为要同步的区域名，None 表示本节点管理的全部区域；
+# 动态更新的区域不参与复制。多进程模式下由 0 号工作进程负责同步
+REPLICATION_PRIMARY = None
+REPLICATION_ZONES = None
+REPLICATION_INTERVAL = 1
+# 与主节点通信的超时（秒），连接失败后重试间隔从 REPLICATION_INTERVAL 起翻倍，最长 REPLICATION_RETRY_MAX_DELAY 秒
+REPLICATION_TIMEOUT = 30
+REPLICATION_RETRY_MAX_DELAY = 30
+# changes_since 每次最多返回的提交（变更日志条目）数
+CHANGES_SINCE_LIMIT = 1000
+# 按区域选择提交方式，未列出的区域使用重写区域文件 + rndc reload。
+# 例如改为 RFC 2136 动态更新（可选 TSIG）：
+# ZONE_BACKENDS = {
+#     "uk.00-0.top": {
+#         "backend": "ddns",
+#         "server": "127.0.0.1",
+#         "port": 53,
+#         "tsig_name": "dns-api-key",
+#         "tsig_secret": "base64密钥",
+#         "tsig_algorithm": "hmac-sha256",
+#         "ttl": 300,
+#     },
+# }
+ZONE_BACKENDS = {}
+# 按区域列出本地之外还要应用变更的 BIND 主机。每次提交在本地成功后并行发往所有目标，
+# 响应中的 targets 给出每个目标（本地为 "local"）的结果和耗时。目标类型：
+#   "rndc"：执行 rndc -s server -p port -k key_file <command> <区域>，command 默认 reload
+#           （区域文件在共享存储上），对从服务器可用 "refresh" 或 "retransfer"
+#   "ddns"：向 server:port 发送 DNS UPDATE（可选 TSIG，参数同 ZONE_BACKENDS），
+#           之前失败而落下的提交按变更日志补发
+# quorum 为请求成功所需的成功目标数（含本地），默认为全部。本地提交失败时不会发往其他目标；
+# 本地已提交但成功数不足 quorum 时请求返回失败，已提交的内容不会撤回，落下的目标在下一次提交时补齐
+# （落后目标的序列号保存在 BACKUP_DIR/targets/<区域>.json，各工作进程和重启之后共用）。
+# ZONE_TARGETS = {
+#     "uk.00-0.top": {
+#         "quorum": 2,
+#         "targets": [
+#             {"name": "ns2", "type": "rndc", "server": "10.0.0.2", "port": 953, "key_file": "/etc/bind/ns2.key"},
+#             {"name": "ns3", "type": "ddns", "server": "10.0.0.3", "port": 53,
+#              "tsig_name": "dns-api-key", "tsig_secret": "base64密钥", "ttl": 300},
+#         ],
+#     },
+# }
+ZONE_TARGETS = {}
+# 并行发往各目标的线程数，以及 rndc 命令的超时（秒）
+TARGET_WORKERS = 8
+TARGET_RNDC_TIMEOUT = 30
+# 记录存储: "zonefile"（直接解析和重写区域文件）或 "sqlite"（记录保存在 SQLITE_DB，区域文件由其生成）
+STORAGE_BACKEND = "zonefile"
+SQLITE_DB = "/var/lib/dns_api/records.db"
+# 区域文件变化监视: "auto"（优先 inotify，不可用时轮询）、"inotify"、"poll" 或 None（不监视）。
+# 使用 inotify 时缓存的区域模型不再在每次请求时 stat() 区域文件
+ZONE_WATCHER = "auto"
+# 轮询方式检查区域文件的间隔（秒）
+ZONE_WATCH_POLL_INTERVAL = 1
+# 变更日志每提交多少次生成一次完整快照
+SNAPSHOT_INTERVAL = 100
+# 备份库保留策略：快照和失败重载前的备份分别计数，超过任一上限时从最旧的开始清理（先清理备份，始终保留最新的快照）
+BACKUP_RETENTION_COUNT = 30
+BACKUP_RETENTION_DAYS = 30
+BACKUP_RETENTION_BYTES = 512 * 1024 * 1024
+# 日志: 格式 "json"（每行一个 JSON 对象）或 "text"，单个文件的最大字节数和保留的轮转文件数，
+# 日志队列长度（满时丢弃并计入 dns_api_log_dropped_total），以及成功请求的抽样比例（按动作）
+LOG_FORMAT = "json"
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_QUEUE_SIZE = 10000
+LOG_SAMPLE_RATES = {"list_domains": 0.01, "changes_since": 0.01}
+# 指标 HTTP 监听地址和端口（GET /metrics，Prometheus 文本格式），端口为 None 时不启用
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None
+# 耗时直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 提交前在内存中校验区域（SOA、重复记录、CNAME 冲突、标签长度、TTL 语法），不通过的变更不会写入文件
+VALIDATE_ZONE = True
+# A/AAAA 记录行（允许带 TTL）
+RECORD_PATTERN = re.compile(r'^([a-zA-Z0-9\-\.]+)\.\s+(?:\d+\s+)?IN\s+(A|AAAA)\s+([0-9a-fA-F\.:]+)')
+# API 管理的 TXT 记录行：只管理 _acme-challenge 名称上单个带引号字符串的记录，SPF/DKIM 等其他 TXT 记录不受影响。
+# 写入时使用 TXT_RECORD_TTL（ACME 令牌需要尽快生效和过期）
+TXT_RECORD_PATTERN = re.compile(r'^(_acme-challenge\.[a-zA-Z0-9_\-\.]+)\.\s+(?:\d+\s+)?IN\s+TXT\s+"([^"\\]*)"\s*$')
+TXT_RECORD_TTL = 60
+# TXT 记录的名称允许下划线（如 _acme-challenge），值为 1 到 255 个不含引号和反斜杠的可打印 ASCII 字符
+TXT_NAME_PATTERN = re.compile(r'^[a-zA-Z0-9_]([a-zA-Z0-9_\-]{0,61}[a-zA-Z0-9])?(\.[a-zA-Z0-9_]([a-zA-Z0-9_\-]{0,61}[a-zA-Z0-9])?)*$')
+TXT_VALUE_PATTERN = re.compile(r'^[\x20\x21\x23-\x5b\x5d-\x7e]{1,255}$')
+# TTL：纯秒数或 1w2d3h4m5s 形式
+TTL_PATTERN = re.compile(r'^(\d+|(\d+[wdhms])+)$', re.I)
 
 # 设置日志
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+class JsonLogFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，通过 extra 传入的字段（client/action/status 等）原样附加"""
+    
+    STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+    
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """按 LOG_SAMPLE_RATES 对成功的高频请求日志抽样，警告及以上级别始终保留"""
+    
+    def filter(self, record):
+        rate = LOG_SAMPLE_RATES.get(getattr(record, "action", None))
+        if rate is None or record.levelno >= logging.WARNING or getattr(record, "status", None) != "success":
+            return True
+        return random.random() < rate
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志并计数，请求线程永远不会因为写日志而阻塞"""
+    
+    def prepare(self, record):
+        # 与标准实现相同地预先格式化消息，但把异常堆栈单独保存在 exc_text 中，便于 JSON 输出
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("dns_api_log_dropped_total")
+
+def setup_logging(shared=False):
+    """
+    请求线程只把日志放入队列，由后台线程格式化并写入 LOG_FILE（按大小轮转）。
+    shared 为真时（多个工作进程写同一个文件）不按大小轮转，改用 WatchedFileHandler，
+    文件被 logrotate 移走后自动重新打开。
+    根日志器已有处理器时（例如被其他脚本导入并已配置日志）不做任何修改。
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    if LOG_FORMAT == "json":
+        formatter = JsonLogFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    if shared:
+        file_handler = logging.handlers.WatchedFileHandler(LOG_FILE, encoding="utf-8")
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES,
+                                                            backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    file_handler.setFormatter(formatter)
+    
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    root.addHandler(queue_handler)
+    root.setLevel(logging.INFO)
+    
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    # 退出前写完队列中剩余的日志
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
+
+def restart_logging(shared, stop_previous=True):
+    """
+    移除根日志器上的处理器并重新配置日志。派生工作进程前在监管进程中调用（stop_previous
+    写完原队列中的日志）；工作进程中调用时原后台线程并没有被带到子进程，不需要停止。
+    """
+    global log_listener
+    if log_listener is not None:
+        atexit.unregister(log_listener.stop)
+        if stop_previous:
+            log_listener.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    log_listener = setup_logging(shared)
+
+class Metrics:
+    """
+    进程内指标（计数器、仪表和直方图），以 Prometheus 文本格式输出。
+    标签以关键字参数传入，同一指标的标签名应保持一致。
+    """
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)
+        self._gauges = collections.defaultdict(float)
+        self._histograms = {}
+        self._collectors = []
+        self._help = {}
+        self._buckets = {}
+    
+    def describe(self, name, kind, text, buckets=None):
+        """登记指标说明；直方图可以指定自己的桶上限"""
+        self._help[name] = (kind, text)
+        if buckets is not None:
+            self._buckets[name] = buckets
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+    
+    def gauge_add(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] += value
+    
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self._buckets.get(name, self.buckets)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(buckets), 0, 0.0]
+            for i, bound in enumerate(buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+    
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+    
+    def add_collector(self, collector):
+        """注册在输出时调用的函数，返回 [(指标名, 标签字典, 值)]，用于按需计算的仪表"""
+        self._collectors.append(collector)
+    
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ""
+        escaped = []
+        for key, value in items:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{key}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+    
+    def render(self):
+        """生成 Prometheus 文本格式 (0.0.4)"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges[(name, tuple(sorted(labels.items())))] = value
+            except Exception as e:
+                logging.error(f"收集指标时出错: {str(e)}")
+        
+        lines = []
+        described = set()
+        def header(name, default_kind):
+            if name not in described:
+                described.add(name)
+                kind, text = self._help.get(name, (default_kind, name))
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+        
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{self._format_labels(labels)} {value:g}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{name}{self._format_labels(labels)} {value:g}")
+        for (name, labels), (counts, count, total) in sorted(histograms.items()):
+            header(name, "histogram")
+            for bound, bucket_count in zip(self._buckets.get(name, self.buckets), counts):
+                lines.append(f"{name}_bucket{self._format_labels(labels, [('le', f'{bound:g}')])} {bucket_count}")
+            lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics(LATENCY_BUCKETS)
+metrics.describe("dns_api_requests_total", "counter", "按动作和结果统计的请求数")
+metrics.describe("dns_api_request_duration_seconds", "histogram", "请求从分派到生成响应的耗时（含排队和合并提交等待）")
+metrics.describe("dns_api_rejected_requests_total", "counter", "因服务器繁忙被拒绝的请求数")
+metrics.describe("dns_api_inflight_requests", "gauge", "已分派但尚未生成响应的请求数")
+metrics.describe("dns_api_phase_duration_seconds", "histogram", "提交各阶段耗时: backup/read/parse/wal/serialize/write/reload/ddns/journal")
+metrics.describe("dns_api_lock_wait_seconds", "histogram", "等待区域读写锁 (read/write) 和跨进程文件锁 (process_read/process_write) 的时间")
+metrics.describe("dns_api_commit_batch_requests", "histogram", "每次合并提交包含的请求数",
+                 buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+metrics.describe("dns_api_zone_records", "gauge", "区域中托管的 A/AAAA 记录数")
+metrics.describe("dns_api_rate_limited_total", "counter", "超出限流额度而被拒绝的请求数（按读/写类别）")
+metrics.describe("dns_api_external_zone_edits_total", "counter", "检测到的区域文件外部修改次数")
+metrics.describe("dns_api_zone_edit_conflicts_total", "counter", "与 API 提交冲突的外部修改次数")
+metrics.describe("dns_api_validation_rejections_total", "counter", "提交前校验未通过而被拒绝的变更请求数")
+metrics.describe("dns_api_log_dropped_total", "counter", "日志队列已满而被丢弃的日志条数")
+metrics.describe("dns_api_wal_replayed_batches_total", "counter", "从 WAL 重放的未完成变更批次数")
+metrics.describe("dns_api_replication_applied_total", "counter", "从节点从主节点应用的提交数")
+metrics.describe("dns_api_replication_resyncs_total", "counter", "从节点整份复制区域内容的次数")
+metrics.describe("dns_api_target_duration_seconds", "histogram", "把提交应用到各 BIND 目标的耗时")
+metrics.describe("dns_api_target_failures_total", "counter", "应用到 BIND 目标失败的提交数")
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     allow_reuse_address = True
     daemon_threads = True
+    # 默认的 listen 队列只有 5，突发连接会触发 SYN 重传（约 1 秒延迟）
+    request_queue_size = 128
+
+class ReusePortTCPServer(ThreadedTCPServer):
+    """多进程模式下每个工作进程各自绑定同一端口 (SO_REUSEPORT)，由内核在进程间分配新连接"""
+    
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+def parse_oneshot_request(data, chunk):
+    """
+    一次性模式：判断已收到的数据是否已是完整的请求，返回 (是否读完, 已解析的请求)。
+    收到任意完整的 JSON 值即读完（不是对象时由 route_request 答复格式错误）。
+    jq 输出的多行 JSON 在传输中只会在末尾被截断，因此出错位置之后已经换行时判定为无效请求，
+    立即返回 (True, None)，不等对端关闭写端（nc 不会关闭）或连接超时。
+    chunk 为最近收到的数据块，只在其中有换行或数据以 } 结尾时才尝试解析。
+    """
+    if b"\n" not in chunk and not data.rstrip().endswith(b"}"):
+        return False, None
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # 末尾的多字节字符可能还没有收全，其他解码错误说明请求无效
+        return e.reason != "unexpected end of data", None
+    text = text.lstrip()
+    if not text:
+        return False, None
+    try:
+        return True, json.JSONDecoder().raw_decode(text)[0]
+    except json.JSONDecodeError as e:
+        return "\n" in text[e.pos:], None
+
+class DNSRequestHandler(socketserver.BaseRequestHandler):
+    """
+    支持两种连接方式：
+    1. 一次性模式（nc 等 shell 客户端）：发送一个 JSON，收到响应后连接关闭。
+    2. 分帧模式：每个请求/响应前加 4 字节大端长度（首字节必为 0，据此识别），
+       连接保持打开，可连续发送多个请求（流水线），响应按请求顺序返回。
+    """
+    
+    def handle(self):
+        client_ip = self.client_address[0]
+        logging.debug("接收来自 %s 的连接", client_ip)
+        self.request.settimeout(CONNECTION_IDLE_TIMEOUT)
+        
+        try:
+            first = self.request.recv(1, socket.MSG_PEEK)
+        except OSError as e:
+            logging.warning(f"读取 {client_ip} 的请求失败: {str(e)}")
+            return
+        if not first:
+            logging.warning(f"从 {client_ip} 接收到空数据")
+            return
+        
+        if first == b"\x00":
+            self._handle_framed(client_ip)
+        else:
+            self._handle_oneshot(client_ip)
+    
+    def _handle_oneshot(self, client_ip):
+        """一次性模式：读取一个完整的 JSON 请求，返回响应后关闭连接"""
+        try:
+            data, request = self._read_oneshot_request()
+            if not data.strip():
+                logging.warning(f"从 {client_ip} 接收到空数据")
+                return
+            if request is None:
+                if len(data) > MAX_REQUEST_SIZE:
+                    raise ValueError(f"请求超过 {MAX_REQUEST_SIZE} 字节")
+                request = json.loads(data.decode('utf-8'))
+            resp = dispatch_request(request, client_ip, allow_stream=True)()
+            
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            logging.error(f"从 {client_ip} 接收到无效的JSON数据")
+            resp = {"status": "error", "message": "无效的JSON格式"}
+            
+        except Exception as e:
+            logging.error(f"处理请求时发生错误: {str(e)}", exc_info=True)
+            resp = {"status": "error", "message": f"服务器错误: {str(e)}"}
+        
+        # 返回响应
+        try:
+            if isinstance(resp, StreamingResponse):
+                for chunk in resp.chunks():
+                    self.request.sendall(chunk)
+                logging.debug("已发送流式响应到 %s", client_ip)
+                return
+            self.request.sendall(json.dumps(resp, ensure_ascii=False).encode('utf-8'))
+            logging.debug("已发送响应到 %s: %s", client_ip, resp.get('status'))
+        except Exception as e:
+            logging.error(f"发送响应到 {client_ip} 时出错: {str(e)}")
+    
+    def _read_oneshot_request(self):
+        """
+        读取数据直到得到完整的 JSON、确定请求无效（见 parse_oneshot_request）或对端关闭写端，
+        返回 (原始数据, 已解析的请求或None)
+        """
+        data = b""
+        while len(data) <= MAX_REQUEST_SIZE:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+            done, request = parse_oneshot_request(data, chunk)
+            if done:
+                return data, request
+        return data, None
+    
+    def _handle_framed(self, client_ip):
+        """分帧模式：持续读取请求帧，交给写线程按顺序发送响应"""
+        responders = queue.Queue(maxsize=PIPELINE_DEPTH)
+        writer = threading.Thread(target=self._write_framed_responses, args=(responders, client_ip), daemon=True)
+        writer.start()
+        count = 0
+        try:
+            while True:
+                header = self.request.recv(4)
+                if not header:
+                    break
+                if len(header) < 4:
+                    header += recv_exact(self.request, 4 - len(header))
+                length = struct.unpack("!I", header)[0]
+                if length > MAX_REQUEST_SIZE:
+                    error = {"status": "error", "message": f"请求超过 {MAX_REQUEST_SIZE} 字节"}
+                    responders.put(lambda: error)
+                    break
+                
+                payload = recv_exact(self.request, length)
+                try:
+                    request = json.loads(payload.decode('utf-8'))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    logging.error(f"从 {client_ip} 接收到无效的JSON数据")
+                    request = None
+                
+                if isinstance(request, dict) and request.get("action") in MUTATION_ACTIONS:
+                    # 变更立即提交，与同一连接上相邻的变更合并为一个批次
+                    responders.put(dispatch_request(request, client_ip))
+                else:
+                    # 读请求等前面的请求全部完成后再执行，既能读到之前的写入，也不会读到之后的写入
+                    responders.join()
+                    resp = run_responder(dispatch_request(request, client_ip))
+                    responders.put(lambda: resp)
+                count += 1
+        except socket.timeout:
+            logging.info(f"{client_ip} 的连接空闲超时")
+        except (OSError, ConnectionError) as e:
+            logging.warning(f"读取 {client_ip} 的请求帧失败: {str(e)}")
+        finally:
+            responders.put(None)
+            writer.join()
+            logging.info(f"{client_ip} 的分帧连接已关闭，共处理 {count} 个请求")
+    
+    def _write_framed_responses(self, responders, client_ip):
+        """按请求顺序生成并发送响应帧"""
+        broken = False
+        while True:
+            responder = responders.get()
+            if responder is None:
+                responders.task_done()
+                return
+            resp = run_responder(responder)
+            if not broken:
+                body = json.dumps(resp, ensure_ascii=False).encode('utf-8')
+                try:
+                    self.request.sendall(struct.pack("!I", len(body)) + body)
+                except OSError as e:
+                    logging.error(f"发送响应到 {client_ip} 时出错: {str(e)}")
+                    broken = True
+            responders.task_done()
+
+# 单项变更动作与变更类型的对应关系
+SINGLE_CHANGE_ACTIONS = {
+    "add_domain": "add",
+    "delete_domain": "delete",
+    "update_domain": "update",
+    "upsert_domain": "upsert",
+}
+# TXT 记录的变更类型
+TXT_CHANGE_OPS = ("set_txt", "clear_txt")
+MUTATION_ACTIONS = set(SINGLE_CHANGE_ACTIONS) | {"apply_changes"} | set(TXT_CHANGE_OPS)
+
+# 从节点收到变更或恢复请求时的答复
+FOLLOWER_READ_ONLY_MESSAGE = "本节点是从节点，变更请提交到主节点"
+
+LIST_QUERY_KEYS = ("domain", "prefix", "suffix", "type", "ip", "cidr", "limit", "cursor", "stream")
+# 从节点可以重放的变更类型；变更日志中的其他记录（如 restore）需要整份同步
+REPLICABLE_OPS = set(SINGLE_CHANGE_ACTIONS.values()) | set(TXT_CHANGE_OPS)
+KNOWN_ACTIONS = MUTATION_ACTIONS | {"list_history", "rollback_to_serial", "list_domains", "changes_since"}
+
+class TokenBucketLimiter:
+    """令牌桶限流表：桶按键（客户端, 类别或动作）在首次使用时创建，补满后可以被清理"""
+    
+    def __init__(self, max_buckets):
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        # 键 -> [令牌数, 上次更新时间, 每秒补充的令牌数, 容量]
+        self._buckets = {}
+    
+    def take(self, limits):
+        """
+        limits 为 [(键, (每秒令牌数, 容量)), ...]，所有桶都有令牌时各取一个并返回 0，
+        否则不取令牌，返回需要等待的秒数
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            wait = 0
+            for key, (rate, burst) in limits:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = [burst, now, rate, burst]
+                else:
+                    bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                    bucket[1] = now
+                buckets.append((key, bucket))
+                if bucket[0] < 1:
+                    wait = max(wait, (1 - bucket[0]) / rate)
+            for key, bucket in buckets:
+                if not wait:
+                    bucket[0] -= 1
+                self._buckets[key] = bucket
+            if len(self._buckets) > self.max_buckets:
+                self._sweep(now)
+            return wait
+    
+    def _sweep(self, now):
+        """清理已经补满的桶（调用方需持有 _lock）"""
+        for key, (tokens, last, rate, burst) in list(self._buckets.items()):
+            if tokens + (now - last) * rate >= burst:
+                del self._buckets[key]
+
+rate_limiter = TokenBucketLimiter(RATE_LIMIT_MAX_BUCKETS)
+
+def admit_request(client_ip, action):
+    """按 RATE_LIMITS 检查客户端的请求额度，允许时返回 0，否则返回建议的重试等待秒数"""
+    if RATE_LIMITS is None or client_ip in RATE_LIMIT_EXEMPT:
+        return 0
+    kind = "write" if action in MUTATION_ACTIONS or action == "rollback_to_serial" else "read"
+    limits = []
+    if kind in RATE_LIMITS:
+        limits.append(((client_ip, kind), RATE_LIMITS[kind]))
+    if action in RATE_LIMIT_ACTIONS:
+        limits.append(((client_ip, action), RATE_LIMIT_ACTIONS[action]))
+    wait = rate_limiter.take(limits) if limits else 0
+    if wait:
+        metrics.inc("dns_api_rate_limited_total", kind=kind)
+        logging.debug("客户端 %s 的 %s 请求超出限流额度", client_ip, action)
+    return wait
+
+def request_zones(request):
+    """请求涉及的区域（按 zone、domain 或第一项变更的域名确定），无法确定时为全部区域"""
+    if isinstance(request, dict):
+        zone = None
+        if request.get("zone") is not None:
+            zone = zone_router.get(str(request["zone"]))
+        else:
+            items = request.get("changes") or request.get("records") or request.get("domains")
+            first = items[0] if isinstance(items, list) and items else request
+            domain = first.get("domain") if isinstance(first, dict) else first
+            if isinstance(domain, str):
+                zone = zone_router.route(domain)
+        if zone is not None:
+            return [zone]
+    return list(zone_router.zones().values())
+
+def dispatch_request(request, client_ip, allow_stream=False):
+    """
+    先做限流检查，再分派请求（见 route_request），并统计请求数、耗时和进行中的请求数。
+    没有带版本号的错误响应（参数校验失败、无效动作等）补上所涉及区域的版本号；
+    限流拒绝的响应不带版本号，以免超额请求也去读取区域。
+    """
+    action = request.get("action") if isinstance(request, dict) else None
+    label = action if action in KNOWN_ACTIONS else "invalid"
+    start = time.monotonic()
+    metrics.gauge_add("dns_api_inflight_requests", 1)
+    try:
+        retry_after = admit_request(client_ip, label)
+        if retry_after:
+            limited = {"status": "error", "message": "请求过于频繁，请稍后重试", "rate_limited": True,
+                       "retry_after": round(retry_after, 3)}
+            responder = lambda: limited
+        else:
+            responder = route_request(request, client_ip, allow_stream)
+    except BaseException:
+        metrics.gauge_add("dns_api_inflight_requests", -1)
+        raise
+    
+    def timed_responder():
+        status = "exception"
+        try:
+            resp = responder()
+            status = resp.status if isinstance(resp, StreamingResponse) else resp.get("status", "unknown")
+            if (status == "error" and not resp.get("rate_limited")
+                    and "version" not in resp and "versions" not in resp):
+                resp.update(zone_versions(request_zones(request)))
+            return resp
+        finally:
+            duration = time.monotonic() - start
+            metrics.gauge_add("dns_api_inflight_requests", -1)
+            metrics.inc("dns_api_requests_total", action=label, status=status)
+            metrics.observe("dns_api_request_duration_seconds", duration, action=label)
+            # 每个请求一条汇总日志，成功的高频请求由 SamplingFilter 抽样
+            logging.info("请求完成: %s %s %.1fms", label, status, duration * 1000,
+                         extra={"client": client_ip, "action": label, "status": status,
+                                "duration_ms": round(duration * 1000, 2)})
+    return timed_responder
+
+def route_request(request, client_ip, allow_stream=False):
+    """
+    解析一个请求并返回生成响应的函数。
+    allow_stream 为真时（一次性连接）list_domains 可以返回 StreamingResponse。
+    变更请求在这里就提交给所属区域的调度器（不等待结果），以便同一连接上
+    流水线发送的变更能合并进同一批次；读请求推迟到调用返回的函数时才执行。
+    按请求顺序调用这些函数即可保证同一连接内先写后读的顺序。
+    """
+    if not isinstance(request, dict):
+        return lambda: {"status": "error", "message": "无效的JSON格式"}
+    
+    action = request.get("action")
+    logging.debug("从 %s 接收到动作: %s", client_ip, action)
+    
+    if action in SINGLE_CHANGE_ACTIONS:
+        change = {"op": SINGLE_CHANGE_ACTIONS[action], "domain": request.get("domain"), "ip": request.get("ip")}
+        return submit_changes([change], batch=False, if_version=request.get("if_version"))
+    
+    if action == "apply_changes":
+        return submit_changes(request.get("changes"), batch=True, if_version=request.get("if_version"))
+    
+    if action in TXT_CHANGE_OPS:
+        changes, batch = build_txt_changes(request, action)
+        return submit_changes(changes, batch=batch, if_version=request.get("if_version"))
+    
+    if action == "list_history":
+        def history_response():
+            zone, msg = resolve_request_zone(request)
+            if zone is None:
+                return {"status": "error", "message": msg}
+            with zone.rwlock.read(), zone.process_lock.shared():
+                history = zone.journal.history(int(request.get("limit", 50)))
+                version = zone.store.snapshot().serial
+            return {"status": "success", "message": "获取变更历史成功", "zone": zone.name, "version": version,
+                    **history}
+        return history_response
+    
+    if action == "changes_since":
+        def changes_response():
+            zone, msg = resolve_request_zone(request)
+            if zone is None:
+                return {"status": "error", "message": msg}
+            return query_zone_changes(zone, request)
+        return changes_response
+    
+    if action == "rollback_to_serial":
+        def rollback_response():
+            if REPLICATION_PRIMARY is not None:
+                return {"status": "error", "message": FOLLOWER_READ_ONLY_MESSAGE}
+            zone, msg = resolve_request_zone(request)
+            if zone is None:
+                return {"status": "error", "message": msg}
+            serial = request.get("serial")
+            if not isinstance(serial, int):
+                return {"status": "error", "message": "serial 必须是整数"}
+            result, msg = restore_zone_to_serial(zone, serial)
+            return {"status": "success" if result else "error", "message": msg, **zone_versions([zone])}
+        return rollback_response
+    
+    if action == "list_domains":
+        def list_response():
+            if any(key in request for key in LIST_QUERY_KEYS):
+                return query_domain_records(request, allow_stream)
+            if request.get("zone") is not None and zone_router.get(str(request["zone"])) is None:
+                return {"status": "error", "message": f"未管理区域 {request['zone']}"}
+            result, resp_data, versions = list_domain_records(request.get("zone"))
+            msg = "获取域名列表成功" if result else "获取域名列表失败"
+            resp = {"status": "success" if result else "error", "message": msg}
+            if result:
+                resp["domains"] = resp_data
+                resp.update(versions)
+            return resp
+        return list_response
+    
+    logging.warning(f"从 {client_ip} 接收到无效动作: {action}")
+    return lambda: {"status": "error", "message": "无效的操作类型"}
+
+def resolve_request_zone(request):
+    """按请求中的 zone 字段查找区域；只管理一个区域时可以省略，返回 (区域, 错误消息)"""
+    zones = zone_router.zones()
+    name = request.get("zone")
+    if name is None:
+        if len(zones) == 1:
+            return next(iter(zones.values())), None
+        return None, "管理多个区域时必须指定 zone"
+    zone = zones.get(str(name).lower().rstrip("."))
+    if zone is None:
+        return None, f"未管理区域 {name}"
+    return zone, None
+
+def build_txt_changes(request, op):
+    """
+    把 set_txt/clear_txt 请求转换为变更列表，返回 (变更列表, 是否批量)。
+    单条形式为 {"domain", "value" 或 "values"}，批量形式为 {"records": [{"domain", "value" 或 "values"}, ...]}，
+    clear_txt 还可以用 {"domains": [...]}。同一名称的多个值（例如通配符证书和主域名的两个令牌）
+    合并为一个 TXT 记录集；set_txt 替换该名称原有的全部 TXT 记录。格式无效时变更列表为 None。
+    """
+    batch = "records" in request or "domains" in request
+    if op == "clear_txt" and "domains" in request:
+        if not isinstance(request["domains"], list):
+            return None, batch
+        items = [{"domain": domain} for domain in request["domains"]]
+    else:
+        items = request.get("records") if batch else [request]
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            return None, batch
+    
+    merged = {}
+    for item in items:
+        domain = item.get("domain")
+        key = domain.lower().rstrip(".") if isinstance(domain, str) else domain
+        change = merged.setdefault(key, {"op": op, "domain": domain})
+        if op == "set_txt":
+            values = item["values"] if isinstance(item.get("values"), list) else [item.get("value")]
+            change.setdefault("values", [])
+            change["values"].extend(value for value in values if value not in change["values"])
+    return list(merged.values()), batch
+
+def validate_change(change):
+    """验证一项变更的域名、IP 或 TXT 值，返回错误消息，验证通过时返回None"""
+    if not change.get("domain"):
+        return "域名为空"
+    if change.get("op") not in TXT_CHANGE_OPS:
+        return validate_domain_and_ip(change.get("domain"), change.get("ip"))
+    if not isinstance(change["domain"], str) or not TXT_NAME_PATTERN.match(change["domain"]):
+        return "无效的域名格式"
+    if not change["domain"].startswith("_acme-challenge."):
+        return "TXT 记录只能设置在 _acme-challenge. 开头的名称上"
+    if change["op"] == "set_txt":
+        values = change.get("values")
+        if not isinstance(values, list) or not values:
+            return "TXT 值为空"
+        if any(not isinstance(value, str) or not TXT_VALUE_PATTERN.match(value) for value in values):
+            return "无效的 TXT 值（1 到 255 个可打印 ASCII 字符，不能包含引号和反斜杠）"
+    return None
+
+def zone_versions(zones):
+    """
+    响应中的版本号（区域的SOA序列号）：涉及一个区域时为 {"version": 序列号}，
+    多个区域时为 {"versions": {区域: 序列号}}。
+    """
+    versions = {}
+    for zone in zones:
+        with zone.rwlock.read():
+            versions[zone.name] = zone.store.snapshot().serial
+    if len(versions) == 1:
+        return {"version": next(iter(versions.values()))}
+    return {"versions": versions}
+
+def run_responder(responder):
+    """调用 dispatch_request 返回的函数，异常转换为错误响应"""
+    try:
+        return responder()
+    except Exception as e:
+        logging.error(f"处理请求时发生错误: {str(e)}", exc_info=True)
+        return {"status": "error", "message": f"服务器错误: {str(e)}"}
+
+def submit_changes(changes, batch, if_version=None):
+    """
+    验证一组变更并提交给所属区域的调度器，返回等待结果并生成响应的函数。
+    if_version 不为空时，只有区域当前版本（SOA序列号）与之相同才执行这组变更。
+    """
+    def error(msg, index=None):
+        resp = {"status": "error", "message": msg}
+        if index is not None:
+            resp["failed_index"] = index
+        return lambda: resp
+    
+    if REPLICATION_PRIMARY is not None:
+        return error(FOLLOWER_READ_ONLY_MESSAGE)
+    if not isinstance(changes, list) or not changes:
+        return error("changes 必须是非空列表")
+    if len(changes) > MAX_BATCH_CHANGES:
+        return error(f"单次最多提交 {MAX_BATCH_CHANGES} 项变更")
+    if if_version is not None and (not isinstance(if_version, int) or isinstance(if_version, bool)):
+        return error("if_version 必须是整数")
+    
+    zone = None
+    for i, change in enumerate(changes):
+        if not isinstance(change, dict):
+            return error(f"第 {i + 1} 项变更格式无效", i)
+        msg = validate_change(change)
+        if not msg:
+            change_zone = zone_router.route(change["domain"])
+            if change_zone is None:
+                msg = f"域名 {change['domain']} 不属于本服务器管理的任何区域"
+            elif zone is not None and change_zone is not zone:
+                msg = "同一批变更必须属于同一个区域，请按区域分别提交"
+            zone = change_zone
+        if msg:
+            return error(f"第 {i + 1} 项变更失败: {msg}", i) if batch else error(msg)
+    
+    ticket = zone.scheduler.submit_async(changes, if_version)
+    
+    def response():
+        result, msg, details = ticket.wait()
+        resp = {"status": "success" if result else "error", "message": msg}
+        if batch and result:
+            resp["results"] = details
+        elif batch and details is not None:
+            resp["failed_index"] = details
+        if ticket.version is not None:
+            resp["version"] = ticket.version
+        if ticket.targets is not None:
+            resp["targets"] = ticket.targets
+        return resp
+    return response
+
+class AsyncDNSAPIServer:
+    """
+    基于 asyncio 的服务器引擎，与 DNSRequestHandler 使用相同的协议和 dispatch_request。
+    请求的分派（区域路由、区域上下文的创建）和阻塞的区域文件读写、rndc 调用都在有界线程池中执行，
+    事件循环线程只做网络读写；同时执行的请求数受 max_inflight（不超过线程池大小）限制，
+    排队的请求超过 max_queued 时立即返回"服务器繁忙"。
+    收到 SIGTERM/SIGINT 后停止接受新连接，等待进行中的请求完成后退出。
+    reuse_port 为真时以 SO_REUSEPORT 绑定，供多进程模式的各工作进程共享端口。
+    """
+    
+    def __init__(self, host, port, max_inflight=MAX_INFLIGHT_REQUESTS,
+                 max_queued=MAX_QUEUED_REQUESTS, workers=EXECUTOR_WORKERS, reuse_port=False):
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.max_inflight = min(max_inflight, workers)
+        self.max_queued = max_queued
+        self.workers = workers
+        self._admitted = 0
+        self._connections = set()
+    
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="dns-api")
+        self._semaphore = asyncio.Semaphore(self.max_inflight)
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        
+        server = await asyncio.start_server(self._handle_connection, self.host or None, self.port, backlog=128,
+                                            reuse_port=self.reuse_port or None)
+        logging.info(f"DNS API Server (asyncio) 正在端口 {self.port} 监听...")
+        print(f"DNS API Server (asyncio) 正在端口 {self.port} 监听...")
+        try:
+            await stop.wait()
+        finally:
+            await self._shutdown(server)
+    
+    async def _shutdown(self, server):
+        logging.info("服务器正在关闭，等待进行中的请求完成...")
+        print("服务器正在关闭...")
+        server.close()
+        await server.wait_closed()
+        
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        while self._admitted and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in list(self._connections):
+            task.cancel()
+        if self._connections:
+            await asyncio.gather(*self._connections, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        logging.info("服务器已关闭")
+    
+    async def _submit(self, request, client_ip, allow_stream=False):
+        """准入控制后在线程池中分派请求，分派完成后返回响应的 Future"""
+        loop = asyncio.get_running_loop()
+        if self._admitted >= self.max_inflight + self.max_queued:
+            logging.warning(f"请求过多，拒绝来自 {client_ip} 的请求")
+            metrics.inc("dns_api_rejected_requests_total")
+            future = loop.create_future()
+            future.set_result({"status": "error", "message": "服务器繁忙，请稍后重试", "busy": True})
+            return future
+        self._admitted += 1
+        try:
+            # 变更在分派时提交给区域的调度器；调用方等分派完成后才读取下一个请求，保持与读取顺序一致
+            responder = await loop.run_in_executor(self._executor, dispatch_request, request, client_ip,
+                                                   allow_stream)
+        except BaseException:
+            self._admitted -= 1
+            raise
+        return asyncio.ensure_future(self._run(responder))
+    
+    async def _run(self, responder):
+        try:
+            async with self._semaphore:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, run_responder, responder)
+        finally:
+            self._admitted -= 1
+    
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        client_ip = writer.get_extra_info("peername")[0]
+        logging.debug("接收来自 %s 的连接", client_ip)
+        try:
+            first = await asyncio.wait_for(reader.read(1), CONNECTION_IDLE_TIMEOUT)
+            if not first:
+                logging.warning(f"从 {client_ip} 接收到空数据")
+            elif first == b"\x00":
+                await self._handle_framed(reader, writer, client_ip, first)
+            else:
+                await self._handle_oneshot(reader, writer, client_ip, first)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError) as e:
+            logging.info(f"{client_ip} 的连接已结束: {type(e).__name__}")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+    
+    async def _handle_oneshot(self, reader, writer, client_ip, data):
+        """一次性模式：读取一个完整的 JSON 请求，返回响应后关闭连接"""
+        done, request = parse_oneshot_request(data, data)
+        while not done and len(data) <= MAX_REQUEST_SIZE:
+            chunk = await asyncio.wait_for(reader.read(65536), CONNECTION_IDLE_TIMEOUT)
+            if not chunk:
+                break
+            data += chunk
+            done, request = parse_oneshot_request(data, chunk)
+        
+        if request is None and not data.strip():
+            logging.warning(f"从 {client_ip} 接收到空数据")
+            return
+        try:
+            if request is None:
+                if len(data) > MAX_REQUEST_SIZE:
+                    raise ValueError(f"请求超过 {MAX_REQUEST_SIZE} 字节")
+                request = json.loads(data.decode('utf-8'))
+            resp = await (await self._submit(request, client_ip, allow_stream=True))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            logging.error(f"从 {client_ip} 接收到无效的JSON数据")
+            resp = {"status": "error", "message": "无效的JSON格式"}
+        except Exception as e:
+            logging.error(f"处理请求时发生错误: {str(e)}", exc_info=True)
+            resp = {"status": "error", "message": f"服务器错误: {str(e)}"}
+        
+        if isinstance(resp, StreamingResponse):
+            await self._send_stream(resp, writer)
+            logging.debug("已发送流式响应到 %s", client_ip)
+            return
+        writer.write(json.dumps(resp, ensure_ascii=False).encode('utf-8'))
+        await writer.drain()
+        logging.debug("已发送响应到 %s: %s", client_ip, resp.get('status'))
+    
+    async def _send_stream(self, resp, writer):
+        """在线程池中读取记录并逐批发送，等待每批写出后再读取下一批"""
+        loop = asyncio.get_running_loop()
+        
+        async def send(chunk):
+            writer.write(chunk)
+            await writer.drain()
+        
+        def pump():
+            chunks = resp.chunks()
+            try:
+                for chunk in chunks:
+                    asyncio.run_coroutine_threadsafe(send(chunk), loop).result()
+            finally:
+                chunks.close()
+        
+        await loop.run_in_executor(self._executor, pump)
+    
+    async def _handle_framed(self, reader, writer, client_ip, first):
+        """分帧模式：与线程版相同的流水线语义，响应由写任务按请求顺序发送"""
+        responses = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+        sender = asyncio.ensure_future(self._write_framed_responses(responses, writer, client_ip))
+        header = first
+        try:
+            while True:
+                if header is None:
+                    header = await asyncio.wait_for(reader.read(1), CONNECTION_IDLE_TIMEOUT)
+                    if not header:
+                        break
+                header += await reader.readexactly(4 - len(header))
+                length = struct.unpack("!I", header)[0]
+                header = None
+                if length > MAX_REQUEST_SIZE:
+                    future = asyncio.get_running_loop().create_future()
+                    future.set_result({"status": "error", "message": f"请求超过 {MAX_REQUEST_SIZE} 字节"})
+                    await responses.put(future)
+                    break
+                
+                payload = await reader.readexactly(length)
+                try:
+                    request = json.loads(payload.decode('utf-8'))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    logging.error(f"从 {client_ip} 接收到无效的JSON数据")
+                    request = None
+                
+                if isinstance(request, dict) and request.get("action") in MUTATION_ACTIONS:
+                    await responses.put(await self._submit(request, client_ip))
+                else:
+                    # 读请求等前面的请求全部完成后再执行
+                    await responses.join()
+                    future = await self._submit(request, client_ip)
+                    await asyncio.wait([future])
+                    await responses.put(future)
+        finally:
+            await responses.put(None)
+            await sender
+    
+    async def _write_framed_responses(self, responses, writer, client_ip):
+        broken = False
+        while True:
+            future = await responses.get()
+            if future is None:
+                responses.task_done()
+                return
+            try:
+                resp = await future
+            except Exception as e:
+                logging.error(f"处理请求时发生错误: {str(e)}", exc_info=True)
+                resp = {"status": "error", "message": f"服务器错误: {str(e)}"}
+            if not broken:
+                body = json.dumps(resp, ensure_ascii=False).encode('utf-8')
+                try:
+                    writer.write(struct.pack("!I", len(body)) + body)
+                    await writer.drain()
+                except ConnectionError as e:
+                    logging.error(f"发送响应到 {client_ip} 时出错: {str(e)}")
+                    broken = True
+            responses.task_done()
+
+def validate_domain_and_ip(domain=None, ip=None):
+    """验证域名和IP格式，返回错误消息，验证通过时返回None"""
+    # 验证域名
+    if domain is not None:
+        if not isinstance(domain, str) or not DOMAIN_PATTERN.match(domain):
+            return "无效的域名格式"
+    
+    # 验证IP地址
+    if ip is not None:
+        try:
+            ipaddress.ip_address(ip)
+        except ValueError:
+            return "无效的IP地址格式"
+    return None
+
+def ensure_backup_dir():
+    """确保备份目录存在"""
+    if not os.path.exists(BACKUP_DIR):
+        os.makedirs(BACKUP_DIR)
+
+def backup_zone_file(zone):
+    """把区域文件的当前内容存入备份库，成功时返回内容哈希，失败时返回None"""
+    try:
+        with metrics.timer("dns_api_phase_duration_seconds", phase="backup"), open(zone.path, "r") as f:
+            entry = zone.backups.put(f.read(), kind="backup")
+        logging.info(f"已创建区域文件备份: {entry['hash']}")
+        return entry["hash"]
+    except Exception as e:
+        logging.error(f"备份区域文件失败: {str(e)}")
+        return None
+
+def write_file_atomic(path, content):
+    """先写入同目录下的临时文件并 fsync，再重命名覆盖目标文件（content 可以是 str 或 bytes）"""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb" if isinstance(content, bytes) else "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        # 保留原文件的权限和属主（mkstemp 创建的文件为 0600，named 可能无法读取）
+        try:
+            st = os.stat(path)
+            os.chmod(tmp_path, st.st_mode & 0o7777)
+            os.chown(tmp_path, st.st_uid, st.st_gid)
+        except FileNotFoundError:
+            pass
+        except PermissionError as e:
+            logging.warning(f"无法保留 {path} 的属主: {str(e)}")
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    
+    # 确保重命名本身落盘
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def next_soa_serial(old_serial):
+    """根据旧序列号计算新的SOA序列号"""
+    # 使用当前日期作为序列号前缀 (YYYYMMDD)
+    today = datetime.now().strftime("%Y%m%d")
+    today_prefix = int(today) * 100
+    
+    # 如果当前序列号的前缀已经是今天的日期（或更晚），则递增；序列号是历史记录的键，不能回退
+    return max(old_serial + 1, today_prefix + 1)
+
+def update_soa_serial(content):
+    """更新SOA序列号"""
+    def replace_serial(match):
+        serial_part = match.group(1).strip()
+        old_serial = int(re.search(r'\d+', serial_part).group())
+        return match.group(1).replace(str(old_serial), str(next_soa_serial(old_serial)), 1)
+    
+    return SOA_PATTERN.sub(replace_serial, content)
+
+def reload_bind(zone_name=None):
+    """重新加载BIND配置；指定区域时只重新加载该区域"""
+    try:
+        ret = subprocess.run(["rndc", "reload"] + ([zone_name] if zone_name else []), capture_output=True, text=True)
+        if ret.returncode != 0:
+            logging.error(f"rndc reload 失败: {ret.stderr}")
+            return False, ret.stderr
+        return True, "BIND配置已重新加载"
+    except Exception as e:
+        logging.error(f"执行rndc reload时出错: {str(e)}")
+        return False, str(e)
+
+def sync_dynamic_zone(zone_name):
+    """让 named 把动态更新的日志（.jnl）写回区域文件，使随后解析到的是最新内容；失败时只记录警告"""
+    try:
+        ret = subprocess.run(["rndc", "sync", zone_name], capture_output=True, text=True)
+        if ret.returncode != 0:
+            logging.warning(f"rndc sync {zone_name} 失败，区域文件可能落后于 named: {ret.stderr.strip()}")
+    except Exception as e:
+        logging.warning(f"执行 rndc sync {zone_name} 时出错，区域文件可能落后于 named: {str(e)}")
+
+def get_record_type(ip):
+    """根据IP地址确定记录类型"""
+    try:
+        addr = ipaddress.ip_address(ip)
+        return "AAAA" if isinstance(addr, ipaddress.IPv6Address) else "A"
+    except ValueError:
+        return "A"  # 默认返回A记录类型
+
+def format_txt_line(domain, value):
+    """生成一行 API 管理的 TXT 记录"""
+    return f'{domain}.   {TXT_RECORD_TTL}  IN  TXT     "{value}"\n'
+
+def is_managed_line(line):
+    """由 API 管理的记录行（A/AAAA 和单个字符串的 TXT）"""
+    return bool(RECORD_PATTERN.match(line) or TXT_RECORD_PATTERN.match(line))
+
+class ZoneModel:
+    """
+    区域文件的内存模型：保留原始行，并按域名索引 A/AAAA 记录。
+    
+    模型按写时复制使用：缓存中的实例只读，修改前先 copy()，
+    因此读请求可以直接使用缓存实例而无需加锁。
+    """
+    
+    def __init__(self, lines):
+        self.lines = lines
+        # 小写域名 -> ((行号, 域名, 类型, IP), ...)
+        self.index = {}
+        # 小写域名 -> ((行号, 域名, TXT 值), ...)
+        self.txt_index = {}
+        self.serial_line = None
+        self.default_ttl = None
+        self.tombstones = 0
+        self._listing = None
+        self._sorted = None
+        self._facts = None
+        
+        for i, line in enumerate(lines):
+            match = RECORD_PATTERN.match(line)
+            if match:
+                name, record_type, ip = match.groups()
+                key = name.lower()
+                self.index[key] = self.index.get(key, ()) + ((i, name, record_type, ip),)
+                continue
+            match = TXT_RECORD_PATTERN.match(line)
+            if match:
+                name, value = match.groups()
+                key = name.lower()
+                self.txt_index[key] = self.txt_index.get(key, ()) + ((i, name, value),)
+            elif self.serial_line is None and SERIAL_LINE_PATTERN.search(line):
+                self.serial_line = i
+            elif self.default_ttl is None and line.startswith("$TTL"):
+                ttl = line.split()[1:2]
+                if ttl and ttl[0].isdigit():
+                    self.default_ttl = int(ttl[0])
+    
+    def copy(self):
+        """复制一份可修改的模型（行列表和索引为浅拷贝）"""
+        clone = ZoneModel.__new__(ZoneModel)
+        clone.lines = list(self.lines)
+        clone.index = dict(self.index)
+        clone.txt_index = dict(self.txt_index)
+        clone.serial_line = self.serial_line
+        clone.default_ttl = self.default_ttl
+        clone.tombstones = self.tombstones
+        clone._listing = None
+        clone._sorted = None
+        # API 只修改托管记录和序列号，非托管内容不变，校验用的信息可以沿用
+        clone._facts = self._facts
+        if clone.tombstones > 1024 and clone.tombstones * 4 > len(clone.lines):
+            clone._compact()
+        return clone
+    
+    def savepoint(self):
+        """保存当前状态，配合 rollback_to 撤销之后的修改"""
+        return self.copy()
+    
+    def rollback_to(self, savepoint):
+        """恢复到 savepoint() 时的状态"""
+        self.__dict__.update(savepoint.__dict__)
+    
+    def _compact(self):
+        """清除已删除行留下的空位并重建行号"""
+        remap = {}
+        lines = []
+        for i, line in enumerate(self.lines):
+            if line is not None:
+                remap[i] = len(lines)
+                lines.append(line)
+        self.index = {
+            key: tuple((remap[i], name, record_type, ip) for i, name, record_type, ip in entries)
+            for key, entries in self.index.items()
+        }
+        self.txt_index = {
+            key: tuple((remap[i], name, value) for i, name, value in entries)
+            for key, entries in self.txt_index.items()
+        }
+        if self.serial_line is not None:
+            self.serial_line = remap[self.serial_line]
+        self.lines = lines
+        self.tombstones = 0
+    
+    def lookup(self, domain):
+        """查找域名的 A/AAAA 记录"""
+        return self.index.get(domain.lower(), ())
+    
+    def _append_line(self, line):
+        """追加一行到区域末尾"""
+        # 与原先 content.rstrip("\n") 的行为一致：去掉末尾空行
+        while self.lines and self.lines[-1] in (None, "\n"):
+            if self.lines.pop() is None:
+                self.tombstones -= 1
+        if self.lines and not self.lines[-1].endswith("\n"):
+            self.lines[-1] += "\n"
+        self.lines.append(line)
+    
+    def add_record(self, domain, record_type, ip):
+        """追加一条记录到区域末尾"""
+        self._append_line(f"{domain}.   IN  {record_type}     {ip}\n")
+        key = domain.lower()
+        self.index[key] = self.index.get(key, ()) + ((len(self.lines) - 1, domain, record_type, ip),)
+        self._listing = None
+        self._sorted = None
+    
+    def delete_records(self, domain):
+        """删除域名的所有 A/AAAA 记录，返回删除的条数"""
+        entries = self.index.pop(domain.lower(), ())
+        for i, _, _, _ in entries:
+            self.lines[i] = None
+        self.tombstones += len(entries)
+        self._listing = None
+        self._sorted = None
+        return len(entries)
+    
+    def update_records(self, domain, record_type, ip):
+        """将域名的 A/AAAA 记录替换为一条新记录，返回原有的条数"""
+        key = domain.lower()
+        entries = self.index.get(key, ())
+        if not entries:
+            return 0
+        first = entries[0][0]
+        self.lines[first] = f"{domain}.   IN  {record_type}     {ip}\n"
+        for i, _, _, _ in entries[1:]:
+            self.lines[i] = None
+        self.tombstones += len(entries) - 1
+        self.index[key] = ((first, domain, record_type, ip),)
+        self._listing = None
+        self._sorted = None
+        return len(entries)
+    
+    def lookup_txt(self, domain):
+        """查找域名的 TXT 记录值"""
+        return tuple(value for _, _, value in self.txt_index.get(domain.lower(), ()))
+    
+    def set_txt(self, domain, values):
+        """把域名的 TXT 记录替换为 values，返回原有的条数"""
+        removed = self.clear_txt(domain)
+        entries = []
+        for value in values:
+            self._append_line(format_txt_line(domain, value))
+            entries.append((len(self.lines) - 1, domain, value))
+        self.txt_index[domain.lower()] = tuple(entries)
+        return removed
+    
+    def clear_txt(self, domain):
+        """删除域名的所有 TXT 记录，返回删除的条数"""
+        entries = self.txt_index.pop(domain.lower(), ())
+        for i, _, _ in entries:
+            self.lines[i] = None
+        self.tombstones += len(entries)
+        return len(entries)
+    
+    def bump_serial(self, serial=None):
+        """递增SOA序列号（只改动序列号所在的行）；serial 不为空时直接使用该值（WAL 中预先确定的序列号）"""
+        if self.serial_line is None:
+            return
+        self.lines[self.serial_line] = SERIAL_LINE_PATTERN.sub(
+            lambda m: f"{m.group(1)}{serial or next_soa_serial(int(m.group(2)))}{m.group(3)}",
+            self.lines[self.serial_line],
+            count=1
+        )
+    
+    def record_count(self):
+        """托管的 A/AAAA 记录数"""
+        return len(self.list_records())
+    
+    @property
+    def serial(self):
+        """当前SOA序列号，找不到时为None"""
+        if self.serial_line is None:
+            return None
+        return int(SERIAL_LINE_PATTERN.search(self.lines[self.serial_line]).group(2))
+    
+    def set_serial(self, serial):
+        """把SOA序列号设置为指定值"""
+        if self.serial_line is None or serial is None:
+            return
+        self.lines[self.serial_line] = SERIAL_LINE_PATTERN.sub(
+            lambda m: f"{m.group(1)}{serial}{m.group(3)}", self.lines[self.serial_line], count=1)
+    
+    def load_from(self, model):
+        """用另一个模型的内容整体替换当前内容"""
+        self.__dict__.update(model.copy().__dict__)
+    
+    def render(self):
+        """生成区域文件内容"""
+        return "".join(line for line in self.lines if line is not None)
+    
+    def zone_facts(self, zone_name):
+        """非托管内容的校验信息（见 parse_zone_facts，结果按模型缓存）"""
+        if self._facts is None or self._facts.zone_name != zone_name:
+            self._facts = parse_zone_facts(
+                (line for line in self.lines if line is not None and not is_managed_line(line)), zone_name)
+        return self._facts
+    
+    def scan_records(self, domain=None, prefix=None, ip=None, after=None):
+        """
+        按 (小写域名, 类型, IP) 顺序产生 (小写域名, 类型, IP, 域名)，从 after 之后开始。
+        指定 domain 时只查该域名，指定 prefix 时二分定位到前缀起点；ip 由调用方过滤。
+        """
+        if domain is not None:
+            rows = sorted((domain.lower(), record_type, value, name)
+                          for _, name, record_type, value in self.index.get(domain.lower(), ()))
+            start = 0
+        else:
+            rows = self.sorted_records()
+            start = bisect.bisect_left(rows, (prefix,)) if prefix else 0
+        if after is not None:
+            # 同一 (域名, 类型, IP) 只会出现一次，用最大码点跳过 after 本身
+            start = max(start, bisect.bisect_right(rows, tuple(after) + (chr(0x10FFFF),)))
+        for row in itertools.islice(rows, start, None):
+            if prefix and not row[0].startswith(prefix):
+                break
+            yield row
+    
+    def sorted_records(self):
+        """按 (小写域名, 类型, IP) 排序的记录列表（结果按模型缓存）"""
+        if self._sorted is None:
+            self._sorted = sorted(
+                (key, record_type, ip, name)
+                for key, entries in self.index.items()
+                for _, name, record_type, ip in entries
+            )
+        return self._sorted
+    
+    def list_records(self):
+        """列出所有 A/AAAA 记录，按区域文件中的行顺序排列（结果按模型缓存）"""
+        if self._listing is None:
+            self._listing = [
+                {"domain": name, "type": record_type, "ip": ip}
+                for _, name, record_type, ip in sorted(
+                    entry for entries in self.index.values() for entry in entries)
+            ]
+        return self._listing
+
+class ReadWriteLock:
+    """读写锁：多个读者可以并行，写者独占；有写者等待时新的读者会让行，避免写者饿死"""
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+    
+    @contextmanager
+    def read(self):
+        start = time.monotonic()
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        metrics.observe("dns_api_lock_wait_seconds", time.monotonic() - start, mode="read")
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        start = time.monotonic()
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        metrics.observe("dns_api_lock_wait_seconds", time.monotonic() - start, mode="write")
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+class ZoneProcessLock:
+    """
+    跨进程的区域锁：锁文件上的 fcntl.flock，多个工作进程（或服务器实例）修改同一区域时互斥。
+    每次加锁都重新打开锁文件，同一进程内的不同线程之间也互斥。
+    调用方应先取得进程内的 ReadWriteLock 再取得本锁，两种锁的获取顺序在所有路径上一致。
+    """
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def _open(self):
+        try:
+            return os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            return os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    
+    @contextmanager
+    def _locked(self, operation, mode):
+        start = time.monotonic()
+        fd = self._open()
+        try:
+            fcntl.flock(fd, operation)
+            metrics.observe("dns_api_lock_wait_seconds", time.monotonic() - start, mode=mode)
+            yield
+        finally:
+            # 关闭描述符即释放锁
+            os.close(fd)
+    
+    def shared(self):
+        return self._locked(fcntl.LOCK_SH, "process_read")
+    
+    def exclusive(self):
+        return self._locked(fcntl.LOCK_EX, "process_write")
+
+class ZoneCache:
+    """
+    按 inode/mtime/size 校验的区域文件缓存，文件确实变化时才重新解析。
+    rwlock 保护区域文件本身：读请求持读锁，写入、重新加载和回滚持写锁，
+    因此读请求只会看到已经成功 reload 的内容。
+    """
+    
+    def __init__(self, path, zone_name=None):
+        self.path = path
+        self.zone_name = zone_name
+        self.rwlock = ReadWriteLock()
+        self._lock = threading.Lock()
+        self._model = None
+        self._signature = None
+        # 由 ZoneWatcher 设置：文件变化会被及时通知，get() 不必每次检查文件状态
+        self.watched = False
+    
+    def _stat_signature(self):
+        st = os.stat(self.path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    
+    def _load(self, signature):
+        """重新解析区域文件（调用方需持有 _lock）"""
+        with metrics.timer("dns_api_phase_duration_seconds", phase="parse"):
+            self._model = read_zone_model(self.path, self.zone_name)
+        self._signature = signature
+        logging.info(f"已重新解析区域文件 {self.path}，共 {len(self._model.index)} 个域名")
+    
+    def get(self):
+        """返回当前区域模型，文件被外部修改时重新解析"""
+        if self.watched:
+            model = self._model
+            if model is not None:
+                return model
+        signature = self._stat_signature()
+        with self._lock:
+            if self._model is None or signature != self._signature:
+                self._load(signature)
+            return self._model
+    
+    def refresh(self):
+        """检查文件是否变化，变化时重新解析，返回 (原模型, 当前模型)"""
+        signature = self._stat_signature()
+        with self._lock:
+            previous = self._model
+            if previous is None or signature != self._signature:
+                self._load(signature)
+            return previous, self._model
+    
+    def changed_on_disk(self):
+        """区域文件与缓存的模型不一致（缓存之后被外部修改或删除）时返回真"""
+        try:
+            signature = self._stat_signature()
+        except FileNotFoundError:
+            return True
+        with self._lock:
+            return self._signature is not None and signature != self._signature
+    
+    def store(self, model):
+        """在写入区域文件后记录新模型，避免下一次请求重新解析"""
+        signature = self._stat_signature()
+        with self._lock:
+            self._model = model
+            self._signature = signature
+    
+    def invalidate(self):
+        """丢弃缓存，下一次访问时重新解析"""
+        with self._lock:
+            self._model = None
+            self._signature = None
+
+class ZoneFileStore:
+    """以区域文件为准的存储：数据来自 ZoneCache 中的内存模型"""
+    
+    def __init__(self, cache):
+        self.cache = cache
+        self.rwlock = cache.rwlock
+    
+    def snapshot(self):
+        """返回只读视图（调用方需持有读锁）"""
+        return self.cache.get()
+    
+    def begin(self):
+        """
+        开始一次写事务，返回可修改的模型副本（调用方需持有写锁和跨进程锁）。
+        总是检查文件状态而不依赖监视：其他工作进程刚提交的内容也要作为本次修改的基础。
+        """
+        return self.cache.refresh()[1].copy()
+    
+    def end(self, model, committed):
+        """结束写事务：提交成功时把新模型放入缓存"""
+        if committed:
+            self.cache.store(model)
+
+def split_zone_model(model):
+    """把区域模型拆成模板（非托管行）和按原顺序排列的托管记录"""
+    records = [entry for entries in model.index.values() for entry in entries]
+    records += [(i, name, "TXT", value) for entries in model.txt_index.values() for i, name, value in entries]
+    records.sort()
+    record_lines = {entry[0] for entry in records}
+    template = "".join(line for i, line in enumerate(model.lines) if line is not None and i not in record_lines)
+    return template, records
+
+class SqliteZoneTransaction:
+    """
+    SQLite 存储上的读写视图，提供与 ZoneModel 相同的记录操作，
+    因此 apply_change_to_model 可以直接作用于它。
+    """
+    
+    def __init__(self, store, conn):
+        self.store = store
+        self.conn = conn
+        self._savepoints = 0
+        row = conn.execute("SELECT default_ttl FROM zones WHERE zone = ?", (store.zone_name,)).fetchone()
+        self.default_ttl = row[0] if row else None
+    
+    def lookup(self, domain):
+        return tuple(self.conn.execute(
+            "SELECT id, name, type, value FROM records "
+            "WHERE zone = ? AND name_key = ? AND type IN ('A', 'AAAA') ORDER BY id",
+            (self.store.zone_name, domain.lower())
+        ))
+    
+    def add_record(self, domain, record_type, ip):
+        self.conn.execute(
+            "INSERT INTO records (zone, name, name_key, type, value) VALUES (?, ?, ?, ?, ?)",
+            (self.store.zone_name, domain, domain.lower(), record_type, ip)
+        )
+    
+    def delete_records(self, domain):
+        return self.conn.execute(
+            "DELETE FROM records WHERE zone = ? AND name_key = ? AND type IN ('A', 'AAAA')",
+            (self.store.zone_name, domain.lower())
+        ).rowcount
+    
+    def update_records(self, domain, record_type, ip):
+        entries = self.lookup(domain)
+        if not entries:
+            return 0
+        self.conn.execute(
+            "UPDATE records SET name = ?, type = ?, value = ? WHERE id = ?",
+            (domain, record_type, ip, entries[0][0])
+        )
+        self.conn.executemany("DELETE FROM records WHERE id = ?", [(entry[0],) for entry in entries[1:]])
+        return len(entries)
+    
+    def lookup_txt(self, domain):
+        return tuple(value for (value,) in self.conn.execute(
+            "SELECT value FROM records WHERE zone = ? AND name_key = ? AND type = 'TXT' ORDER BY id",
+            (self.store.zone_name, domain.lower())
+        ))
+    
+    def set_txt(self, domain, values):
+        removed = self.clear_txt(domain)
+        self.conn.executemany(
+            "INSERT INTO records (zone, name, name_key, type, value) VALUES (?, ?, ?, 'TXT', ?)",
+            [(self.store.zone_name, domain, domain.lower(), value) for value in values]
+        )
+        return removed
+    
+    def clear_txt(self, domain):
+        return self.conn.execute(
+            "DELETE FROM records WHERE zone = ? AND name_key = ? AND type = 'TXT'",
+            (self.store.zone_name, domain.lower())
+        ).rowcount
+    
+    def _template(self):
+        return self.conn.execute("SELECT template FROM zones WHERE zone = ?", (self.store.zone_name,)).fetchone()[0]
+    
+    def bump_serial(self, serial=None):
+        template = SERIAL_LINE_PATTERN.sub(
+            lambda m: f"{m.group(1)}{serial or next_soa_serial(int(m.group(2)))}{m.group(3)}",
+            self._template(),
+            count=1
+        )
+        self.conn.execute("UPDATE zones SET template = ? WHERE zone = ?", (template, self.store.zone_name))
+    
+    def record_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM records WHERE zone = ? AND type IN ('A', 'AAAA')",
+                                 (self.store.zone_name,)).fetchone()[0]
+    
+    @property
+    def serial(self):
+        """当前SOA序列号，找不到时为None"""
+        match = SERIAL_LINE_PATTERN.search(self._template())
+        return int(match.group(2)) if match else None
+    
+    def load_from(self, model):
+        """用区域模型的内容整体替换该区域的模板和记录"""
+        template, records = split_zone_model(model)
+        self.conn.execute("UPDATE zones SET template = ?, default_ttl = ? WHERE zone = ?",
+                          (template, model.default_ttl, self.store.zone_name))
+        self.conn.execute("DELETE FROM records WHERE zone = ?", (self.store.zone_name,))
+        self.conn.executemany(
+            "INSERT INTO records (zone, name, name_key, type, value) VALUES (?, ?, ?, ?, ?)",
+            [(self.store.zone_name, name, name.lower(), record_type, ip) for _, name, record_type, ip in records]
+        )
+        self.default_ttl = model.default_ttl
+    
+    def zone_facts(self, zone_name):
+        """模板的校验信息，模板除序列号外未变化时沿用上次的结果"""
+        key = SERIAL_LINE_PATTERN.sub(r"\g<1>0\g<3>", self._template(), count=1)
+        cached = self.store.facts
+        if cached is None or cached[0] != key or cached[1].zone_name != zone_name:
+            cached = self.store.facts = (key, parse_zone_facts(key.splitlines(True), zone_name))
+        return cached[1]
+    
+    def render(self):
+        """由模板（SOA/NS 等非托管内容）和记录表生成区域文件"""
+        parts = [self._template().rstrip("\n") + "\n"]
+        for name, record_type, value in self.conn.execute(
+                "SELECT name, type, value FROM records WHERE zone = ? ORDER BY id", (self.store.zone_name,)):
+            if record_type == "TXT":
+                parts.append(format_txt_line(name, value))
+            else:
+                parts.append(f"{name}.   IN  {record_type}     {value}\n")
+        return "".join(parts)
+    
+    def list_records(self):
+        return [
+            {"domain": name, "type": record_type, "ip": value}
+            for name, record_type, value in self.conn.execute(
+                "SELECT name, type, value FROM records "
+                "WHERE zone = ? AND type IN ('A', 'AAAA') ORDER BY id",
+                (self.store.zone_name,))
+        ]
+    
+    def scan_records(self, domain=None, prefix=None, ip=None, after=None):
+        """与 ZoneModel.scan_records 相同，条件和游标由索引处理"""
+        sql = "SELECT name_key, type, value, name FROM records WHERE zone = ? AND type IN ('A', 'AAAA')"
+        params = [self.store.zone_name]
+        if domain is not None:
+            sql += " AND name_key = ?"
+            params.append(domain.lower())
+        if prefix:
+            sql += " AND name_key >= ? AND name_key < ?"
+            params += [prefix, prefix + chr(0x10FFFF)]
+        if ip is not None:
+            sql += " AND value = ?"
+            params.append(ip)
+        if after is not None:
+            sql += " AND (name_key, type, value) > (?, ?, ?)"
+            params += list(after)
+        cursor = self.conn.execute(sql + " ORDER BY name_key, type, value", params)
+        try:
+            while True:
+                rows = cursor.fetchmany(LIST_STREAM_BATCH)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+    
+    def savepoint(self):
+        self._savepoints += 1
+        name = f"sp{self._savepoints}"
+        self.conn.execute(f"SAVEPOINT {name}")
+        return name
+    
+    def rollback_to(self, savepoint):
+        self.conn.execute(f"ROLLBACK TO {savepoint}")
+
+class SqliteZoneStore:
+    """
+    以 SQLite 为准的存储：记录保存在带索引的表中，区域文件在每次提交时由
+    模板 + 记录表生成。首次使用时从现有区域文件导入（A/AAAA 记录入表，
+    其余内容作为模板）。之后对区域文件的手工修改会在下一次提交时被覆盖。
+    每个线程使用独立连接，WAL 模式下读请求不会被写事务阻塞。
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS zones (
+            zone TEXT PRIMARY KEY,
+            template TEXT NOT NULL,
+            default_ttl INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS records (
+            id INTEGER PRIMARY KEY,
+            zone TEXT NOT NULL,
+            name TEXT NOT NULL,
+            name_key TEXT NOT NULL,
+            type TEXT NOT NULL,
+            value TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS records_name ON records (zone, name_key, type);
+        CREATE INDEX IF NOT EXISTS records_value ON records (zone, value);
+    """
+    
+    def __init__(self, db_path, zone_name, zone_file):
+        self.db_path = db_path
+        self.zone_name = zone_name
+        self.zone_file = zone_file
+        self.rwlock = ReadWriteLock()
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        # (模板, ZoneFacts)，见 SqliteZoneTransaction.zone_facts
+        self.facts = None
+    
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        with self._init_lock:
+            if not self._initialized:
+                conn.executescript(self.SCHEMA)
+                self._import_zone_file(conn)
+                self._initialized = True
+        return conn
+    
+    def _import_zone_file(self, conn):
+        """区域尚未入库时，从区域文件导入"""
+        if conn.execute("SELECT 1 FROM zones WHERE zone = ?", (self.zone_name,)).fetchone():
+            return
+        model = read_zone_model(self.zone_file, self.zone_name)
+        template, records = split_zone_model(model)
+        
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO zones (zone, template, default_ttl) VALUES (?, ?, ?)",
+                         (self.zone_name, template, model.default_ttl))
+            conn.executemany(
+                "INSERT INTO records (zone, name, name_key, type, value) VALUES (?, ?, ?, ?, ?)",
+                [(self.zone_name, name, name.lower(), record_type, ip) for _, name, record_type, ip in records]
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        logging.info(f"已将区域文件 {self.zone_file} 导入 SQLite，共 {len(records)} 条记录")
+    
+    def snapshot(self):
+        """返回只读视图（调用方需持有读锁）"""
+        return SqliteZoneTransaction(self, self._connect())
+    
+    def begin(self):
+        """开始一次写事务（调用方需持有写锁）"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        return SqliteZoneTransaction(self, conn)
+    
+    def end(self, txn, committed):
+        """提交成功时 COMMIT，否则 ROLLBACK"""
+        txn.conn.execute("COMMIT" if committed else "ROLLBACK")
+
+def create_zone_store(zone_name, zone_file, cache):
+    """按 STORAGE_BACKEND 创建记录存储"""
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteZoneStore(SQLITE_DB, zone_name, zone_file)
+    return ZoneFileStore(cache)
+
+def restore_zone_content(zone, previous_content):
+    """把区域文件恢复为提交前的内容"""
+    backup_zone_file(zone)  # 先备份当前的错误文件
+    write_file_atomic(zone.path, previous_content)
+    zone.cache.invalidate()
+    logging.info(f"已将区域 {zone.name} 的文件恢复为提交前的内容")
+
+def commit_zone_model(zone, model, previous_content, serial=None):
+    """写入新的区域内容并重新加载BIND，失败时恢复提交前的内容（调用方需持有写锁）"""
+    # 更新SOA序列号
+    model.bump_serial(serial)
+    
+    # 生成并写入文件
+    with metrics.timer("dns_api_phase_duration_seconds", phase="serialize"):
+        content = model.render()
+    with metrics.timer("dns_api_phase_duration_seconds", phase="write"):
+        write_file_atomic(zone.path, content)
+    
+    # 重新加载BIND
+    with metrics.timer("dns_api_phase_duration_seconds", phase="reload"):
+        result, msg = reload_bind(zone.name)
+    if not result:
+        # 恢复提交前的内容
+        restore_zone_content(zone, previous_content)
+        return False, f"重新加载BIND失败: {msg}"
+    return True, msg
+
+class BackupStore:
+    """
+    按内容寻址的压缩备份库。
+    对象按 sha256 存为 objects/<前两位>/<哈希>.gz，相同内容只存一份；
+    清单 manifest/<区域>.json 按时间顺序记录每次备份（哈希、seq、序列号、类型、时间），
+    常驻内存，最新/上一个/按序列号查找都不需要列目录；清单文件被其他工作进程改写后重新读取。
+    每次写入后按类型分别按个数、天数和总字节数增量清理最旧的记录，并删除不再被引用的对象。
+    """
+    
+    def __init__(self, directory, zone_name, max_count, max_age_days, max_bytes):
+        self.object_dir = os.path.join(directory, "objects", zone_name)
+        self.manifest_path = os.path.join(directory, "manifest", f"{zone_name}.json")
+        self.max_count = max_count
+        self.max_age = max_age_days * 86400
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = None
+        self._signature = None
+    
+    def _load(self):
+        signature = file_signature(self.manifest_path)
+        if self._entries is not None and signature == self._signature:
+            return
+        os.makedirs(self.object_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        entries = []
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                entries = json.load(f)["entries"]
+        self._entries = collections.deque(entries)
+        self._refs = collections.Counter(entry["hash"] for entry in entries)
+        self._sizes = {entry["hash"]: entry["size"] for entry in entries}
+        self._by_serial = {entry["serial"]: entry for entry in entries}
+        self._bytes = sum(self._sizes.values())
+        self._signature = signature
+    
+    def _object_path(self, digest):
+        return os.path.join(self.object_dir, digest[:2], f"{digest}.gz")
+    
+    def _save_manifest(self):
+        write_file_atomic(self.manifest_path, json.dumps({"version": 1, "entries": list(self._entries)}))
+        self._signature = file_signature(self.manifest_path)
+    
+    def put(self, content, serial=None, seq=None, kind="snapshot"):
+        """保存一份区域内容，返回清单记录"""
+        data = content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._load()
+            path = self._object_path(digest)
+            if digest not in self._sizes and not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write_file_atomic(path, gzip.compress(data, mtime=0))
+            size = self._sizes.get(digest) or os.path.getsize(path)
+            
+            entry = {"hash": digest, "size": size, "serial": serial, "seq": seq, "kind": kind, "time": time.time()}
+            self._entries.append(entry)
+            if self._refs[digest] == 0:
+                self._sizes[digest] = size
+                self._bytes += size
+            self._refs[digest] += 1
+            if serial is not None:
+                self._by_serial[serial] = entry
+            self._enforce_retention()
+            self._save_manifest()
+        return entry
+    
+    def _enforce_retention(self):
+        """
+        按类型分别清理：快照和失败重载前的备份各自最多保留 max_count 份，超过天数的记录都清理；
+        总字节数超限时先清理备份，再清理最旧的快照。最新的快照始终保留（之后的变更日志从它重放），
+        因此 reload 持续失败时产生的备份不会挤掉按序列号恢复所需的快照。
+        """
+        now = time.time()
+        newest_snapshot = next((entry for entry in reversed(self._entries) if entry["kind"] == "snapshot"), None)
+        counts = collections.Counter(entry["kind"] for entry in self._entries)
+        for kind in ("backup", "snapshot"):
+            for entry in [entry for entry in self._entries if entry["kind"] == kind]:
+                if entry is newest_snapshot:
+                    break
+                if (counts[kind] <= self.max_count
+                        and now - entry["time"] <= self.max_age
+                        and self._bytes <= self.max_bytes):
+                    break
+                self._remove(entry)
+                counts[kind] -= 1
+    
+    def _remove(self, entry):
+        """删除一条记录，对象不再被引用时一并删除"""
+        self._entries.remove(entry)
+        if self._by_serial.get(entry["serial"]) is entry:
+            del self._by_serial[entry["serial"]]
+        digest = entry["hash"]
+        self._refs[digest] -= 1
+        if self._refs[digest] == 0:
+            del self._refs[digest]
+            self._bytes -= self._sizes.pop(digest)
+            try:
+                os.remove(self._object_path(digest))
+                os.rmdir(os.path.dirname(self._object_path(digest)))
+            except OSError:
+                pass  # 对象已不存在，或目录下还有其他对象
+            logging.info(f"已删除过期备份对象: {digest}")
+    
+    def read(self, entry):
+        """读取某条记录对应的区域内容"""
+        with open(self._object_path(entry["hash"]), "rb") as f:
+            return gzip.decompress(f.read()).decode("utf-8")
+    
+    def latest(self, kind=None):
+        """最新的记录（可按类型过滤），没有时返回None"""
+        with self._lock:
+            self._load()
+            for entry in reversed(self._entries):
+                if kind is None or entry["kind"] == kind:
+                    return entry
+        return None
+    
+    def previous(self, kind=None):
+        """倒数第二条记录（可按类型过滤），没有时返回None"""
+        with self._lock:
+            self._load()
+            found = 0
+            for entry in reversed(self._entries):
+                if kind is None or entry["kind"] == kind:
+                    found += 1
+                    if found == 2:
+                        return entry
+        return None
+    
+    def by_serial(self, serial):
+        """某个序列号最近一次的记录，没有时返回None"""
+        with self._lock:
+            self._load()
+            return self._by_serial.get(serial)
+    
+    def entries(self, kind=None):
+        """按时间顺序返回所有记录"""
+        with self._lock:
+            self._load()
+            return [entry for entry in self._entries if kind is None or entry["kind"] == kind]
+
+class ZoneJournal:
+    """
+    追加式变更日志 + 定期快照，代替每次变更前复制整个区域文件。
+    日志每行记录一次提交 {"seq", "serial", "time", "changes"}，写入量与变更大小成正比；
+    快照保存某次提交之后的完整区域内容，存放在 BackupStore 中。
+    任意序列号的内容 = 不晚于它的最近快照 + 重放其后的日志。
+    所有方法都应在持有区域写锁（读取历史时为读锁）和对应的跨进程锁时调用；
+    日志或备份清单被其他工作进程修改后，下一次使用时重新读取位置。
+    """
+    
+    def __init__(self, directory, zone_name, snapshot_interval, backups):
+        self.zone_name = zone_name
+        self.snapshot_interval = snapshot_interval
+        self.backups = backups
+        self.journal_path = os.path.join(directory, "journal", f"{zone_name}.jsonl")
+        self._signature = None
+        self.last_seq = 0
+        self.last_serial = None
+        self.last_snapshot_seq = None
+        self._trimmed_to = None
+    
+    def _disk_signature(self):
+        return file_signature(self.journal_path), file_signature(self.backups.manifest_path)
+    
+    def _load(self):
+        """首次使用时，或日志、备份清单在本进程之外被修改后，从日志末尾和备份清单恢复位置"""
+        signature = self._disk_signature()
+        if signature == self._signature:
+            return
+        os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+        self.last_seq, self.last_serial, self.last_snapshot_seq = 0, None, None
+        line = read_last_line(self.journal_path)
+        if line:
+            entry = json.loads(line)
+            self.last_seq, self.last_serial = entry["seq"], entry["serial"]
+        snapshot = self.backups.latest("snapshot")
+        if snapshot:
+            self.last_snapshot_seq = snapshot["seq"]
+            if snapshot["seq"] >= self.last_seq:
+                self.last_seq, self.last_serial = snapshot["seq"], snapshot["serial"]
+        self._signature = signature
+    
+    def committed_serial(self):
+        """最近一次经由日志提交（或建快照）时的区域序列号"""
+        self._load()
+        return self.last_serial
+    
+    def list_snapshots(self):
+        """返回 [(seq, serial, 清单记录)]，按 seq 升序，同一 seq 按写入先后"""
+        snapshots = [(entry["seq"], entry["serial"], entry) for entry in self.backups.entries("snapshot")]
+        return sorted(snapshots, key=lambda snap: snap[0])
+    
+    def _write_snapshot(self, seq, serial, content):
+        entry = self.backups.put(content, serial=serial, seq=seq)
+        self.last_snapshot_seq = seq
+        logging.info(f"已创建区域快照: seq={seq} serial={serial} {entry['hash'][:12]}")
+        self._trim_journal()
+    
+    def _trim_journal(self):
+        """丢弃最早快照之前的日志（快照被备份库清理后它们已无法重放）"""
+        snapshots = self.list_snapshots()
+        if not snapshots or snapshots[0][0] == self._trimmed_to:
+            return
+        oldest_seq = snapshots[0][0]
+        kept = [json.dumps(entry, ensure_ascii=False) + "\n" for entry in self.entries(after_seq=oldest_seq)]
+        write_file_atomic(self.journal_path, "".join(kept))
+        self._trimmed_to = oldest_seq
+    
+    def prepare(self, base_serial, render):
+        """提交前调用：区域在日志之外被修改过（或尚无日志）时，先为当前内容建快照"""
+        self._load()
+        if base_serial != self.last_serial:
+            self._write_snapshot(self.last_seq, base_serial, render())
+            self.last_serial = base_serial
+            self._signature = self._disk_signature()
+    
+    def append(self, serial, changes, render, force_snapshot=False):
+        """
+        提交成功后追加一条日志，每 snapshot_interval 次提交建一次快照。
+        render 为空时不建快照（一次提交中间批次的内容无法单独生成），留到下一条日志。
+        """
+        self._load()
+        seq = self.last_seq + 1
+        entry = {"seq": seq, "serial": serial, "time": datetime.now().isoformat(timespec="seconds"),
+                 "changes": changes}
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.last_seq, self.last_serial = seq, serial
+        
+        if render is not None and (force_snapshot or self.last_snapshot_seq is None
+                                   or seq - self.last_snapshot_seq >= self.snapshot_interval):
+            self._write_snapshot(seq, serial, render())
+        self._signature = self._disk_signature()
+    
+    def entries(self, after_seq=0):
+        """按顺序读取 seq 大于 after_seq 的日志"""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    if entry["seq"] > after_seq:
+                        yield entry
+    
+    def history(self, limit=50):
+        """最近的提交记录和可用快照"""
+        self._load()
+        recent = collections.deque(maxlen=limit)
+        for entry in self.entries():
+            recent.append({"seq": entry["seq"], "serial": entry["serial"], "time": entry["time"],
+                           "changes": len(entry["changes"])})
+        snapshots = [{"seq": seq, "serial": serial} for seq, serial, _ in self.list_snapshots()]
+        return {"commits": list(recent), "snapshots": snapshots}
+    
+    def _positions(self):
+        """
+        每个日志序号处区域最终的序列号：该序号的日志条目，被之后在同一序号建立的快照
+        （日志之外的修改或按序列号恢复）覆盖
+        """
+        positions = {entry["seq"]: entry["serial"] for entry in self.entries()}
+        for seq, serial, _ in self.list_snapshots():
+            positions[seq] = serial
+        return positions
+    
+    def changes_since(self, seq=None, serial=None, limit=CHANGES_SINCE_LIMIT):
+        """
+        返回给定位置（seq 为日志序号，serial 为区域序列号，可同时给出）之后的日志条目：
+        (条目列表, 应用这些条目后的序列号, 是否还有更多)。位置不在记录中（日志已被清理）、
+        之后紧接着日志之外的修改或恢复操作时条目列表为None，调用方需要整份同步。
+        """
+        self._load()
+        if serial is not None and serial == self.last_serial and seq in (None, self.last_seq):
+            # 已是最新，不必读取日志
+            return [], serial, False
+        positions = self._positions()
+        if seq is None:
+            matched = [position for position, value in positions.items() if value == serial]
+            if serial is None or not matched:
+                return None, None, False
+            seq = max(matched)
+        elif seq not in positions or (serial is not None and positions[seq] != serial):
+            return None, None, False
+        
+        entries = []
+        for entry in self.entries(after_seq=seq):
+            if (entry["seq"] != seq + len(entries) + 1
+                    or any(change.get("op") not in REPLICABLE_OPS for change in entry["changes"])):
+                break
+            entries.append(entry)
+            # 这次提交之后有日志之外的修改：先返回到这里为止的条目，下一次请求时整份同步
+            if positions[entry["seq"]] != entry["serial"] or len(entries) >= limit:
+                break
+        if not entries:
+            if seq == self.last_seq:
+                return [], positions[seq], False
+            return None, None, False
+        last = entries[-1]
+        more = last["seq"] < self.last_seq or positions[last["seq"]] != last["serial"]
+        return entries, last["serial"], more
+    
+    def reconstruct(self, serial):
+        """重建指定序列号时的区域内容，返回 (内容, 消息)，找不到时内容为 None"""
+        self._load()
+        exact = self.backups.by_serial(serial)
+        if exact and exact["kind"] == "snapshot":
+            return self.backups.read(exact), f"已读取序列号 {serial} 的快照"
+        
+        target_seq = None
+        for entry in self.entries():
+            if entry["serial"] == serial:
+                target_seq = entry["seq"]
+        if target_seq is None:
+            return None, f"找不到序列号 {serial} 的历史记录"
+        
+        # 同一 seq 可能有日志外修改产生的快照，只有序列号一致的那份才代表目标状态
+        base = [snap for snap in self.list_snapshots()
+                if snap[0] < target_seq or (snap[0] == target_seq and snap[1] == serial)]
+        if not base:
+            return None, f"序列号 {serial} 之前的快照已被清理"
+        snap_seq, _, snapshot = base[-1]
+        model = ZoneModel(self.backups.read(snapshot).splitlines(True))
+        
+        for entry in self.entries(after_seq=snap_seq):
+            if entry["seq"] > target_seq:
+                break
+            result, msg, _ = apply_changes_to_model(model, entry["changes"])
+            if not result:
+                return None, f"重放日志 {entry['seq']} 失败: {msg}"
+        model.set_serial(serial)
+        return model.render(), f"已重建序列号 {serial} 的区域内容"
+
+def read_last_line(path):
+    """读取文件最后一个非空行，文件不存在时返回None"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            size = 4096
+            while True:
+                start = max(0, end - size)
+                f.seek(start)
+                lines = f.read(end - start).splitlines()
+                lines = [line for line in lines if line.strip()]
+                if start == 0 or len(lines) > 1:
+                    return lines[-1].decode("utf-8") if lines else None
+                size *= 2
+    except FileNotFoundError:
+        return None
+
+def file_signature(path):
+    """文件的 (inode, 修改时间, 大小)，用于判断文件是否被替换或修改；文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+class ZoneWAL:
+    """
+    区域的预写日志：每批被接受的变更在改写区域文件之前追加一行
+    {"base": 原序列号, "serial": 提交后的序列号, "changes": [...]} 并 fsync，
+    所有批次都在区域中生效（写入、reload、记入变更日志）后清空。
+    记录按序列号首尾相接，区域当前序列号在链上的位置决定哪些批次尚未生效。
+    所有方法都应在持有区域写锁和跨进程排他锁时调用。
+    """
+    
+    def __init__(self, directory, zone_name):
+        self.path = os.path.join(directory, "wal", f"{zone_name}.wal")
+        self._last_offset = None
+    
+    def has_records(self):
+        try:
+            return os.path.getsize(self.path) > 0
+        except FileNotFoundError:
+            return False
+    
+    def records(self):
+        """读取所有完整的记录；末尾不完整的一行（追加中途崩溃，未 fsync 也未答复）被截掉"""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        records = []
+        offset = 0
+        for line in data.splitlines(True):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logging.warning(f"WAL {self.path} 末尾有不完整的记录，已截掉")
+                os.truncate(self.path, offset)
+                break
+            offset += len(line)
+        return records
+    
+    @staticmethod
+    def pending(records, serial):
+        """区域当前序列号为 serial 时尚未生效的记录；序列号不在记录链上时返回None"""
+        if not records or serial == records[0]["base"]:
+            return records
+        for i, record in enumerate(records):
+            if record["serial"] == serial:
+                return records[i + 1:]
+        return None
+    
+    def append(self, base, serial, changes):
+        """追加一个批次并 fsync，同一批次的所有请求共用这一次 fsync"""
+        line = json.dumps({"base": base, "serial": serial, "time": datetime.now().isoformat(timespec="seconds"),
+                           "changes": changes}, ensure_ascii=False) + "\n"
+        if not os.path.exists(self.path):
+            # 新建文件时连同目录项一起落盘
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_file_atomic(self.path, line)
+            self._last_offset = 0
+            return
+        with open(self.path, "a") as f:
+            self._last_offset = f.tell()
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def discard_last(self):
+        """撤销最后追加的批次（提交失败，且还没有答复客户端）"""
+        if self._last_offset is None:
+            return
+        with open(self.path, "r+") as f:
+            f.truncate(self._last_offset)
+            os.fsync(f.fileno())
+        self._last_offset = None
+    
+    def clear(self):
+        """所有批次都已生效后清空"""
+        with open(self.path, "r+") as f:
+            f.truncate(0)
+            os.fsync(f.fileno())
+        self._last_offset = None
+    
+    def quarantine(self):
+        """把无法重放的 WAL 移到一旁保留，返回新路径"""
+        path = f"{self.path}.{datetime.now().strftime('%Y%m%d%H%M%S')}.failed"
+        os.replace(self.path, path)
+        self._last_offset = None
+        return path
+
+def restore_zone_to_serial(zone, serial):
+    """把区域恢复到历史序列号时的内容，并以新的（更大的）序列号提交"""
+    if zone_backend_config(zone.name).get("backend") == "ddns":
+        return False, "动态更新区域的内容由 named 维护，不支持按序列号恢复"
+    
+    with zone.rwlock.write(), zone.process_lock.exclusive():
+        if zone.wal is not None and zone.wal.has_records():
+            return False, "区域还有尚未完成的变更（WAL），请稍后重试"
+        content, msg = zone.journal.reconstruct(serial)
+        if content is None:
+            return False, msg
+        
+        txn = zone.store.begin()
+        committed = False
+        try:
+            base_serial = txn.serial
+            if base_serial is None:
+                return False, f"区域 {zone.name} 的 SOA 序列号无法解析（序列号所在行需带 '; serial' 注释）"
+            zone.journal.prepare(base_serial, txn.render)
+            target = ZoneModel(content.splitlines(True))
+            # 先对齐到当前序列号，提交时再递增，保证从服务器能看到序列号增大
+            target.set_serial(base_serial)
+            txn.load_from(target)
+            started = time.monotonic()
+            committed, msg = commit_zone_changes(zone, txn, [])
+            if committed:
+                changes = [{"op": "restore", "serial": serial}]
+                local = {"target": "local", "status": "success", "message": msg,
+                         "latency_ms": round((time.monotonic() - started) * 1000, 2)}
+                zone.journal.append(txn.serial, changes, txn.render, force_snapshot=True)
+                if zone.targets:
+                    reached, msg, _ = fan_out_commit(zone, base_serial, txn.serial, changes, txn.default_ttl, local)
+                    if not reached:
+                        return False, f"已在本地恢复到序列号 {serial} 的内容（新序列号 {txn.serial}），但{msg}"
+        finally:
+            zone.store.end(txn, committed)
+    
+    if not committed:
+        return False, msg
+    logging.info(f"已将区域 {zone.name} 恢复到序列号 {serial} 的内容，新序列号 {txn.serial}")
+    return True, f"已恢复到序列号 {serial} 的内容，新序列号 {txn.serial}"
+
+def committed_zone_content(zone):
+    """
+    区域已提交的内容和序列号（调用方需持有读锁和跨进程共享锁）。
+    以区域文件为准的区域直接读取文件，不依赖可能还没刷新的缓存（其他工作进程刚提交的内容）。
+    """
+    if isinstance(zone.store, ZoneFileStore):
+        with open(zone.path, "r") as f:
+            content = f.read()
+    else:
+        content = zone.store.snapshot().render()
+    match = SERIAL_LINE_PATTERN.search(content)
+    return (int(match.group(2)) if match else None), content
+
+def query_zone_changes(zone, request):
+    """
+    changes_since：返回区域在给定位置（serial 为区域序列号，或 seq 为变更日志序号）之后的提交。
+    每次最多返回 limit 条，more 为真时以响应中的 serial 继续请求；
+    无法从该位置增量同步时返回 resync 和区域的完整内容 (content)。
+    """
+    seq, serial = request.get("seq"), request.get("serial")
+    for name, value in (("seq", seq), ("serial", serial)):
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            return {"status": "error", "message": f"{name} 必须是整数"}
+    limit = request.get("limit", CHANGES_SINCE_LIMIT)
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= CHANGES_SINCE_LIMIT:
+        return {"status": "error", "message": f"limit 必须是 1 到 {CHANGES_SINCE_LIMIT} 之间的整数"}
+    ddns = zone_backend_config(zone.name).get("backend") == "ddns"
+    
+    with zone.rwlock.read(), zone.process_lock.shared():
+        version = zone.store.snapshot().serial
+        if seq is None and serial is not None and serial == version:
+            entries, end_serial, more = [], serial, False
+        else:
+            entries, end_serial, more = zone.journal.changes_since(seq, serial, limit)
+        # 区域在日志之外被修改、还没有经过 API 提交（当前序列号比日志中的新）时也只能整份同步
+        resync = entries is None or (not more and not ddns and version is not None
+                                     and end_serial is not None and version > end_serial)
+        if resync and not ddns:
+            version, content = committed_zone_content(zone)
+    
+    if not resync:
+        return {"status": "success", "message": f"共 {len(entries)} 次提交", "zone": zone.name,
+                "version": version, "serial": end_serial, "seq": entries[-1]["seq"] if entries else seq,
+                "entries": entries, "more": more}
+    if ddns:
+        return {"status": "error", "message": "动态更新区域的内容由 named 维护，无法从该位置增量同步"}
+    logging.info(f"区域 {zone.name} 无法从 seq={seq} serial={serial} 增量同步，返回完整内容")
+    return {"status": "success", "message": "无法从该位置增量同步，返回区域的完整内容", "zone": zone.name,
+            "version": version, "serial": version, "resync": True, "content": content}
+
+# ---------------------------------------------------------------------------
+# RFC 2136 动态更新后端：向 named 发送 DNS UPDATE，只修改涉及的 RRset，
+# 不重写区域文件也不执行 rndc reload。区域需在 named.conf 中配置
+# allow-update / update-policy，可选使用 TSIG 签名（配置 TSIG 时也校验响应的签名）。
+# 序列号由 named 递增，提交后通过 SOA 查询取得；启动时先 rndc sync，
+# 区域文件按 named 重写后的格式（$ORIGIN、相对名称）解析。
+# ---------------------------------------------------------------------------
+
+DNS_TYPE_CODES = {"A": 1, "SOA": 6, "TXT": 16, "AAAA": 28, "TSIG": 250, "ANY": 255}
+DNS_CLASS_IN = 1
+DNS_CLASS_NONE = 254
+DNS_CLASS_ANY = 255
+DNS_OPCODE_UPDATE = 5
+DNS_RCODE_NAMES = {
+    0: "NOERROR", 1: "FORMERR", 2: "SERVFAIL", 3: "NXDOMAIN", 4: "NOTIMP",
+    5: "REFUSED", 6: "YXDOMAIN", 7: "YXRRSET", 8: "NXRRSET", 9: "NOTAUTH", 10: "NOTZONE",
+}
+TSIG_ERROR_NAMES = {16: "BADSIG", 17: "BADKEY", 18: "BADTIME", 22: "BADTRUNC"}
+TSIG_ALGORITHMS = {
+    "hmac-md5": ("hmac-md5.sig-alg.reg.int", hashlib.md5),
+    "hmac-sha1": ("hmac-sha1", hashlib.sha1),
+    "hmac-sha256": ("hmac-sha256", hashlib.sha256),
+    "hmac-sha512": ("hmac-sha512", hashlib.sha512),
+}
+
+def zone_backend_config(zone_name=None):
+    """返回区域的后端配置，未配置时使用重写文件 + rndc reload"""
+    return ZONE_BACKENDS.get(zone_name or ZONE_NAME, {"backend": "file"})
+
+def encode_dns_name(name):
+    """将域名编码为 DNS 报文格式（不压缩）"""
+    wire = b""
+    for label in name.rstrip(".").split("."):
+        if label:
+            encoded = label.encode("ascii")
+            if len(encoded) > 63:
+                raise ValueError(f"标签过长: {label}")
+            wire += bytes([len(encoded)]) + encoded
+    return wire + b"\x00"
+
+def encode_rr(name, record_type, record_class, ttl, rdata=b""):
+    """编码一条资源记录"""
+    return (encode_dns_name(name)
+            + struct.pack("!HHIH", DNS_TYPE_CODES[record_type], record_class, ttl, len(rdata))
+            + rdata)
+
+def changes_to_update_rrs(changes, ttl):
+    """把 add/update/upsert/delete 和 set_txt/clear_txt 变更转换为 UPDATE 报文更新区中的记录"""
+    rrs = []
+    for change in changes:
+        op = change.get("op")
+        domain = change.get("domain")
+        if op in ("delete", "update", "upsert"):
+            # 删除该域名的整个 A 和 AAAA RRset
+            rrs.append(encode_rr(domain, "A", DNS_CLASS_ANY, 0))
+            rrs.append(encode_rr(domain, "AAAA", DNS_CLASS_ANY, 0))
+        if op in ("add", "update", "upsert"):
+            addr = ipaddress.ip_address(change.get("ip"))
+            record_type = "AAAA" if isinstance(addr, ipaddress.IPv6Address) else "A"
+            rrs.append(encode_rr(domain, record_type, DNS_CLASS_IN, ttl, addr.packed))
+        if op in TXT_CHANGE_OPS:
+            rrs.append(encode_rr(domain, "TXT", DNS_CLASS_ANY, 0))
+        if op == "set_txt":
+            for value in change["values"]:
+                data = value.encode("ascii")
+                rrs.append(encode_rr(domain, "TXT", DNS_CLASS_IN, TXT_RECORD_TTL, bytes([len(data)]) + data))
+    return rrs
+
+def build_update_message(zone_name, rrs, msg_id):
+    """构造 UPDATE 报文（区域段 + 更新段，无前提条件）"""
+    header = struct.pack("!HHHHHH", msg_id, DNS_OPCODE_UPDATE << 11, 1, 0, len(rrs), 0)
+    zone = encode_dns_name(zone_name) + struct.pack("!HH", DNS_TYPE_CODES["SOA"], DNS_CLASS_IN)
+    return header + zone + b"".join(rrs)
+
+def sign_tsig(message, msg_id, key_name, secret, algorithm="hmac-sha256", fudge=300):
+    """按 RFC 8945 为报文追加 TSIG 记录，返回 (签名后的报文, MAC)；校验响应时需要请求的 MAC"""
+    algorithm_name, digest = TSIG_ALGORITHMS[algorithm]
+    key_wire = encode_dns_name(key_name.lower())
+    algorithm_wire = encode_dns_name(algorithm_name)
+    now = int(time.time())
+    time_signed = struct.pack("!HI", now >> 32, now & 0xFFFFFFFF)
+    
+    # TSIG 变量：密钥名、类、TTL、算法名、签名时间、fudge、错误码、其他数据长度
+    variables = (key_wire + struct.pack("!HI", DNS_CLASS_ANY, 0) + algorithm_wire
+                 + time_signed + struct.pack("!HHH", fudge, 0, 0))
+    mac = hmac.new(base64.b64decode(secret), message + variables, digest).digest()
+    
+    rdata = (algorithm_wire + time_signed + struct.pack("!HH", fudge, len(mac)) + mac
+             + struct.pack("!HHH", msg_id, 0, 0))
+    tsig_rr = key_wire + struct.pack("!HHIH", DNS_TYPE_CODES["TSIG"], DNS_CLASS_ANY, 0, len(rdata)) + rdata
+    
+    # ADCOUNT + 1
+    arcount = struct.unpack("!H", message[10:12])[0] + 1
+    return message[:10] + struct.pack("!H", arcount) + message[12:] + tsig_rr, mac
+
+def skip_dns_name(message, offset):
+    """跳过报文中 offset 处的域名（可能以压缩指针结尾），返回其后的位置"""
+    while True:
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1 + length
+        if length == 0:
+            return offset
+
+def parse_dns_records(message):
+    """返回报文回答、授权和附加段中的资源记录 [(起始位置, 类型, rdata 起始位置, rdata 长度)]"""
+    qdcount, ancount, nscount, arcount = struct.unpack("!HHHH", message[4:12])
+    offset = 12
+    for _ in range(qdcount):
+        offset = skip_dns_name(message, offset) + 4
+    records = []
+    for _ in range(ancount + nscount + arcount):
+        start = offset
+        offset = skip_dns_name(message, offset)
+        record_type, _, _, length = struct.unpack("!HHIH", message[offset:offset + 10])
+        records.append((start, record_type, offset + 10, length))
+        offset += 10 + length
+    if offset > len(message):
+        raise ValueError("报文被截断")
+    return records
+
+def verify_tsig(response, request_mac, key_name, secret, algorithm="hmac-sha256"):
+    """按 RFC 8945 校验响应末尾的 TSIG 记录，返回错误消息，通过时返回None"""
+    algorithm_name, digest = TSIG_ALGORITHMS[algorithm]
+    key_wire = encode_dns_name(key_name.lower())
+    algorithm_wire = encode_dns_name(algorithm_name)
+    records = parse_dns_records(response)
+    arcount = struct.unpack("!H", response[10:12])[0]
+    if not arcount or records[-1][1] != DNS_TYPE_CODES["TSIG"]:
+        return "响应没有 TSIG 签名"
+    start, _, rdata, length = records[-1]
+    if response[start:start + len(key_wire)].lower() != key_wire:
+        return "响应的 TSIG 密钥名与请求不一致"
+    pos = skip_dns_name(response, rdata)
+    if response[rdata:pos].lower() != algorithm_wire:
+        return "响应的 TSIG 算法与请求不一致"
+    time_signed = response[pos:pos + 6]
+    fudge, mac_size = struct.unpack("!HH", response[pos + 6:pos + 10])
+    mac = response[pos + 10:pos + 10 + mac_size]
+    original_id, error, other_size = struct.unpack("!HHH", response[pos + 10 + mac_size:pos + 16 + mac_size])
+    other = response[pos + 16 + mac_size:rdata + length]
+    if error:
+        return f"TSIG 校验失败: {TSIG_ERROR_NAMES.get(error, str(error))}"
+    
+    # 签名内容：请求的 MAC + 去掉 TSIG 记录（ARCOUNT 减一、恢复原 ID）的响应 + TSIG 变量
+    message = (struct.pack("!H", original_id) + response[2:10] + struct.pack("!H", arcount - 1)
+               + response[12:start])
+    variables = (key_wire + struct.pack("!HI", DNS_CLASS_ANY, 0) + algorithm_wire
+                 + time_signed + struct.pack("!HHH", fudge, error, other_size) + other)
+    expected = hmac.new(base64.b64decode(secret),
+                        struct.pack("!H", len(request_mac)) + request_mac + message + variables, digest).digest()
+    if not hmac.compare_digest(mac, expected):
+        return "响应的 TSIG 签名不正确"
+    if abs(time.time() - int.from_bytes(time_signed, "big")) > fudge:
+        return "响应的 TSIG 签名时间超出允许范围"
+    return None
+
+def send_dns_message(message, server, port, timeout):
+    """发送 DNS 报文并返回响应；报文超过 512 字节或响应被截断时使用 TCP"""
+    if len(message) <= 512:
+        with socket.socket(socket.AF_INET6 if ":" in server else socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(timeout)
+            sock.sendto(message, (server, port))
+            while True:
+                response, _ = sock.recvfrom(65535)
+                # 忽略 ID 不匹配的迟到响应
+                if response[:2] == message[:2]:
+                    break
+        if not (struct.unpack("!H", response[2:4])[0] & 0x0200):
+            return response
+    
+    with socket.create_connection((server, port), timeout=timeout) as sock:
+        sock.sendall(struct.pack("!H", len(message)) + message)
+        length = struct.unpack("!H", recv_exact(sock, 2))[0]
+        return recv_exact(sock, length)
+
+def recv_exact(sock, size):
+    """从套接字读取指定长度的数据"""
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("连接被提前关闭")
+        data += chunk
+    return data
+
+def exchange_dns_message(message, msg_id, config, what):
+    """
+    按配置为报文签名（TSIG）并发给 named，配置了 TSIG 时校验响应的签名。
+    返回 (响应, 错误消息)，失败时响应为None；what 为报文的说明，用于日志和错误消息。
+    """
+    request_mac = None
+    if config.get("tsig_name"):
+        message, request_mac = sign_tsig(message, msg_id, config["tsig_name"], config["tsig_secret"],
+                                         config.get("tsig_algorithm", "hmac-sha256"))
+    try:
+        response = send_dns_message(message, config.get("server", "127.0.0.1"),
+                                    config.get("port", 53), config.get("timeout", 5))
+        error = None
+        if request_mac is not None:
+            error = verify_tsig(response, request_mac, config["tsig_name"], config["tsig_secret"],
+                                config.get("tsig_algorithm", "hmac-sha256"))
+    except (OSError, ConnectionError) as e:
+        logging.error(f"发送 {what} 失败: {str(e)}")
+        return None, f"发送 {what} 失败: {str(e)}"
+    except (ValueError, IndexError, struct.error) as e:
+        error = f"响应格式错误: {str(e)}"
+    if error:
+        logging.error(f"{what} 的响应无效: {error}")
+        return None, f"{what} 的响应无效: {error}"
+    
+    rcode = struct.unpack("!H", response[2:4])[0] & 0x000F
+    if rcode != 0:
+        name = DNS_RCODE_NAMES.get(rcode, str(rcode))
+        logging.error(f"{what} 被拒绝: {name}")
+        return None, f"{what} 被拒绝: {name}"
+    return response, None
+
+def send_dns_update(zone_name, changes, config, ttl):
+    """把一组变更作为一个 UPDATE 报文发送给 named（named 保证整体生效或整体失败）"""
+    rrs = changes_to_update_rrs(changes, ttl)
+    msg_id = int.from_bytes(os.urandom(2), "big")
+    response, msg = exchange_dns_message(build_update_message(zone_name, rrs, msg_id), msg_id, config, "DNS UPDATE")
+    if response is None:
+        return False, msg
+    return True, f"DNS UPDATE 已生效 ({len(rrs)} 条更新)"
+
+def query_soa_serial(zone_name, config):
+    """向 named 查询区域当前的 SOA 序列号，返回 (序列号, 错误消息)，失败时序列号为None"""
+    msg_id = int.from_bytes(os.urandom(2), "big")
+    message = (struct.pack("!HHHHHH", msg_id, 0, 1, 0, 0, 0)
+               + encode_dns_name(zone_name) + struct.pack("!HH", DNS_TYPE_CODES["SOA"], DNS_CLASS_IN))
+    response, msg = exchange_dns_message(message, msg_id, config, "SOA 查询")
+    if response is None:
+        return None, msg
+    try:
+        ancount = struct.unpack("!H", response[6:8])[0]
+        for _, record_type, rdata, _ in parse_dns_records(response)[:ancount]:
+            if record_type == DNS_TYPE_CODES["SOA"]:
+                # rdata：主服务器名、管理员邮箱，之后第一个 32 位整数是序列号
+                pos = skip_dns_name(response, skip_dns_name(response, rdata))
+                return struct.unpack("!I", response[pos:pos + 4])[0], None
+    except (ValueError, IndexError, struct.error) as e:
+        return None, f"SOA 查询的响应格式错误: {str(e)}"
+    return None, "SOA 查询的响应中没有 SOA 记录"
+
+def commit_dynamic_update(zone_name, model, changes, config):
+    """通过 DNS UPDATE 提交变更，区域文件由 named 维护，不重写也不 reload"""
+    ttl = config.get("ttl") or model.default_ttl or 3600
+    with metrics.timer("dns_api_phase_duration_seconds", phase="ddns"):
+        result, msg = send_dns_update(zone_name, changes, config, ttl)
+        if not result:
+            return False, msg
+        # 序列号由 named 按 serial-update-method 递增，以 named 的 SOA 为准，不在本地推算
+        serial, error = query_soa_serial(zone_name, config)
+    if serial is None:
+        logging.warning(f"区域 {zone_name} 的 DNS UPDATE 已生效，但无法获取新的序列号（{error}），版本号暂不更新")
+        return True, msg
+    model.bump_serial(serial)
+    return True, msg
+
+def commit_zone_changes(zone, model, changes, serial=None):
+    """
+    按区域配置的后端提交已在内存模型上验证过的变更（调用方需持有写锁）。
+    serial 为写入 WAL 时确定的新序列号，为空时按当前序列号递增。
+    """
+    config = zone_backend_config(zone.name)
+    if config.get("backend") == "ddns":
+        return commit_dynamic_update(zone.name, model, changes, config)
+    
+    # 事务开始后区域文件被外部修改：放弃本次提交，以免覆盖外部的修改
+    if isinstance(zone.store, ZoneFileStore) and zone.cache.changed_on_disk():
+        zone.cache.invalidate()
+        metrics.inc("dns_api_zone_edit_conflicts_total", zone=zone.name)
+        logging.warning(f"区域 {zone.name} 的文件在提交期间被外部修改，已放弃本次提交")
+        return False, "区域文件在提交期间被外部修改，请重试"
+    
+    # 读取当前内容用于 reload 失败时回滚；历史记录由区域的 journal 负责，不再整份复制
+    with metrics.timer("dns_api_phase_duration_seconds", phase="read"), open(zone.path, "r") as f:
+        previous_content = f.read()
+    return commit_zone_model(zone, model, previous_content, serial)
+
+class BindTarget:
+    """
+    ZONE_TARGETS 中的一台 BIND，通过 rndc 或 DNS UPDATE 应用区域的提交。
+    serial 为该目标落后时已确认的区域序列号（None 表示与本地一致），
+    DNS UPDATE 目标据此从变更日志补发之前失败而落下的提交。serial 保存在
+    BACKUP_DIR/targets 下（见 load_target_serials），各工作进程和重启之后共用。
+    同一区域的提交持有区域写锁和跨进程排他锁依次发出，同一目标不会被并发调用。
+    """
+    
+    def __init__(self, zone_name, config):
+        self.zone_name = zone_name
+        self.config = config
+        self.name = config.get("name") or f"{config.get('type')}:{config.get('server')}"
+        self.serial = None
+    
+    def apply(self, zone, base, serial, changes, ttl):
+        """把序列号 base -> serial 的提交应用到该目标，返回 (是否成功, 消息)"""
+        if self.config.get("type") == "rndc":
+            return self._rndc()
+        result, msg = self._update(zone, base, changes, ttl)
+        if result:
+            self.serial = None
+        elif self.serial is None:
+            self.serial = base
+        return result, msg
+    
+    def _rndc(self):
+        command = ["rndc"]
+        for flag, key in (("-s", "server"), ("-p", "port"), ("-k", "key_file")):
+            if self.config.get(key):
+                command += [flag, str(self.config[key])]
+        command += [self.config.get("command", "reload"), self.zone_name]
+        try:
+            ret = subprocess.run(command, capture_output=True, text=True, timeout=TARGET_RNDC_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return False, f"执行 rndc 失败: {str(e)}"
+        if ret.returncode != 0:
+            return False, f"rndc {command[-2]} 失败: {(ret.stderr or ret.stdout).strip()}"
+        return True, f"rndc {command[-2]} 已完成"
+    
+    def _update(self, zone, base, changes, ttl):
+        pending = changes
+        if self.serial is not None and self.serial != base:
+            # 之前失败而落下的提交：从变更日志补发（本次提交已记入日志）
+            entries, _, _ = zone.journal.changes_since(serial=self.serial)
+            if entries is None:
+                return False, (f"无法从序列号 {self.serial} 补发落下的变更，"
+                               f"请人工同步该目标后从 {target_state_path(zone)} 中删除该目标")
+            pending = [change for entry in entries for change in entry["changes"]]
+        if any(change.get("op") not in REPLICABLE_OPS for change in pending):
+            return False, (f"按序列号恢复的内容无法通过 DNS UPDATE 同步，"
+                           f"请人工同步该目标后从 {target_state_path(zone)} 中删除该目标")
+        return send_dns_update(self.zone_name, pending, self.config, self.config.get("ttl") or ttl or 3600)
+
+# 把提交并行发往各区域的 BIND 目标
+target_executor = concurrent.futures.ThreadPoolExecutor(max_workers=TARGET_WORKERS, thread_name_prefix="bind-target")
+
+def reset_target_executor():
+    """
+    在派生出的工作进程中调用：监管进程启动时重放 WAL 可能已经用过线程池，
+    其线程不在子进程中，沿用旧线程池提交的任务永远不会执行。
+    """
+    global target_executor
+    target_executor = concurrent.futures.ThreadPoolExecutor(max_workers=TARGET_WORKERS,
+                                                            thread_name_prefix="bind-target")
+
+def target_state_path(zone):
+    return os.path.join(BACKUP_DIR, "targets", f"{zone.name}.json")
+
+def load_target_serials(zone):
+    """读取各目标落后时已确认的序列号（其他工作进程或上次运行写入），调用方需持有跨进程排他锁"""
+    try:
+        with open(target_state_path(zone), "r") as f:
+            serials = json.load(f)
+    except FileNotFoundError:
+        serials = {}
+    except (OSError, ValueError) as e:
+        logging.error(f"读取区域 {zone.name} 的目标同步状态失败，按全部一致处理: {str(e)}")
+        serials = {}
+    for target in zone.targets:
+        target.serial = serials.get(target.name)
+    return serials
+
+def save_target_serials(zone, previous):
+    """目标的同步状态有变化时写回文件"""
+    serials = {target.name: target.serial for target in zone.targets if target.serial is not None}
+    if serials == previous:
+        return
+    path = target_state_path(zone)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_file_atomic(path, json.dumps(serials))
+
+def fan_out_commit(zone, base, serial, changes, ttl, local):
+    """
+    本地提交成功后把提交并行应用到区域的所有目标（调用方需持有区域写锁和跨进程排他锁）。
+    local 为本地提交的结果。返回 (是否达到 quorum, 未达到时的消息, 各目标的结果)
+    """
+    def run(target):
+        start = time.monotonic()
+        try:
+            result, msg = target.apply(zone, base, serial, changes, ttl)
+        except Exception as e:
+            logging.error(f"应用到目标 {target.name} 时出错: {str(e)}", exc_info=True)
+            result, msg = False, f"应用到目标时出错: {str(e)}"
+        return result, msg, time.monotonic() - start
+    
+    previous = load_target_serials(zone)
+    futures = [(target, target_executor.submit(run, target)) for target in zone.targets]
+    results = [local]
+    for target, future in futures:
+        result, msg, seconds = future.result()
+        metrics.observe("dns_api_target_duration_seconds", seconds, zone=zone.name, target=target.name)
+        if not result:
+            metrics.inc("dns_api_target_failures_total", zone=zone.name, target=target.name)
+            logging.error(f"区域 {zone.name} 的提交（序列号 {serial}）应用到目标 {target.name} 失败: {msg}")
+        results.append({"target": target.name, "status": "success" if result else "error", "message": msg,
+                        "latency_ms": round(seconds * 1000, 2)})
+    try:
+        save_target_serials(zone, previous)
+    except Exception as e:
+        logging.error(f"保存区域 {zone.name} 的目标同步状态失败: {str(e)}", exc_info=True)
+    
+    applied = sum(1 for item in results if item["status"] == "success")
+    if applied >= zone.quorum:
+        return True, None, results
+    return False, f"只有 {applied}/{len(results)} 个目标应用成功，需要 {zone.quorum} 个", results
+
+class ZoneFacts:
+    """区域中非托管内容（SOA、NS、CNAME 等）的摘要，供提交前校验使用"""
+    
+    def __init__(self, zone_name):
+        self.zone_name = zone_name.lower().rstrip(".")
+        # 小写绝对名称（不带末尾的点） -> {(类型, 数据), ...}
+        self.names = {}
+        self.soa_count = 0
+        self.errors = []
+    
+    def types(self, name):
+        return {record_type for record_type, _ in self.names.get(name.lower(), ())}
+
+def strip_zone_comment(line):
+    """去掉区域文件行中的注释（引号内的分号不算）"""
+    if ";" not in line:
+        return line
+    quoted = False
+    for i, ch in enumerate(line):
+        if ch == '"' and (i == 0 or line[i - 1] != "\\"):
+            quoted = not quoted
+        elif ch == ";" and not quoted:
+            return line[:i]
+    return line
+
+def qualify_zone_name(name, origin):
+    """
+    把区域文件中的名称展开为不带末尾点的绝对名称。origin 为空表示根
+    （named 规范化输出里的 "$ORIGIN ."），此时相对名称不能再拼出末尾的点。
+    """
+    if name.endswith(".") or not origin:
+        return name.rstrip(".")
+    return f"{name}.{origin}"
+
+def iter_zone_records(lines, zone_name, errors):
+    """
+    粗略解析区域文件内容（支持 $ORIGIN、$TTL、@、相对名称、省略所有者和括号续行），
+    逐条产生 (不带末尾点的绝对所有者, 显式 TTL 或 None, 类型, 数据字段列表)；
+    $TTL 指令产生为 (None, 值, "$TTL", [])。TTL 语法错误追加到 errors。
+    """
+    origin = zone_name.rstrip(".")
+    owner = origin
+    pending = ""
+    for raw in lines:
+        text = strip_zone_comment(raw.rstrip("\n"))
+        # 括号内的多行记录（如 SOA）拼成一行再解析
+        if pending or "(" in text:
+            pending += " " + text if pending else text
+            if pending.count("(") > pending.count(")"):
+                continue
+            text, pending = pending.replace("(", " ").replace(")", " "), ""
+        if not text.strip():
+            continue
+        tokens = text.split()
+        if tokens[0].startswith("$"):
+            directive = tokens[0].upper()
+            if directive == "$ORIGIN" and len(tokens) > 1:
+                origin = qualify_zone_name(tokens[1], origin)
+            elif directive == "$TTL":
+                if len(tokens) < 2 or not TTL_PATTERN.match(tokens[1]):
+                    errors.append(f"无效的 $TTL: {text.strip()}")
+                else:
+                    yield None, tokens[1], "$TTL", []
+            continue
+        if not text[0].isspace():
+            name = tokens.pop(0)
+            owner = origin if name == "@" else qualify_zone_name(name, origin)
+        # 所有者之后是可选的 TTL 和类别（顺序任意），然后是类型和数据
+        ttl = None
+        while tokens and (tokens[0].upper() in ("IN", "CH", "HS", "CS") or tokens[0][0].isdigit()):
+            token = tokens.pop(0)
+            if token[0].isdigit():
+                if TTL_PATTERN.match(token):
+                    ttl = token
+                else:
+                    errors.append(f"{owner} 的 TTL 无效: {token}")
+        if tokens:
+            yield owner, ttl, tokens[0].upper(), tokens[1:]
+
+def parse_zone_facts(lines, zone_name):
+    """
+    收集区域文件中每个名称的记录类型、SOA 数量以及 TTL 语法错误（解析见 iter_zone_records）。
+    只用于校验，不用于生成区域文件。
+    """
+    facts = ZoneFacts(zone_name)
+    for owner, _, record_type, data in iter_zone_records(lines, facts.zone_name, facts.errors):
+        if owner is None:
+            continue
+        owner = owner.lower()
+        facts.names.setdefault(owner, set()).add((record_type, " ".join(data).lower()))
+        if record_type == "SOA" and owner == facts.zone_name:
+            facts.soa_count += 1
+    return facts
+
+def canonical_zone_lines(lines, zone_name):
+    """
+    把 named 重写的区域文件（$ORIGIN、相对名称、省略所有者、多行 SOA）展开为
+    每行一条、带绝对名称的记录，使 ZoneModel 能识别其中的托管记录和序列号。
+    用于动态更新区域：这些区域的文件由 named 维护，API 不会写回展开后的内容。
+    """
+    canonical = []
+    for owner, ttl, record_type, data in iter_zone_records(lines, zone_name, []):
+        if owner is None:
+            canonical.append(f"$TTL {ttl}\n")
+        elif record_type == "SOA" and len(data) == 7:
+            # 序列号单独成行，供 SERIAL_LINE_PATTERN 定位
+            canonical += [f"{owner}.   {ttl or ''} IN  SOA     {data[0]} {data[1]} (\n",
+                          f"        {data[2]} ; serial\n",
+                          f"        {' '.join(data[3:])} )\n"]
+        else:
+            # RECORD_PATTERN 只识别纯数字的 TTL，named 输出的 TTL 都是秒数
+            ttl = f"{ttl}  " if ttl and ttl.isdigit() else ""
+            canonical.append(f"{owner}.   {ttl}IN  {record_type}     {' '.join(data)}\n")
+    return canonical
+
+def read_zone_model(path, zone_name):
+    """解析区域文件；动态更新区域的文件由 named 重写，先按 canonical_zone_lines 展开"""
+    with open(path, "r") as f:
+        lines = f.readlines()
+    if zone_backend_config(zone_name).get("backend") == "ddns":
+        lines = canonical_zone_lines(lines, zone_name)
+    return ZoneModel(lines)
+
+def check_zone_facts(facts):
+    """检查整个区域的 SOA 和 TTL，返回错误消息，通过时返回None"""
+    if facts.soa_count != 1:
+        return f"区域 {facts.zone_name} 应有且只有一条 SOA 记录，实际为 {facts.soa_count} 条"
+    if facts.errors:
+        return facts.errors[0]
+    return None
+
+def check_record_change(facts, domain, record_type, ip=None):
+    """
+    检查为 domain 写入 (record_type, ip) 是否合法：名称在区域内、标签长度、
+    与非托管记录的 CNAME 冲突和重复记录（ip 为空时不检查）。托管记录的重复由调用方的存在性检查保证。
+    通过时返回None。
+    """
+    name = domain.lower().rstrip(".")
+    if len(name) > 253 or any(not 0 < len(label) <= 63 for label in name.split(".")):
+        return f"域名 {domain} 的标签或总长度超出限制"
+    if name != facts.zone_name and not name.endswith("." + facts.zone_name):
+        return f"域名 {domain} 不属于区域 {facts.zone_name}"
+    if facts.types(name) & {"CNAME", "DNAME"}:
+        return f"域名 {domain} 已有 CNAME 记录，不能再添加 {record_type} 记录"
+    if ip is not None and (record_type, ip.lower()) in facts.names.get(name, ()):
+        return f"区域中已有相同的记录: {domain} {record_type} {ip}"
+    return None
+
+def apply_change_to_model(model, change, facts=None):
+    """
+    在模型上执行一项变更 {"op": "add"|"update"|"upsert"|"delete", "domain": ..., "ip": ...}
+    或 {"op": "set_txt", "domain": ..., "values": [...]} / {"op": "clear_txt", "domain": ...}。
+    给出 facts 时先用 check_record_change 校验，不通过则不修改模型。
+    """
+    op = change.get("op")
+    domain = change.get("domain")
+    ip = change.get("ip")
+    
+    if op == "add":
+        if not domain or not ip:
+            return False, "域名或IP为空"
+        # 判断记录是否已存在
+        if model.lookup(domain):
+            return False, f"域名 {domain} 已存在"
+        # 确定记录类型并追加记录
+        record_type = get_record_type(ip)
+        error = facts and check_record_change(facts, domain, record_type, ip)
+        if error:
+            metrics.inc("dns_api_validation_rejections_total")
+            return False, error
+        model.add_record(domain, record_type, ip)
+        return True, f"成功添加{record_type}记录: {domain} -> {ip}"
+    
+    if op == "delete":
+        if not domain:
+            return False, "域名为空"
+        if not model.delete_records(domain):
+            return False, f"域名 {domain} 不存在"
+        return True, f"成功删除域名记录: {domain}"
+    
+    if op == "update":
+        if not domain or not ip:
+            return False, "域名或IP为空"
+        # 确定记录类型并替换记录
+        record_type = get_record_type(ip)
+        error = facts and check_record_change(facts, domain, record_type, ip)
+        if error:
+            metrics.inc("dns_api_validation_rejections_total")
+            return False, error
+        if not model.update_records(domain, record_type, ip):
+            return False, f"域名 {domain} 不存在"
+        return True, f"成功更新域名记录: {domain} -> {ip} ({record_type})"
+    
+    if op == "upsert":
+        if not domain or not ip:
+            return False, "域名或IP为空"
+        # 已存在则替换，不存在则添加
+        record_type = get_record_type(ip)
+        error = facts and check_record_change(facts, domain, record_type, ip)
+        if error:
+            metrics.inc("dns_api_validation_rejections_total")
+            return False, error
+        if model.update_records(domain, record_type, ip):
+            return True, f"成功更新域名记录: {domain} -> {ip} ({record_type})"
+        model.add_record(domain, record_type, ip)
+        return True, f"成功添加{record_type}记录: {domain} -> {ip}"
+    
+    if op == "set_txt":
+        values = change.get("values")
+        if not domain or not values:
+            return False, "域名或 TXT 值为空"
+        error = facts and check_record_change(facts, domain, "TXT")
+        if error:
+            metrics.inc("dns_api_validation_rejections_total")
+            return False, error
+        model.set_txt(domain, values)
+        return True, f"已设置 {domain} 的 {len(values)} 条 TXT 记录"
+    
+    if op == "clear_txt":
+        if not domain:
+            return False, "域名为空"
+        return True, f"已删除 {domain} 的 {model.clear_txt(domain)} 条 TXT 记录"
+    
+    return False, f"无效的变更类型: {op}"
+
+def is_noop_change(model, change):
+    """
+    无需任何修改的变更：upsert 的目标记录已经是唯一且相同的记录，
+    set_txt 的值与现有 TXT 记录相同，或 clear_txt 的名称没有 TXT 记录
+    """
+    op = change.get("op")
+    if op == "set_txt" and change.get("domain") and change.get("values"):
+        return sorted(model.lookup_txt(change["domain"])) == sorted(change["values"])
+    if op == "clear_txt" and change.get("domain"):
+        return not model.lookup_txt(change["domain"])
+    if op != "upsert" or not change.get("domain") or not change.get("ip"):
+        return False
+    entries = model.lookup(change["domain"])
+    return (len(entries) == 1 and entries[0][2] == get_record_type(change["ip"])
+            and entries[0][3] == change["ip"])
+
+def apply_changes_to_model(model, changes, facts=None, applied=None):
+    """
+    在模型上依次执行一组变更（facts 见 apply_change_to_model）。
+    applied 不为空时，实际修改了模型的变更会追加到其中（跳过无需修改的 upsert）。
+    返回 (是否成功, 消息, 成功时为各项结果/失败时为出错项下标)
+    """
+    results = []
+    for i, change in enumerate(changes):
+        if is_noop_change(model, change):
+            results.append(f"记录未变化: {change['domain']}" + (f" -> {change['ip']}" if change.get("ip") else ""))
+            continue
+        result, msg = apply_change_to_model(model, change, facts)
+        if not result:
+            if len(changes) > 1:
+                msg = f"第 {i + 1} 项变更失败: {msg}"
+            return False, msg, i
+        if applied is not None:
+            applied.append(change)
+        results.append(msg)
+    if len(results) == 1:
+        return True, results[0], results
+    return True, f"成功提交 {len(results)} 项变更", results
+
+class CommitTicket:
+    """一个等待提交的变更请求；version 为完成时区域的版本号（SOA序列号）"""
+    
+    def __init__(self, changes, if_version=None):
+        self.changes = changes
+        self.if_version = if_version
+        self.result = None
+        self.version = None
+        # 区域配置了 ZONE_TARGETS 时为各目标的结果
+        self.targets = None
+        self.done = threading.Event()
+    
+    def finish(self, result, version=None):
+        self.result = result
+        self.version = version
+        self.done.set()
+    
+    def wait(self):
+        self.done.wait()
+        return self.result
 
-class DNSRequestHandler(socketserver.BaseRequestHandler):
-    def handle(self):
-        client_ip = self.client_address[0]
-        logging.info(f"接收来自 {client_ip} 的连接")
-        
+class CommitScheduler:
+    """
+    组提交调度器：空闲时立即提交收到的请求；提交进行期间到达的请求排队，
+    下一次合并为一次备份、一次序列号更新、一次写入和一次 rndc reload，
+    然后把共同的结果返回给每个等待的请求（window 见 RELOAD_BATCH_WINDOW）。
+    每个请求内部的变更仍然是全部成功或全部不生效，互不影响。
+    启用 WAL 时每个批次在改写区域文件之前先写入 WAL，WAL 中尚未生效的批次先于新批次提交。
+    """
+    
+    def __init__(self, zone, window):
+        self.zone = zone
+        self.window = window
+        self._cond = threading.Condition()
+        self._pending = []
+        self._thread = None
+        # 上一次提交结束的时间（time.monotonic），用于判断是否处于持续写入中
+        self._last_flush = float("-inf")
+        # WAL 中留有提交失败的批次时为真，调度线程空闲时定期重试
+        self._retry = False
+    
+    def submit(self, changes, if_version=None):
+        """提交一组变更并等待所在批次完成"""
+        return self.submit_async(changes, if_version).wait()
+    
+    def submit_async(self, changes, if_version=None):
+        """提交一组变更，立即返回 CommitTicket"""
+        ticket = CommitTicket(changes, if_version)
+        with self._cond:
+            self._pending.append(ticket)
+            self._start()
+            self._cond.notify()
+        return ticket
+    
+    def _start(self):
+        """启动调度线程（调用方需持有 _cond）"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+    
+    def recover(self, retry=True):
+        """
+        同步提交 WAL 中尚未完成的批次（服务启动时调用），失败时交给调度线程定期重试。
+        retry 为假时不在本进程启动调度线程，由派生出的工作进程各自启动（见 reset_after_fork）。
+        """
+        with self.zone.rwlock.write(), self.zone.process_lock.exclusive():
+            self._flush([])
+        with self._cond:
+            self._retry = self.zone.wal.has_records()
+            if self._retry and retry:
+                self._start()
+    
+    def reset_after_fork(self):
+        """
+        在派生出的工作进程中调用：父进程的调度线程不会被带到子进程，
+        重建调度状态，WAL 中还有待重试的批次时在本进程启动调度线程。
+        """
+        self._cond = threading.Condition()
+        self._pending = []
+        self._thread = None
+        with self._cond:
+            if self._retry:
+                self._start()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    if not self._cond.wait(WAL_RETRY_INTERVAL if self._retry else None) and self._retry:
+                        break
+            # 空闲时立即提交；上一次提交刚结束时最多等到窗口期满，让持续到达的请求进入同一批次
+            if self.window > 0:
+                delay = self._last_flush + self.window - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            with self._cond:
+                batch, self._pending = self._pending, []
+            try:
+                with self.zone.rwlock.write(), self.zone.process_lock.exclusive():
+                    self._flush(batch)
+            except Exception as e:
+                logging.error(f"批量提交变更时出错: {str(e)}", exc_info=True)
+                for ticket in batch:
+                    if not ticket.done.is_set():
+                        ticket.finish((False, f"提交变更时出错: {str(e)}", None))
+            self._last_flush = time.monotonic()
+            if self.zone.wal is not None:
+                self._retry = self.zone.wal.has_records()
+    
+    def _flush(self, batch):
+        zone = self.zone
+        wal = zone.wal
+        txn = zone.store.begin()
+        committed = False
+        changes = []
+        acked = False
+        targets = None
         try:
-            data = self.request.recv(4096).strip()
-            if not data:
-                logging.warning(f"从 {client_ip} 接收到空数据")
+            base = txn.serial
+            version = base
+            if base is None:
+                # 没有序列号时 WAL、变更日志和版本号都无从谈起，拒绝修改而不是写入 None
+                msg = f"区域 {zone.name} 的 SOA 序列号无法解析（序列号所在行需带 '; serial' 注释），拒绝修改"
+                logging.error(msg)
+                for ticket in batch:
+                    ticket.finish((False, msg, None), base)
                 return
-                
-            request = json.loads(data.decode('utf-8'))
-            action = request.get("action")
-            
-            logging.info(f"从 {client_ip} 接收到动作: {action}")
-            
-            if action == "add_domain":
-                domain = request.get("domain")
-                ip = request.get("ip")
-                result, msg = self._validate_and_execute(add_domain_record, domain, ip)
-                resp = {"status": "success" if result else "error", "message": msg}
-            
-            elif action == "delete_domain":
-                domain = request.get("domain")
-                result, msg = self._validate_and_execute(delete_domain_record, domain)
-                resp = {"status": "success" if result else "error", "message": msg}
-                
-            elif action == "update_domain":
-                domain = request.get("domain")
-                ip = request.get("ip")
-                result, msg = self._validate_and_execute(update_domain_record, domain, ip)
-                resp = {"status": "success" if result else "error", "message": msg}
-                
-            elif action == "list_domains":
-                result, resp_data = list_domain_records()
-                msg = "获取域名列表成功" if result else "获取域名列表失败"
-                resp = {"status": "success" if result else "error", "message": msg}
+            zone.journal.prepare(base, txn.render)
+            # WAL 中尚未生效的批次已经被接受（可能已答复），先于本批次应用；版本号从其末尾接续
+            replayed = self._replay_wal(txn, base) if wal is not None else []
+            head = replayed[-1]["serial"] if replayed else base
+            facts = None
+            if VALIDATE_ZONE:
+                facts = txn.zone_facts(zone.name)
+                error = check_zone_facts(facts)
+                if error:
+                    metrics.inc("dns_api_validation_rejections_total", len(batch))
+                    logging.error(f"区域 {zone.name} 校验失败，拒绝 {len(batch)} 个变更请求: {error}")
+                    for ticket in batch:
+                        ticket.finish((False, f"区域校验失败: {error}", None), base)
+                    return
+            accepted, rejected, deferred = self._apply_batch(txn, batch, head, facts)
+            batch_changes = [change for _, _, _, applied in accepted for change in applied]
+            changes = [change for record in replayed for change in record["changes"]] + batch_changes
+            if changes:
+                serial = None
+                if wal is not None:
+                    serial = head
+                    if batch_changes:
+                        serial = next_soa_serial(head)
+                        with metrics.timer("dns_api_phase_duration_seconds", phase="wal"):
+                            wal.append(head, serial, batch_changes)
+                        if WAL_EARLY_ACK:
+                            # 批次已持久化：先答复客户端，改写区域文件和 reload 随后进行
+                            acked = True
+                            for ticket, msg, details, _ in accepted:
+                                ticket.finish((True, msg, details), serial)
+                started = time.monotonic()
+                committed, reload_msg = commit_zone_changes(zone, txn, changes, serial)
+                if committed:
+                    version = txn.serial
+                    local = {"target": "local", "status": "success", "message": reload_msg,
+                             "latency_ms": round((time.monotonic() - started) * 1000, 2)}
+                    # 每个 WAL 批次（可能已按其序列号答复）各记一条日志，客户端拿到的版本都能在日志中找到
+                    entries = [(version, changes)]
+                    if wal is not None:
+                        entries = [(record["serial"], record["changes"]) for record in replayed]
+                        if batch_changes:
+                            entries.append((version, batch_changes))
+                    try:
+                        with metrics.timer("dns_api_phase_duration_seconds", phase="journal"):
+                            for entry_serial, entry_changes in entries[:-1]:
+                                zone.journal.append(entry_serial, entry_changes, None)
+                            zone.journal.append(version, entries[-1][1], txn.render)
+                    except Exception as e:
+                        logging.error(f"写入变更日志失败: {str(e)}", exc_info=True)
+                    if wal is not None and wal.has_records():
+                        wal.clear()
+                    if zone.targets:
+                        reached, quorum_msg, targets = fan_out_commit(zone, base, version, changes,
+                                                                      txn.default_ttl, local)
+                elif wal is not None and batch_changes and not acked:
+                    # 客户端会收到失败的答复，这个批次不能再被重放
+                    wal.discard_last()
+        finally:
+            zone.store.end(txn, committed)
+        
+        for ticket, result in rejected:
+            ticket.finish(result, version)
+        # 带 if_version 的请求排在已修改区域的请求之后时，放回队列按新的版本重新判断
+        if deferred:
+            with self._cond:
+                self._pending[:0] = deferred
+                self._cond.notify()
+        
+        if not changes:
+            # 全部是无需修改的 upsert：不备份、不更新序列号、不 reload
+            for ticket, msg, details, _ in accepted:
+                ticket.finish((True, msg, details), version)
+            return
+        
+        if accepted:
+            metrics.observe("dns_api_commit_batch_requests", len(accepted))
+        if not committed:
+            logging.error(f"区域 {zone.name} 合并提交 {len(accepted)} 个请求的 {len(changes)} 项变更失败: {reload_msg}")
+            if acked or replayed:
+                logging.error(f"区域 {zone.name} 已接受的变更保留在 WAL 中，每 {WAL_RETRY_INTERVAL} 秒重试一次")
+            for ticket, _, _, _ in accepted:
+                if not ticket.done.is_set():
+                    ticket.finish((False, reload_msg, None), version)
+            return
+        
+        logging.info(f"区域 {zone.name} 已合并提交 {len(accepted)} 个请求的 {len(changes)} 项变更，版本 {version}")
+        for ticket, msg, details, applied in accepted:
+            for change in applied:
+                logging.info(f"已提交变更: {change}")
+            if ticket.done.is_set():
+                continue
+            if targets is not None:
+                ticket.targets = targets
+                if not reached:
+                    ticket.finish((False, quorum_msg, None), version)
+                    continue
+            ticket.finish((True, msg, details), version)
+    
+    def _replay_wal(self, txn, base):
+        """把 WAL 中尚未生效的批次应用到事务上，返回这些批次的记录"""
+        zone = self.zone
+        records = zone.wal.records()
+        pending = zone.wal.pending(records, base)
+        if pending is None:
+            path = zone.wal.quarantine()
+            logging.error(f"区域 {zone.name} 的序列号 {base} 不在 WAL 的记录链上（区域文件被外部修改？），"
+                          f"无法重放，已把 WAL 移到 {path}，请人工核对")
+            return []
+        if not pending:
+            if records:
+                # 区域已包含全部批次，但上次提交在 reload 或清空 WAL 之前中断
+                result, msg = reload_bind(zone.name)
                 if result:
-                    resp["domains"] = resp_data
-            
-            else:
-                logging.warning(f"从 {client_ip} 接收到无效动作: {action}")
-                resp = {"status": "error", "message": "无效的操作类型"}
-                
-        except json.JSONDecodeError:
-            logging.error(f"从 {client_ip} 接收到无效的JSON数据")
-            resp = {"status": "error", "message": "无效的JSON格式"}
-            
-        except Exception as e:
-            logging.error(f"处理请求时发生错误: {str(e)}", exc_info=True)
-            resp = {"status": "error", "message": f"服务器错误: {str(e)}"}
+                    zone.wal.clear()
+                else:
+                    logging.error(f"区域 {zone.name} 完成 WAL 中的提交时重新加载BIND失败: {msg}")
+            return []
         
-        # 返回响应
+        savepoint = txn.savepoint()
+        for record in pending:
+            result, msg, _ = apply_changes_to_model(txn, record["changes"])
+            if not result:
+                txn.rollback_to(savepoint)
+                path = zone.wal.quarantine()
+                logging.error(f"区域 {zone.name} 重放 WAL 批次（序列号 {record['serial']}）失败: {msg}，"
+                              f"已把 WAL 移到 {path}，请人工核对")
+                return []
+        metrics.inc("dns_api_wal_replayed_batches_total", len(pending), zone=zone.name)
+        logging.warning(f"区域 {zone.name} 重放 WAL 中尚未完成的 {len(pending)} 个批次，"
+                        f"序列号 {pending[0]['base']} -> {pending[-1]['serial']}")
+        return pending
+    
+    @staticmethod
+    def _apply_batch(txn, batch, base, facts=None):
+        """
+        把每个请求的变更应用到事务上（facts 不为空时逐项校验）。
+        返回 (被接受的请求, 被拒绝的请求及结果, 需要放回队列的请求)。
+        """
+        accepted = []
+        rejected = []
+        deferred = []
+        modified = False
+        for ticket in batch:
+            if ticket.if_version is not None:
+                if modified:
+                    deferred.append(ticket)
+                    continue
+                if ticket.if_version != base:
+                    rejected.append((ticket, (False, f"版本不匹配: 区域当前版本为 {base}", None)))
+                    continue
+            # 单项变更失败时不会修改数据；多项变更先建保存点，失败时整体回退
+            savepoint = txn.savepoint() if len(ticket.changes) > 1 else None
+            applied = []
+            result, msg, details = apply_changes_to_model(txn, ticket.changes, facts, applied)
+            if not result:
+                if savepoint is not None:
+                    txn.rollback_to(savepoint)
+                rejected.append((ticket, (False, msg, details)))
+                continue
+            modified = modified or bool(applied)
+            accepted.append((ticket, msg, details, applied))
+        return accepted, rejected, deferred
+
+class ZoneContext:
+    """一个区域的运行状态：锁、缓存、存储、备份、变更日志和提交调度器，各区域互不影响"""
+    
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        if zone_backend_config(name).get("backend") == "ddns":
+            sync_dynamic_zone(name)
+        self.cache = ZoneCache(path, name)
+        self.store = create_zone_store(name, path, self.cache)
+        self.rwlock = self.store.rwlock
+        self.backups = BackupStore(BACKUP_DIR, name, BACKUP_RETENTION_COUNT, BACKUP_RETENTION_DAYS,
+                                   BACKUP_RETENTION_BYTES)
+        self.journal = ZoneJournal(BACKUP_DIR, name, SNAPSHOT_INTERVAL, self.backups)
+        self.scheduler = CommitScheduler(self, RELOAD_BATCH_WINDOW)
+        self.wal = None
+        if WAL_ENABLED and zone_backend_config(name).get("backend") != "ddns":
+            self.wal = ZoneWAL(BACKUP_DIR, name)
+        # 多个工作进程之间的区域锁：提交、恢复持排他锁，读取变更日志和检查外部修改持共享锁
+        self.process_lock = ZoneProcessLock(os.path.join(BACKUP_DIR, "locks", f"{name}.lock"))
+        # 本地之外的 BIND 目标和成功所需的目标数（含本地）
+        target_config = ZONE_TARGETS.get(name, {})
+        self.targets = [BindTarget(name, config) for config in target_config.get("targets", [])]
+        self.quorum = target_config.get("quorum") or len(self.targets) + 1
+
+def parse_named_conf_zones(path):
+    """从 named.conf 片段中解析 master/primary 区域，返回 {区域名: 区域文件路径}"""
+    with open(path, "r") as f:
+        text = f.read()
+    # 去掉 /* */、// 和 # 注释（引号内的内容不会出现这些写法，这里不做区分）
+    text = re.sub(r'/\*.*?\*/', ' ', text, flags=re.S)
+    text = re.sub(r'(//|#)[^\n]*', ' ', text)
+    
+    zones = {}
+    for match in re.finditer(r'\bzone\s+"([^"]+)"\s*(?:\w+\s*)?\{', text):
+        # 区域块内可能嵌套 { }（如 allow-update），按括号配对找到块结束位置
+        depth, pos = 1, match.end()
+        while depth and pos < len(text):
+            depth += {"{": 1, "}": -1}.get(text[pos], 0)
+            pos += 1
+        body = text[match.end():pos]
+        zone_type = re.search(r'\btype\s+(\w+)\s*;', body)
+        zone_file = re.search(r'\bfile\s+"([^"]+)"\s*;', body)
+        if zone_type and zone_type.group(1) in ("master", "primary") and zone_file:
+            name = match.group(1).lower().rstrip(".")
+            zones[name] = os.path.join(BIND_DIRECTORY, zone_file.group(1))
+    return zones
+
+class ZoneRouter:
+    """
+    区域索引：从 named.conf.local 加载所有 master 区域，按域名最长后缀匹配找到所属区域。
+    配置文件的修改时间变化后重新加载；名称和文件都没变的区域沿用原有的 ZoneContext。
+    新区域的 ZoneContext 在重新加载时创建（ddns 区域会执行 rndc sync），重新加载期间
+    其他线程继续使用原有的区域表，不在锁上等待。
+    """
+    
+    def __init__(self, conf_path):
+        self.conf_path = conf_path
+        self._lock = threading.Lock()
+        self._zones = None
+        self._signature = None
+        self._checked = 0
+    
+    def _conf_signature(self):
         try:
-            self.request.sendall(json.dumps(resp, ensure_ascii=False).encode('utf-8'))
-            logging.info(f"已发送响应到 {client_ip}: {resp.get('status')}")
-        except Exception as e:
-            logging.error(f"发送响应到 {client_ip} 时出错: {str(e)}")
+            st = os.stat(self.conf_path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
     
-    def _validate_and_execute(self, func, domain=None, ip=None):
-        """验证输入参数并执行函数"""
-        # 验证域名
-        if domain is not None:
-            if not re.match(r'^[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?)*$', domain):
-                return False, "无效的域名格式"
-        
-        # 验证IP地址
-        if ip is not None:
+    def zones(self):
+        """返回 {区域名: ZoneContext}，按 ZONE_CONFIG_CHECK_INTERVAL 检查配置是否变化"""
+        now = time.monotonic()
+        if self._zones is not None and now - self._checked < ZONE_CONFIG_CHECK_INTERVAL:
+            return self._zones
+        # 只有首次加载需要等待；其他线程正在重新加载时直接返回原有的区域表
+        if not self._lock.acquire(blocking=self._zones is None):
+            return self._zones
+        try:
+            self._checked = now
+            signature = self._conf_signature()
+            if self._zones is None or signature != self._signature:
+                self._zones = self._load(signature)
+                self._signature = signature
+        finally:
+            self._lock.release()
+        return self._zones
+    
+    def _load(self, signature):
+        configured = {}
+        if signature is not None:
             try:
-                ipaddress.ip_address(ip)
-            except ValueError:
-                return False, "无效的IP地址格式"
+                configured = parse_named_conf_zones(self.conf_path)
+            except Exception as e:
+                logging.error(f"解析 {self.conf_path} 失败: {str(e)}")
+                if self._zones is not None:
+                    return self._zones
+        if not configured:
+            configured = {ZONE_NAME: ZONE_FILE}
         
-        # 执行函数
-        if ip is not None:
-            return func(domain, ip)
-        else:
-            return func(domain)
+        previous = self._zones or {}
+        zones = {}
+        for name, path in configured.items():
+            current = previous.get(name)
+            zones[name] = current if current is not None and current.path == path else ZoneContext(name, path)
+        logging.info(f"已加载 {len(zones)} 个区域: {', '.join(sorted(zones))}")
+        if zone_watcher is not None:
+            zone_watcher.watch(zones)
+        return zones
+    
+    def get(self, zone_name):
+        """按区域名查找，未管理时返回None"""
+        return self.zones().get(zone_name.lower().rstrip("."))
+    
+    def route(self, domain):
+        """按最长后缀匹配返回域名所属的区域，不属于任何区域时返回None"""
+        zones = self.zones()
+        labels = domain.lower().rstrip(".").split(".")
+        for i in range(len(labels)):
+            zone = zones.get(".".join(labels[i:]))
+            if zone is not None:
+                return zone
+        return None
 
-def ensure_backup_dir():
-    """确保备份目录存在"""
-    if not os.path.exists(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR)
+zone_router = ZoneRouter(NAMED_CONF_LOCAL)
 
-def backup_zone_file():
-    """备份区域文件"""
-    ensure_backup_dir()
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_path = os.path.join(BACKUP_DIR, f"db.uk.00-0.top.{timestamp}")
-    try:
-        with open(ZONE_FILE, "r") as src, open(backup_path, "w") as dst:
-            dst.write(src.read())
-        logging.info(f"已创建区域文件备份: {backup_path}")
-        return True
-    except Exception as e:
-        logging.error(f"备份区域文件失败: {str(e)}")
-        return False
+class InotifyWatch:
+    """通过 ctypes 调用 inotify 监视目录，系统不支持时构造函数抛出 OSError"""
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+    EVENT = struct.Struct("iIII")
+    
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        # 监视描述符 -> 目录
+        self.dirs = {}
+    
+    def add(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"无法监视目录 {directory}")
+        self.dirs[wd] = directory
+    
+    def read(self):
+        """阻塞读取一批事件，返回 [(文件路径, 掩码)]；路径为 None 表示可能丢失了事件"""
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & (self.IN_Q_OVERFLOW | self.IN_IGNORED):
+                if mask & self.IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                events.append((None, mask))
+            elif wd in self.dirs and name:
+                events.append((os.path.join(self.dirs[wd], os.fsdecode(name)), mask))
+        return events
 
-def update_soa_serial(content):
-    """更新SOA序列号"""
-    def replace_serial(match):
-        serial_part = match.group(1).strip()
-        old_serial = int(re.search(r'\d+', serial_part).group())
-        
-        # 使用当前日期作为序列号前缀 (YYYYMMDD)
-        today = datetime.now().strftime("%Y%m%d")
-        today_prefix = int(today) * 100
+class ZoneWatcher:
+    """
+    监视以区域文件为准的区域：文件被外部写入或替换后在后台线程中立即重新解析，
+    请求不必等待解析，使用 inotify 时也不必每次 stat() 文件。inotify 不可用时定期轮询。
+    外部修改没有递增序列号时（通常是编辑器保存了旧内容，覆盖了 API 的提交）记录警告。
+    多进程模式下其他工作进程的提交也会触发通知，按变更日志识别后只重新加载、不告警。
+    SQLite 存储的区域文件由数据库生成，不在监视范围内；动态更新区域的文件由 named 同步日志时重写，
+    并不是外部修改，也不监视（请求时按文件状态检查，变化后静默重新解析）。
+    """
+    
+    def __init__(self, mode, poll_interval):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        # 区域文件的绝对路径 -> ZoneContext
+        self._zones = {}
+        self._inotify = None
+        if mode in ("auto", "inotify"):
+            try:
+                self._inotify = InotifyWatch()
+            except (OSError, AttributeError) as e:
+                if mode == "inotify":
+                    raise
+                logging.warning(f"inotify 不可用，改为每 {poll_interval} 秒轮询区域文件: {str(e)}")
+    
+    def watch(self, zones):
+        """设置要监视的区域（区域配置重新加载后调用）"""
+        with self._lock:
+            paths = {os.path.abspath(zone.path): zone for zone in zones.values()
+                     if isinstance(zone.store, ZoneFileStore)
+                     and zone_backend_config(zone.name).get("backend") != "ddns"}
+            if self._inotify is not None:
+                for directory in {os.path.dirname(path) for path in paths} - set(self._inotify.dirs.values()):
+                    try:
+                        self._inotify.add(directory)
+                    except OSError as e:
+                        logging.warning(f"{str(e)}，该目录下的区域改为每次请求检查文件状态")
+            watched_dirs = set(self._inotify.dirs.values()) if self._inotify is not None else set()
+            for path, zone in paths.items():
+                zone.cache.watched = os.path.dirname(path) in watched_dirs
+            self._zones = paths
+    
+    def start(self):
+        target = self._run_inotify if self._inotify is not None else self._run_poll
+        threading.Thread(target=target, daemon=True, name="zone-watcher").start()
+        logging.info(f"区域文件监视已启动（{'inotify' if self._inotify is not None else '轮询'}）")
+    
+    def _run_inotify(self):
+        while True:
+            try:
+                events = self._inotify.read()
+            except OSError as e:
+                logging.error(f"读取 inotify 事件失败，改为轮询: {str(e)}")
+                for zone in self._zones.values():
+                    zone.cache.watched = False
+                self._run_poll()
+                return
+            changed = set()
+            for path, mask in events:
+                if path is None:
+                    # 事件队列溢出或目录被移除：检查全部区域，已移除目录下的区域改回每次检查文件状态
+                    watched_dirs = set(self._inotify.dirs.values())
+                    for zone_path, zone in self._zones.items():
+                        zone.cache.watched = zone.cache.watched and os.path.dirname(zone_path) in watched_dirs
+                    changed.update(self._zones)
+                elif mask & (InotifyWatch.IN_MOVED_FROM | InotifyWatch.IN_DELETE):
+                    # 文件被移走或删除：丢弃缓存，新文件写完（IN_CLOSE_WRITE/IN_MOVED_TO）后再解析
+                    zone = self._zones.get(path)
+                    if zone is not None:
+                        zone.cache.invalidate()
+                else:
+                    changed.add(path)
+            for path in changed:
+                zone = self._zones.get(path)
+                if zone is not None:
+                    self.refresh(zone)
+    
+    def _run_poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            for zone in list(self._zones.values()):
+                self.refresh(zone)
+    
+    def refresh(self, zone):
+        """
+        重新检查一个区域的文件；持读锁和跨进程共享锁执行，因此 API 的提交（包括其他工作进程的
+        提交及其变更日志）完成后才检查，不会被误认为外部修改
+        """
+        try:
+            with zone.rwlock.read(), zone.process_lock.shared():
+                previous, current = zone.cache.refresh()
+                # 序列号变成了变更日志中最近一次提交的序列号：其他工作进程的提交
+                committed = (previous is not None and current is not previous and current.serial is not None
+                             and current.serial != previous.serial
+                             and current.serial == zone.journal.committed_serial())
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.error(f"重新加载区域 {zone.name} 的文件失败: {str(e)}", exc_info=True)
+            return
+        if previous is None or current is previous:
+            return
+        if committed:
+            logging.debug("区域 %s 已由其他工作进程提交到序列号 %s，已重新加载", zone.name, current.serial)
+            return
+        metrics.inc("dns_api_external_zone_edits_total", zone=zone.name)
+        logging.warning(f"检测到区域 {zone.name} 的文件被外部修改，已重新加载")
+        if previous.serial is not None and current.serial is not None and current.serial <= previous.serial:
+            metrics.inc("dns_api_zone_edit_conflicts_total", zone=zone.name)
+            logging.warning(f"区域 {zone.name} 的外部修改没有递增序列号（{previous.serial} -> {current.serial}），"
+                            f"可能覆盖了 API 的提交，从服务器也不会同步这次修改")
+
+# 由 start_zone_watcher() 设置，未启动监视时为None
+zone_watcher = None
+
+def start_zone_watcher():
+    """按 ZONE_WATCHER 启动区域文件监视"""
+    watcher = ZoneWatcher(ZONE_WATCHER, ZONE_WATCH_POLL_INTERVAL)
+    watcher.watch(zone_router.zones())
+    watcher.start()
+    return watcher
+
+class ReplicationFollower:
+    """
+    从节点的同步线程：通过一个分帧长连接向主节点请求各区域的 changes_since，
+    把返回的提交按主节点的序列号在本地一次性提交，并记入本地的变更日志
+    （因此从节点也可以作为其他从节点的主节点）。本地区域无法应用增量时整份复制主节点的内容。
+    """
+    
+    def __init__(self, primary, interval):
+        self.primary = primary
+        self.interval = interval
+        self._sock = None
+        # 本地内容与主节点不一致、下一次需要整份同步的区域
+        self._diverged = set()
+    
+    def start(self):
+        threading.Thread(target=self._run, daemon=True, name="replication").start()
+        logging.info(f"从节点同步已启动，主节点 {self.primary[0]}:{self.primary[1]}")
+    
+    def _run(self):
+        failures = 0
+        while True:
+            try:
+                for zone in self._zones():
+                    self.sync(zone)
+                failures = 0
+            except (OSError, ValueError) as e:
+                self._close()
+                failures += 1
+                logging.warning(f"与主节点 {self.primary[0]}:{self.primary[1]} 同步失败: {str(e)}")
+            except Exception as e:
+                self._close()
+                failures += 1
+                logging.error(f"同步主节点的变更时出错: {str(e)}", exc_info=True)
+            time.sleep(min(REPLICATION_RETRY_MAX_DELAY, self.interval * 2 ** failures))
+    
+    def _zones(self):
+        zones = zone_router.zones()
+        names = zones if REPLICATION_ZONES is None else [name for name in REPLICATION_ZONES if name in zones]
+        return [zones[name] for name in names if zone_backend_config(name).get("backend") != "ddns"]
+    
+    def _call(self, request):
+        """在长连接上发送一个请求帧并读取响应帧"""
+        if self._sock is None:
+            self._sock = socket.create_connection(self.primary, timeout=REPLICATION_TIMEOUT)
+        body = json.dumps(request, ensure_ascii=False).encode("utf-8")
+        self._sock.sendall(struct.pack("!I", len(body)) + body)
+        length = struct.unpack("!I", recv_exact(self._sock, 4))[0]
+        return json.loads(recv_exact(self._sock, length).decode("utf-8"))
+    
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+    
+    def sync(self, zone):
+        """把一个区域同步到主节点的最新状态"""
+        while True:
+            with zone.rwlock.read():
+                serial = zone.store.snapshot().serial
+            request = {"action": "changes_since", "zone": zone.name}
+            if serial is not None and zone.name not in self._diverged:
+                request["serial"] = serial
+            resp = self._call(request)
+            if resp.get("status") != "success":
+                logging.warning(f"从主节点获取区域 {zone.name} 的变更失败: {resp.get('message')}")
+                return
+            if resp.get("resync"):
+                self._apply(zone, serial, resp["serial"], content=resp["content"])
+                return
+            if resp["entries"] and not self._apply(zone, serial, resp["serial"], entries=resp["entries"]):
+                return
+            if not resp.get("more"):
+                return
+    
+    def _apply(self, zone, base, serial, entries=None, content=None):
+        """
+        在本地提交主节点的一组提交（entries）或完整内容（content），新序列号与主节点相同。
+        区域在请求期间被修改或应用失败时放弃，返回是否已提交。
+        """
+        with zone.rwlock.write(), zone.process_lock.exclusive():
+            if zone.wal is not None and zone.wal.has_records():
+                logging.warning(f"区域 {zone.name} 的 WAL 中还有未完成的变更，稍后再同步主节点的变更")
+                return False
+            txn = zone.store.begin()
+            committed = False
+            msg = None
+            try:
+                if txn.serial != base:
+                    # 本地区域在请求期间被修改，下一轮按新的序列号同步
+                    return False
+                zone.journal.prepare(base, txn.render)
+                if content is None:
+                    changes = [change for entry in entries for change in entry["changes"]]
+                    result, msg, _ = apply_changes_to_model(txn, changes)
+                    if not result:
+                        self._diverged.add(zone.name)
+                        logging.error(f"区域 {zone.name} 应用主节点的变更失败: {msg}，下一次整份同步")
+                        return False
+                else:
+                    txn.load_from(ZoneModel(content.splitlines(True)))
+                    changes = [{"op": "resync", "serial": serial}]
+                committed, msg = commit_zone_changes(zone, txn, changes if content is None else [], serial)
+                if committed:
+                    try:
+                        zone.journal.append(txn.serial, changes, txn.render, force_snapshot=content is not None)
+                    except Exception as e:
+                        logging.error(f"写入变更日志失败: {str(e)}", exc_info=True)
+            finally:
+                zone.store.end(txn, committed)
         
-        # 如果当前序列号的前缀已经是今天的日期，则递增
-        if old_serial >= today_prefix and old_serial < today_prefix + 99:
-            new_serial = old_serial + 1
+        if not committed:
+            logging.error(f"区域 {zone.name} 提交主节点的变更失败: {msg}")
+            return False
+        if content is None:
+            metrics.inc("dns_api_replication_applied_total", len(entries), zone=zone.name)
+            logging.info(f"区域 {zone.name} 已同步主节点的 {len(entries)} 次提交，序列号 {base} -> {serial}")
         else:
-            new_serial = today_prefix + 1
-            
-        return f" {new_serial} ; serial"
-    
-    return re.sub(SOA_PATTERN, replace_serial, content)
+            self._diverged.discard(zone.name)
+            metrics.inc("dns_api_replication_resyncs_total", zone=zone.name)
+            logging.warning(f"区域 {zone.name} 已整份复制主节点的内容，序列号 {base} -> {serial}")
+        return True
 
-def reload_bind():
-    """重新加载BIND配置"""
-    try:
-        ret = subprocess.run(["rndc", "reload"], capture_output=True, text=True)
-        if ret.returncode != 0:
-            logging.error(f"rndc reload 失败: {ret.stderr}")
-            return False, ret.stderr
-        return True, "BIND配置已重新加载"
-    except Exception as e:
-        logging.error(f"执行rndc reload时出错: {str(e)}")
-        return False, str(e)
+def start_replication():
+    """从节点模式：启动向 REPLICATION_PRIMARY 同步的线程"""
+    follower = ReplicationFollower(REPLICATION_PRIMARY, REPLICATION_INTERVAL)
+    follower.start()
+    return follower
 
-def get_record_type(ip):
-    """根据IP地址确定记录类型"""
-    try:
-        addr = ipaddress.ip_address(ip)
-        return "AAAA" if isinstance(addr, ipaddress.IPv6Address) else "A"
-    except ValueError:
-        return "A"  # 默认返回A记录类型
+def apply_zone_changes(changes):
+    """
+    原子地执行一组变更（必须属于同一区域）：全部在内存模型上成功后才会提交。
+    并发请求由区域的调度器合并为一次写入和重新加载。
+    返回 (是否成功, 消息, 成功时为各项结果/失败时为出错项下标)
+    """
+    zone = zone_router.route(changes[0].get("domain") or "")
+    if zone is None:
+        return False, f"域名 {changes[0].get('domain')} 不属于本服务器管理的任何区域", 0
+    return zone.scheduler.submit(changes)
 
 def add_domain_record(domain, ip):
     """添加域名记录"""
     try:
-        if not domain or not ip:
-            return False, "域名或IP为空"
-            
-        # 备份区域文件
-        if not backup_zone_file():
-            return False, "无法备份区域文件"
-            
-        with open(ZONE_FILE, "r") as f:
-            content = f.read()
-            
-        # 判断记录是否已存在
-        check_str = f"{domain}."
-        domain_regex = re.compile(rf"{re.escape(check_str)}\s+IN\s+[A|AAAA]")
-        if domain_regex.search(content):
-            return False, f"域名 {domain} 已存在"
-            
-        # 确定记录类型并创建记录行
-        record_type = get_record_type(ip)
-        record_line = f"{domain}.   IN  {record_type}     {ip}"
-        
-        # 更新SOA序列号
-        content = update_soa_serial(content)
-        
-        # 追加记录
-        new_content = content.rstrip("\n") + "\n" + record_line + "\n"
-        
-        # 写入文件
-        with open(ZONE_FILE, "w") as f:
-            f.write(new_content)
-            
-        # 重新加载BIND
-        result, msg = reload_bind()
-        if not result:
-            # 恢复备份
-            backup_zone_file()  # 先备份当前的错误文件
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            latest_backup = sorted([f for f in os.listdir(BACKUP_DIR) if f.startswith("db.uk.00-0.top")])[-2]
-            os.system(f"cp {os.path.join(BACKUP_DIR, latest_backup)} {ZONE_FILE}")
-            return False, f"重新加载BIND失败: {msg}"
-            
-        logging.info(f"已添加域名记录: {domain} -> {ip} ({record_type})")
-        return True, f"成功添加{record_type}记录: {domain} -> {ip}"
-        
+        result, msg, _ = apply_zone_changes([{"op": "add", "domain": domain, "ip": ip}])
+        return result, msg
     except Exception as e:
         logging.error(f"添加域名记录时出错: {str(e)}", exc_info=True)
         return False, f"添加域名记录时出错: {str(e)}"
@@ -228,155 +3937,249 @@ def add_domain_record(domain, ip):
 def delete_domain_record(domain):
     """删除域名记录"""
     try:
-        if not domain:
-            return False, "域名为空"
-            
-        # 备份区域文件
-        if not backup_zone_file():
-            return False, "无法备份区域文件"
-            
-        with open(ZONE_FILE, "r") as f:
-            content = f.readlines()
-            
-        # 查找并删除匹配的记录
-        check_str = f"{domain}."
-        domain_regex = re.compile(rf"{re.escape(check_str)}\s+IN\s+[A|AAAA]")
-        
-        found = False
-        new_content = []
-        for line in content:
-            if domain_regex.search(line):
-                found = True
-                continue
-            new_content.append(line)
-            
-        if not found:
-            return False, f"域名 {domain} 不存在"
-            
-        # 更新SOA序列号
-        new_content_str = "".join(new_content)
-        new_content_str = update_soa_serial(new_content_str)
-        
-        # 写入文件
-        with open(ZONE_FILE, "w") as f:
-            f.write(new_content_str)
-            
-        # 重新加载BIND
-        result, msg = reload_bind()
-        if not result:
-            # 恢复备份
-            backup_zone_file()  # 先备份当前的错误文件
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            latest_backup = sorted([f for f in os.listdir(BACKUP_DIR) if f.startswith("db.uk.00-0.top")])[-2]
-            os.system(f"cp {os.path.join(BACKUP_DIR, latest_backup)} {ZONE_FILE}")
-            return False, f"重新加载BIND失败: {msg}"
-            
-        logging.info(f"已删除域名记录: {domain}")
-        return True, f"成功删除域名记录: {domain}"
-        
+        result, msg, _ = apply_zone_changes([{"op": "delete", "domain": domain}])
+        return result, msg
     except Exception as e:
         logging.error(f"删除域名记录时出错: {str(e)}", exc_info=True)
         return False, f"删除域名记录时出错: {str(e)}"
 
+def upsert_domain_record(domain, ip):
+    """添加或更新域名记录，记录已一致时不做任何修改"""
+    try:
+        result, msg, _ = apply_zone_changes([{"op": "upsert", "domain": domain, "ip": ip}])
+        return result, msg
+    except Exception as e:
+        logging.error(f"添加或更新域名记录时出错: {str(e)}", exc_info=True)
+        return False, f"服务器错误: {str(e)}"
+
 def update_domain_record(domain, ip):
     """更新域名记录"""
     try:
-        if not domain or not ip:
-            return False, "域名或IP为空"
-            
-        # 备份区域文件
-        if not backup_zone_file():
-            return False, "无法备份区域文件"
-            
-        with open(ZONE_FILE, "r") as f:
-            content = f.readlines()
-            
-        # 确定记录类型
-        record_type = get_record_type(ip)
-        
-        # 查找并更新匹配的记录
-        check_str = f"{domain}."
-        domain_regex = re.compile(rf"{re.escape(check_str)}\s+IN\s+[A|AAAA]")
-        
-        found = False
-        new_content = []
-        for line in content:
-            if domain_regex.search(line):
-                found = True
-                new_line = f"{domain}.   IN  {record_type}     {ip}\n"
-                new_content.append(new_line)
-            else:
-                new_content.append(line)
-                
-        if not found:
-            return False, f"域名 {domain} 不存在"
-            
-        # 更新SOA序列号
-        new_content_str = "".join(new_content)
-        new_content_str = update_soa_serial(new_content_str)
-        
-        # 写入文件
-        with open(ZONE_FILE, "w") as f:
-            f.write(new_content_str)
-            
-        # 重新加载BIND
-        result, msg = reload_bind()
-        if not result:
-            # 恢复备份
-            backup_zone_file()  # 先备份当前的错误文件
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            latest_backup = sorted([f for f in os.listdir(BACKUP_DIR) if f.startswith("db.uk.00-0.top")])[-2]
-            os.system(f"cp {os.path.join(BACKUP_DIR, latest_backup)} {ZONE_FILE}")
-            return False, f"重新加载BIND失败: {msg}"
-            
-        logging.info(f"已更新域名记录: {domain} -> {ip} ({record_type})")
-        return True, f"成功更新域名记录: {domain} -> {ip} ({record_type})"
-        
+        result, msg, _ = apply_zone_changes([{"op": "update", "domain": domain, "ip": ip}])
+        return result, msg
     except Exception as e:
         logging.error(f"更新域名记录时出错: {str(e)}", exc_info=True)
         return False, f"更新域名记录时出错: {str(e)}"
 
-def list_domain_records():
-    """列出所有域名记录"""
+class StreamingResponse:
+    """
+    NDJSON 流式响应：每行一条记录，最后一行是 {"status", "message", "count"} 加上版本号字段。
+    records 和 versions 是在发送时才调用的函数（versions 先于 records 调用），
+    因此记录的读取和发送在同一个线程中进行（SQLite 连接不能跨线程使用）。
+    """
+    
+    def __init__(self, records, versions=dict):
+        self.records = records
+        self.versions = versions
+        self.status = "stream"
+    
+    def chunks(self, batch=LIST_STREAM_BATCH):
+        """逐批生成要发送的字节"""
+        count = 0
+        lines = []
+        try:
+            versions = self.versions()
+            for record in self.records():
+                lines.append(json.dumps(record, ensure_ascii=False))
+                count += 1
+                if len(lines) >= batch:
+                    yield ("\n".join(lines) + "\n").encode("utf-8")
+                    lines = []
+            lines.append(json.dumps({"status": "success", "message": "获取域名列表成功", "count": count,
+                                     **versions}, ensure_ascii=False))
+        except Exception as e:
+            logging.error(f"流式输出域名列表时出错: {str(e)}", exc_info=True)
+            lines.append(json.dumps({"status": "error", "message": f"服务器错误: {str(e)}", "count": count},
+                                    ensure_ascii=False))
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+def encode_list_cursor(position):
+    """把 (区域, 小写域名, 类型, IP) 编码为不透明的分页游标"""
+    return base64.urlsafe_b64encode(json.dumps(list(position)).encode("utf-8")).decode("ascii")
+
+def decode_list_cursor(cursor):
+    """解析分页游标，无效时返回None"""
     try:
-        with open(ZONE_FILE, "r") as f:
-            content = f.readlines()
-            
-        # 查找所有A和AAAA记录
-        record_regex = re.compile(r'^([a-zA-Z0-9\-\.]+)\.\s+IN\s+(A|AAAA)\s+([0-9a-fA-F\.:]+)')
-        
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError, AttributeError, UnicodeError):
+        return None
+    if not isinstance(position, list) or len(position) != 4 or not all(isinstance(v, str) for v in position):
+        return None
+    return tuple(position)
+
+def parse_list_filters(request):
+    """解析 list_domains 的过滤参数，返回 (过滤条件, 错误消息)"""
+    filters = {}
+    for key in ("domain", "prefix", "suffix", "ip", "cidr", "type"):
+        value = request.get(key)
+        if value is None:
+            continue
+        if not isinstance(value, str) or not value:
+            return None, f"{key} 必须是非空字符串"
+        filters[key] = value
+    
+    for key in ("domain", "prefix", "suffix"):
+        if key in filters:
+            filters[key] = filters[key].lower().rstrip(".") if key != "prefix" else filters[key].lower()
+    if "type" in filters:
+        filters["type"] = filters["type"].upper()
+        if filters["type"] not in ("A", "AAAA"):
+            return None, "type 只能是 A 或 AAAA"
+    if "ip" in filters:
+        try:
+            filters["ip"] = str(ipaddress.ip_address(filters["ip"]))
+        except ValueError:
+            return None, "无效的IP地址格式"
+    if "cidr" in filters:
+        try:
+            filters["cidr"] = ipaddress.ip_network(filters["cidr"], strict=False)
+        except ValueError:
+            return None, "无效的 CIDR 格式"
+    return filters, None
+
+def record_matches(filters, key, record_type, ip):
+    """检查一条记录是否满足 domain/prefix 以外的过滤条件（这两项由存储层处理）"""
+    if "suffix" in filters and not (key == filters["suffix"] or key.endswith("." + filters["suffix"])):
+        return False
+    if "type" in filters and record_type != filters["type"]:
+        return False
+    if "ip" in filters or "cidr" in filters:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if "ip" in filters and str(address) != filters["ip"]:
+            return False
+        if "cidr" in filters and address not in filters["cidr"]:
+            return False
+    return True
+
+def iter_domain_records(zones, filters, after=None):
+    """
+    按 (区域, 小写域名, 类型, IP) 顺序逐条产生满足条件的记录，从 after 之后开始。
+    每个区域只在开始读取时持有读锁：区域文件存储的模型不可变，
+    SQLite 查询在开始执行时就固定了快照，之后的遍历不会阻塞写入。
+    """
+    for zone in sorted(zones, key=lambda zone: zone.name):
+        if after is not None and zone.name < after[0]:
+            continue
+        zone_after = after[1:] if after is not None and zone.name == after[0] else None
+        with zone.rwlock.read():
+            # 只把 IPv4 交给存储层按值查找：IPv6 在区域文件中可能有多种写法，统一由 record_matches 比较
+            ip = filters.get("ip") if "." in filters.get("ip", "") else None
+            rows = zone.store.snapshot().scan_records(domain=filters.get("domain"), prefix=filters.get("prefix"),
+                                                      ip=ip, after=zone_after)
+            first = next(rows, None)
+        if first is None:
+            continue
+        for key, record_type, ip, name in itertools.chain((first,), rows):
+            if record_matches(filters, key, record_type, ip):
+                yield (zone.name, key, record_type, ip), {"domain": name, "type": record_type, "ip": ip,
+                                                          "zone": zone.name}
+
+def query_domain_records(request, allow_stream):
+    """处理带过滤、分页或流式参数的 list_domains 请求"""
+    filters, msg = parse_list_filters(request)
+    if msg:
+        return {"status": "error", "message": msg}
+    
+    zones = list(zone_router.zones().values())
+    if request.get("zone") is not None:
+        zone = zone_router.get(str(request["zone"]))
+        if zone is None:
+            return {"status": "error", "message": f"未管理区域 {request['zone']}"}
+        zones = [zone]
+    
+    after = None
+    if request.get("cursor") is not None:
+        after = decode_list_cursor(request["cursor"])
+        if after is None:
+            return {"status": "error", "message": "无效的 cursor"}
+    
+    if request.get("stream"):
+        if not allow_stream:
+            return {"status": "error", "message": "分帧连接不支持流式输出，请使用 limit/cursor 分页"}
+        return StreamingResponse(lambda: (record for _, record in iter_domain_records(zones, filters, after)),
+                                 lambda: zone_versions(zones))
+    
+    limit = request.get("limit", MAX_LIST_LIMIT)
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_LIST_LIMIT:
+        return {"status": "error", "message": f"limit 必须是 1 到 {MAX_LIST_LIMIT} 之间的整数"}
+    
+    # 先读版本号：返回的版本不会比记录新，用它做 if_version 不会掩盖之后的修改
+    versions = zone_versions(zones)
+    domains = []
+    next_cursor = None
+    records = iter_domain_records(zones, filters, after)
+    for position, record in records:
+        if len(domains) == limit:
+            # 还有更多记录：游标指向本页最后一条
+            next_cursor = encode_list_cursor(last_position)
+            break
+        domains.append(record)
+        last_position = position
+    records.close()
+    return {"status": "success", "message": "获取域名列表成功", "domains": domains, "next_cursor": next_cursor,
+            **versions}
+
+def list_domain_records(zone_name=None):
+    """列出所有区域（或指定区域）的域名记录，返回 (是否成功, 记录, 版本号字段)；指定的区域不存在时失败"""
+    try:
+        zones = zone_router.zones()
+        if zone_name is not None:
+            zone = zone_router.get(str(zone_name))
+            if zone is None:
+                logging.warning(f"获取域名列表失败: 未管理区域 {zone_name}")
+                return False, [], {}
+            zones = {zone.name: zone}
         domains = []
-        for line in content:
-            match = record_regex.search(line)
-            if match:
-                domain_name = match.group(1)
-                record_type = match.group(2)
-                ip_address = match.group(3)
-                
-                domains.append({
-                    "domain": domain_name,
-                    "type": record_type,
-                    "ip": ip_address
-                })
-                
-        logging.info(f"已获取域名列表，共 {len(domains)} 条记录")
-        return True, domains
+        versions = {}
+        for zone in zones.values():
+            with zone.rwlock.read():
+                snapshot = zone.store.snapshot()
+                records = snapshot.list_records()
+                versions[zone.name] = snapshot.serial
+            domains.extend({**record, "zone": zone.name} for record in records)
+        logging.debug("已获取域名列表，共 %d 条记录", len(domains))
+        if len(versions) == 1:
+            return True, domains, {"version": next(iter(versions.values()))}
+        return True, domains, {"versions": versions}
         
     except Exception as e:
         logging.error(f"获取域名列表时出错: {str(e)}", exc_info=True)
-        return False, []
+        return False, [], {}
+
+def recover_zone_wals(retry=True):
+    """
+    服务启动时（检查区域文件之前）提交各区域 WAL 中尚未完成的批次。
+    retry 为假时失败的批次不在本进程重试（多进程模式的监管进程不运行调度线程）。
+    """
+    for zone in zone_router.zones().values():
+        if zone.wal is None or not zone.wal.has_records():
+            continue
+        try:
+            zone.scheduler.recover(retry)
+        except Exception as e:
+            logging.error(f"重放区域 {zone.name} 的 WAL 时出错: {str(e)}", exc_info=True)
 
 def check_zone_file_health():
-    """检查区域文件健康状态"""
+    """检查所有区域文件的健康状态"""
     try:
-        # 使用named-checkzone检查区域文件
-        zone_name = "uk.00-0.top"  # 假设这是区域名称
-        ret = subprocess.run(["named-checkzone", zone_name, ZONE_FILE], 
-                            capture_output=True, text=True)
-        
-        if ret.returncode != 0:
-            logging.error(f"区域文件检查失败: {ret.stderr}")
-            return False
+        for zone in zone_router.zones().values():
+            # 使用named-checkzone检查区域文件
+            ret = subprocess.run(["named-checkzone", zone.name, zone.path], 
+                                capture_output=True, text=True)
+            
+            if ret.returncode != 0:
+                logging.error(f"区域 {zone.name} 的文件检查失败: {ret.stderr}")
+                return False
+            
+            # 版本号、WAL 和变更日志都以 SOA 序列号为键
+            with zone.rwlock.read():
+                serial = zone.store.snapshot().serial
+            if serial is None:
+                logging.error(f"区域 {zone.name} 的文件中找不到 SOA 序列号（序列号所在行需带 '; serial' 注释）")
+                return False
             
         logging.info("区域文件检查通过")
         return True
@@ -384,61 +4187,194 @@ def check_zone_file_health():
         logging.error(f"检查区域文件时出错: {str(e)}")
         return False
 
-def perform_zone_file_cleanup():
-    """清理过期的备份文件（保留最近30个）"""
-    try:
-        backup_files = sorted([os.path.join(BACKUP_DIR, f) 
-                              for f in os.listdir(BACKUP_DIR) 
-                              if f.startswith("db.uk.00-0.top")])
-        
-        # 保留最近30个备份
-        files_to_delete = backup_files[:-30] if len(backup_files) > 30 else []
-        
-        for file_path in files_to_delete:
-            os.remove(file_path)
-            logging.info(f"已删除过期备份: {file_path}")
-            
-        return True
-    except Exception as e:
-        logging.error(f"清理备份文件时出错: {str(e)}")
-        return False
+def collect_zone_metrics():
+    """输出指标时统计各区域的记录数"""
+    samples = []
+    for zone in zone_router.zones().values():
+        with zone.rwlock.read():
+            count = zone.store.snapshot().record_count()
+        samples.append(("dns_api_zone_records", {"zone": zone.name}, count))
+    return samples
 
-def cleanup_thread():
-    """执行定期清理任务的线程"""
-    while True:
-        try:
-            # 每24小时执行一次清理
-            time.sleep(24 * 60 * 60)
-            perform_zone_file_cleanup()
-        except Exception as e:
-            logging.error(f"清理线程出错: {str(e)}")
+metrics.add_collector(collect_zone_metrics)
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """GET /metrics 返回 Prometheus 文本格式的指标"""
+    
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass  # 抓取很频繁，不写入日志
 
-def start_cleanup_thread():
-    """启动清理线程"""
-    thread = threading.Thread(target=cleanup_thread, daemon=True)
+def start_metrics_server(port=None):
+    """在后台线程中启动指标 HTTP 监听（默认端口为 METRICS_PORT）"""
+    port = port or METRICS_PORT
+    server = http.server.ThreadingHTTPServer((METRICS_HOST, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
     thread.start()
-    logging.info("清理线程已启动")
+    logging.info(f"指标端点已启动: http://{METRICS_HOST}:{port}/metrics")
+    return server
+
+def run_server(host, port, reuse_port=False):
+    """按 SERVER_ENGINE 运行服务器，直到被中断（多进程模式下收到 SIGTERM 时也正常返回）"""
+    if SERVER_ENGINE == "asyncio":
+        asyncio.run(AsyncDNSAPIServer(host, port, reuse_port=reuse_port).serve())
+        return
+    server_class = ReusePortTCPServer if reuse_port else ThreadedTCPServer
+    with server_class((host, port), DNSRequestHandler) as server:
+        if reuse_port:
+            # 监管进程转发的 SIGTERM：停止接受新连接（shutdown 会等待 serve_forever 返回，需在其他线程调用）
+            signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+        logging.info(f"DNS API Server 正在端口 {port} 监听...")
+        print(f"DNS API Server 正在端口 {port} 监听...")
+        server.serve_forever()
+
+def run_worker(index, host, port):
+    """多进程模式的工作进程（派生出的子进程中执行），返回退出码"""
+    global zone_watcher
+    # 父进程的日志后台线程不会被带到子进程，重新建立日志队列
+    restart_logging(shared=True, stop_previous=False)
+    # 同理，父进程中区域调度线程和目标线程池的线程也不在子进程中，重建它们
+    for zone in zone_router.zones().values():
+        zone.scheduler.reset_after_fork()
+    reset_target_executor()
+    try:
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT + index)
+        if ZONE_WATCHER:
+            zone_watcher = start_zone_watcher()
+        if REPLICATION_PRIMARY is not None and index == 0:
+            start_replication()
+        run_server(host, port, reuse_port=True)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logging.critical(f"工作进程 {index} 运行时发生错误: {str(e)}", exc_info=True)
+        return 1
+    # 等待进行中的提交完成后再退出
+    for zone in zone_router.zones().values():
+        with zone.rwlock.write():
+            pass
+    logging.info(f"工作进程 {index} 已退出")
+    return 0
+
+class WorkerSupervisor:
+    """
+    多进程模式的监管进程：派生 count 个工作进程，它们各自以 SO_REUSEPORT 绑定同一端口。
+    工作进程在未收到停止信号时退出（崩溃）会被重新派生，连续快速退出时按指数退避。
+    收到 SIGTERM/SIGINT 后转发给所有工作进程，等它们全部退出后返回。
+    """
+    
+    def __init__(self, host, port, count):
+        self.host = host
+        self.port = port
+        self.count = count
+        # pid -> (工作进程序号, 启动时间)
+        self._workers = {}
+        self._failures = [0] * count
+        self._stopping = False
+    
+    def run(self):
+        restart_logging(shared=True)
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._stop)
+        logging.info(f"DNS API Server 以 {self.count} 个工作进程在端口 {self.port} 监听...")
+        print(f"DNS API Server 以 {self.count} 个工作进程在端口 {self.port} 监听...")
+        for index in range(self.count):
+            self._spawn(index)
+        
+        while self._workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            if pid not in self._workers:
+                continue
+            index, started = self._workers.pop(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if self._stopping:
+                continue
+            if time.monotonic() - started >= WORKER_MIN_UPTIME:
+                self._failures[index] = 0
+            delay = min(WORKER_RESTART_MAX_DELAY, 2 ** self._failures[index] - 1)
+            self._failures[index] += 1
+            logging.error(f"工作进程 {index} (pid {pid}) 意外退出，退出码 {code}，{delay} 秒后重新启动")
+            deadline = time.monotonic() + delay
+            while not self._stopping and time.monotonic() < deadline:
+                time.sleep(min(0.5, deadline - time.monotonic()))
+            if not self._stopping:
+                self._spawn(index)
+        logging.info("所有工作进程已退出")
+    
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                code = run_worker(index, self.host, self.port)
+            finally:
+                # 子进程不执行父进程的 atexit 和清理，写完日志后直接退出
+                try:
+                    log_listener.stop()
+                finally:
+                    os._exit(code)
+        self._workers[pid] = (index, time.monotonic())
+        logging.info(f"已启动工作进程 {index} (pid {pid})")
+    
+    def _stop(self, signum, frame):
+        self._stopping = True
+        for pid in list(self._workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
 
 if __name__ == "__main__":
     # 确保备份目录存在
     ensure_backup_dir()
     
+    # 重放上次运行中已接受但没有完成的变更；多进程模式下失败的批次由工作进程重试，
+    # 监管进程不运行调度线程，派生时也就不会有线程持有区域锁
+    recover_zone_wals(retry=WORKER_PROCESSES <= 1)
+    
     # 检查区域文件健康状态
     if not check_zone_file_health():
         logging.error("区域文件检查失败，服务退出")
         exit(1)
     
-    # 启动清理线程
-    start_cleanup_thread()
-    
     # 启动服务器
     HOST, PORT = "", 5050
     
     try:
-        with ThreadedTCPServer((HOST, PORT), DNSRequestHandler) as server:
-            logging.info(f"DNS API Server 正在端口 {PORT} 监听...")
-            print(f"DNS API Server 正在端口 {PORT} 监听...")
-            server.serve_forever()
+        if WORKER_PROCESSES > 1:
+            # 指标端点和区域文件监视由各工作进程自己启动，从节点同步由 0 号工作进程负责
+            WorkerSupervisor(HOST, PORT, WORKER_PROCESSES).run()
+        else:
+            # 启动指标端点
+            if METRICS_PORT:
+                start_metrics_server()
+            
+            # 监视区域文件的外部修改
+            if ZONE_WATCHER:
+                zone_watcher = start_zone_watcher()
+            
+            # 从节点：持续同步主节点的变更
+            if REPLICATION_PRIMARY is not None:
+                start_replication()
+            
+            run_server(HOST, PORT)
     except KeyboardInterrupt:
         logging.info("服务器正在关闭...")
         print("服务器正在关闭...")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# check_dns_api_client.py - esb-dns 命令行的冒烟检查
+#
+# 连接一个运行中的 DNS API Server，用 esb-dns 的位置参数形式依次执行每个子命令
+# （set-txt/clear-txt 只接受输入文件），检查用的域名 esb-dns-check.<区域> 在结束时被删除。
+# 所有子命令都成功时退出码为 0，有失败时为 1。
+#
+# 示例：
+#   ./check_dns_api_client.py --zone example.com
+#   ./check_dns_api_client.py --server 10.0.0.5 --port 5050 --zone example.com
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from dns_api_client import DEFAULT_PORT, DEFAULT_SERVER, main as esb_dns
+
+CHECK_LABEL = "esb-dns-check"
+
+def check_cli(server, port, zone):
+    """依次执行每个子命令并打印结果，返回失败的命令"""
+    domain = f"{CHECK_LABEL}.{zone}"
+    with tempfile.NamedTemporaryFile("w", prefix=f"{CHECK_LABEL}.", suffix=".txt", delete=False) as f:
+        f.write(f"{domain} check-token\n")
+        txt_input = f.name
+    commands = [
+        ["add", domain, "192.0.2.10"],
+        ["update", domain, "192.0.2.11"],
+        ["upsert", domain, "192.0.2.12"],
+        ["list", "--domain", domain],
+        ["delete", domain],
+        ["set-txt", "-f", txt_input],
+        ["clear-txt", "-f", txt_input],
+    ]
+    failed = []
+    try:
+        for command in commands:
+            output = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                    code = esb_dns(["--server", server, "--port", str(port), "--format", "text"] + command)
+            except (Exception, SystemExit) as e:
+                code, output = 1, io.StringIO(repr(e))
+            status = "通过" if code == 0 else f"失败（退出码 {code}）"
+            print(f"  esb-dns {' '.join(command)}: {status}")
+            if code != 0:
+                print("    " + output.getvalue().strip().replace("\n", "\n    "))
+                failed.append(command)
+    finally:
+        os.remove(txt_input)
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="esb-dns 命令行冒烟检查")
+    parser.add_argument("--server", default=os.environ.get("DNS_API_SERVER", DEFAULT_SERVER), help="服务器地址")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("DNS_API_PORT", DEFAULT_PORT)), help="服务器端口")
+    parser.add_argument("--zone", required=True, help="服务器管理的区域，检查用的域名建在该区域下")
+    args = parser.parse_args(argv)
+
+    print(f"检查 esb-dns 子命令（{args.server}:{args.port}，区域 {args.zone}）:")
+    failed = check_cli(args.server, args.port, args.zone.rstrip("."))
+    print("全部通过" if not failed else f"{len(failed)} 个子命令失败")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# dns_api_client.py - DNS API Server 的 Python 客户端和批量命令行工具 (esb-dns)
+#
+# DNSAPIClient 复用一个分帧长连接（每个请求/响应前加 4 字节大端长度），
+# 批量请求以流水线方式发送，不必等待上一个响应。
+# 服务器繁忙 (busy) 或限流 (rate_limited/retry_after) 的请求按带抖动的指数退避重试；
+# 连接中断时重新连接，只有幂等的请求会被自动重发，其余请求报告"结果未知"。
+#
+# 命令行用法（esb-dns 是本文件的入口）：
+#   esb-dns add www.example.com 1.2.3.4
+#   esb-dns upsert -f domains.txt               # 每行 "域名 IP"
+#   esb-dns upsert --ip 1.2.3.4 -f names.txt    # 每行一个域名，都指向同一个 IP
+#   cat names.txt | esb-dns delete -f -
+#   esb-dns upsert --atomic -f domains.txt      # 合并为 apply_changes 请求，全部成功或全部不生效
+#   esb-dns set-txt -f tokens.txt               # 每行 "域名 令牌"，一次提交
+#   esb-dns list --suffix .example.com
+# 每个结果输出一行 JSON（--format text 输出可读文本）；全部成功时退出码为 0，
+# 有请求失败时为 1，无法连接服务器或参数错误时为 2。
+# 同目录下的 check_dns_api_client.py 对运行中的服务器逐个检查各子命令。
+
+import argparse
+import collections
+import json
+import os
+import random
+import socket
+import struct
+import sys
+import time
+
+DEFAULT_SERVER = "127.0.0.1"
+DEFAULT_PORT = 5050
+# 流水线中同时等待响应的请求数（不超过服务器的 PIPELINE_DEPTH）
+DEFAULT_PIPELINE = 64
+# 单个 apply_changes / set_txt 请求的最大变更数（与服务器的 MAX_BATCH_CHANGES 一致）
+MAX_BATCH_CHANGES = 1000
+# 连接中断后可以安全重发的动作：重复执行的结果与执行一次相同
+IDEMPOTENT_ACTIONS = {"list_domains", "list_history", "changes_since", "upsert_domain", "set_txt", "clear_txt"}
+# 单项变更的动作与 apply_changes 中变更类型的对应关系
+CHANGE_OPS = {"add_domain": "add", "delete_domain": "delete", "update_domain": "update", "upsert_domain": "upsert"}
+
+class DNSAPIError(Exception):
+    """无法连接服务器，或连接中断且无法恢复"""
+
+class DNSAPIClient:
+    """
+    DNS API 客户端：一个分帧长连接，按需建立，出错后自动重连。
+    execute() 以流水线方式发送一组请求，按原顺序返回响应；
+    被拒绝（繁忙、限流）的请求在退避后重发，最多重试 retries 次。
+    被拒绝时流水线窗口减半，之后每个成功的响应把窗口加一，直到 pipeline。
+    """
+
+    def __init__(self, server=DEFAULT_SERVER, port=DEFAULT_PORT, timeout=30, retries=5,
+                 backoff=0.2, max_backoff=10, pipeline=DEFAULT_PIPELINE):
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pipeline = max(1, pipeline)
+        self._sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        if self._sock is None:
+            self._sock = socket.create_connection((self.server, self.port), timeout=self.timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self._sock
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+
+    def _delay(self, attempt):
+        """第 attempt 次重试前的等待时间：指数退避，乘以 0.5~1 的随机抖动，避免客户端同时重试"""
+        return min(self.max_backoff, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1)
+
+    def _send(self, requests):
+        frames = []
+        for request in requests:
+            body = json.dumps(request, ensure_ascii=False).encode("utf-8")
+            frames.append(struct.pack("!I", len(body)) + body)
+        self.connect().sendall(b"".join(frames))
+
+    def _recv_exact(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("服务器关闭了连接")
+            data += chunk
+        return data
+
+    def _recv(self):
+        length = struct.unpack("!I", self._recv_exact(4))[0]
+        return json.loads(self._recv_exact(length).decode("utf-8"))
+
+    def execute(self, requests):
+        """按流水线发送一组请求，返回与之一一对应的响应"""
+        requests = list(requests)
+        results = [None] * len(requests)
+        attempts = [0] * len(requests)
+        waiting = collections.deque(range(len(requests)))
+        # 需要重发的请求按原顺序排在尚未发送的请求前面
+        retrying = collections.deque()
+        inflight = collections.deque()
+        # 退避期间不发送新的请求
+        resume_at = 0
+        failures = 0
+        window = self.pipeline
+
+        while waiting or retrying or inflight:
+            now = time.monotonic()
+            if (waiting or retrying) and len(inflight) < window and now >= resume_at:
+                sending = []
+                while (waiting or retrying) and len(inflight) + len(sending) < window:
+                    sending.append((retrying or waiting).popleft())
+                try:
+                    self._send([requests[i] for i in sending])
+                    inflight.extend(sending)
+                except OSError as e:
+                    retrying.extendleft(reversed(sending))
+                    failures = self._connection_lost(e, requests, results, attempts, retrying, inflight, failures)
+                    resume_at = time.monotonic() + self._delay(failures)
+                    continue
+            if not inflight:
+                time.sleep(max(0, resume_at - time.monotonic()))
+                continue
+
+            try:
+                resp = self._recv()
+            except (OSError, ValueError) as e:
+                failures = self._connection_lost(e, requests, results, attempts, retrying, inflight, failures)
+                resume_at = time.monotonic() + self._delay(failures)
+                continue
+            failures = 0
+            i = inflight.popleft()
+            if (resp.get("busy") or resp.get("rate_limited")) and attempts[i] < self.retries:
+                # 服务器没有执行这个请求：等待后重发
+                attempts[i] += 1
+                delay = resp.get("retry_after") or self._delay(attempts[i])
+                resume_at = max(resume_at, time.monotonic() + delay * random.uniform(1, 1.2))
+                retrying.append(i)
+                window = max(1, window // 2)
+            else:
+                results[i] = resp
+                window = min(self.pipeline, window + 1)
+        return results
+
+    def _connection_lost(self, error, requests, results, attempts, retrying, inflight, failures):
+        """
+        连接中断：已发送但未收到响应的幂等请求放回队列重发，其余请求标记为结果未知。
+        连续失败超过重试次数时抛出 DNSAPIError。返回连续失败次数。
+        """
+        self.close()
+        failures += 1
+        if failures > self.retries:
+            raise DNSAPIError(f"无法连接 DNS API 服务器 {self.server}:{self.port}: {error}")
+        for i in inflight:
+            attempts[i] += 1
+            if requests[i].get("action") in IDEMPOTENT_ACTIONS and attempts[i] <= self.retries:
+                retrying.append(i)
+            else:
+                results[i] = {"status": "error", "message": f"连接中断，请求结果未知: {error}", "unknown": True}
+        inflight.clear()
+        return failures
+
+    def request(self, request):
+        """发送单个请求并返回响应"""
+        return self.execute([request])[0]
+
+    def add(self, domain, ip):
+        return self.request({"action": "add_domain", "domain": domain, "ip": ip})
+
+    def delete(self, domain):
+        return self.request({"action": "delete_domain", "domain": domain})
+
+    def update(self, domain, ip):
+        return self.request({"action": "update_domain", "domain": domain, "ip": ip})
+
+    def upsert(self, domain, ip, if_version=None):
+        request = {"action": "upsert_domain", "domain": domain, "ip": ip}
+        if if_version is not None:
+            request["if_version"] = if_version
+        return self.request(request)
+
+    def apply_changes(self, changes, if_version=None):
+        """批量变更（全部成功或全部不生效），changes 为 [{"op", "domain", "ip"}]"""
+        request = {"action": "apply_changes", "changes": list(changes)}
+        if if_version is not None:
+            request["if_version"] = if_version
+        return self.request(request)
+
+    def set_txt(self, records):
+        """发布 TXT 记录，records 为 [{"domain", "value" 或 "values"}]"""
+        return self.request({"action": "set_txt", "records": list(records)})
+
+    def clear_txt(self, domains):
+        return self.request({"action": "clear_txt", "domains": list(domains)})
+
+    def changes_since(self, zone=None, serial=None, seq=None, limit=None):
+        """
+        区域在序列号 serial（或变更日志序号 seq）之后的提交；响应带 resync 时
+        无法增量同步，content 为区域的完整内容
+        """
+        request = {"action": "changes_since"}
+        for key, value in (("zone", zone), ("serial", serial), ("seq", seq), ("limit", limit)):
+            if value is not None:
+                request[key] = value
+        return self.request(request)
+
+    def iter_records(self, limit=None, **filters):
+        """
+        按 filters（domain/prefix/suffix/type/ip/cidr/zone）逐页读取记录，
+        每页最多 limit 条（默认由服务器决定），逐条返回
+        """
+        filters = {key: value for key, value in filters.items() if value is not None}
+        request = {"action": "list_domains", **filters}
+        if limit is not None:
+            request["limit"] = limit
+        elif not filters:
+            # 不带任何过滤或分页参数时服务器会一次返回全部记录，改为分页读取
+            request["limit"] = 10000
+        while True:
+            resp = self.request(request)
+            if resp.get("status") != "success":
+                raise DNSAPIError(resp.get("message", "获取域名列表失败"))
+            yield from resp.get("domains", [])
+            if not resp.get("next_cursor"):
+                return
+            request["cursor"] = resp["next_cursor"]
+
+def read_lines(path):
+    """读取批量输入（"-" 为标准输入），跳过空行和 # 注释，每行按空白或逗号切分"""
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line.replace(",", " ").split()
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def build_requests(args):
+    """按命令和输入生成请求列表，返回 [(请求, 输出时附带的字段)]"""
+    action = {"add": "add_domain", "delete": "delete_domain", "update": "update_domain",
+              "upsert": "upsert_domain"}[args.command]
+    items = []
+    if args.domain:
+        items.append([args.domain] + ([args.address] if args.address else []))
+    if args.file:
+        items.extend(read_lines(args.file))
+
+    changes = []
+    for fields in items:
+        domain = fields[0]
+        if action == "delete_domain":
+            changes.append({"op": CHANGE_OPS[action], "domain": domain})
+            continue
+        ip = fields[1] if len(fields) > 1 else args.ip
+        if not ip:
+            raise ValueError(f"{domain} 缺少 IP 地址（可以用 --ip 指定默认值）")
+        changes.append({"op": CHANGE_OPS[action], "domain": domain, "ip": ip})
+
+    if args.atomic:
+        return [({"action": "apply_changes", "changes": changes[start:start + MAX_BATCH_CHANGES]},
+                 {"changes": len(changes[start:start + MAX_BATCH_CHANGES])})
+                for start in range(0, len(changes), MAX_BATCH_CHANGES)]
+    requests = []
+    for change in changes:
+        request = {"action": action, "domain": change["domain"]}
+        if "ip" in change:
+            request["ip"] = change["ip"]
+        requests.append((request, {key: value for key, value in request.items() if key != "action"}))
+    return requests
+
+def acme_challenge_name(domain):
+    if domain.startswith("_acme-challenge."):
+        return domain
+    return "_acme-challenge." + (domain[2:] if domain.startswith("*.") else domain)
+
+def build_txt_requests(args):
+    """
+    set-txt 每行 "域名 令牌"，clear-txt 每行一个域名；每 MAX_BATCH_CHANGES 个名称一个请求。
+    与 dns_operations.sh 的 acme-set 相同，域名去掉 "*." 后加上 "_acme-challenge." 前缀（已带前缀的不变）
+    """
+    items = [[acme_challenge_name(fields[0])] + fields[1:] for fields in read_lines(args.file)]
+    if args.command == "set-txt":
+        if any(len(fields) < 2 for fields in items):
+            raise ValueError("set-txt 的每行需要 \"域名 令牌\"")
+        records = [{"domain": fields[0], "value": fields[1]} for fields in items]
+        return [({"action": "set_txt", "records": records[start:start + MAX_BATCH_CHANGES]},
+                 {"records": len(records[start:start + MAX_BATCH_CHANGES])})
+                for start in range(0, len(records), MAX_BATCH_CHANGES)]
+    domains = [fields[0] for fields in items]
+    return [({"action": "clear_txt", "domains": domains[start:start + MAX_BATCH_CHANGES]},
+             {"domains": len(domains[start:start + MAX_BATCH_CHANGES])})
+            for start in range(0, len(domains), MAX_BATCH_CHANGES)]
+
+def print_result(args, fields, resp):
+    if args.format == "json":
+        print(json.dumps({**fields, **resp}, ensure_ascii=False))
+        return
+    target = fields.get("domain") or ", ".join(f"{key}={value}" for key, value in fields.items())
+    print(f"{target}: {'成功' if resp.get('status') == 'success' else '失败'} {resp.get('message', '')}")
+
+def run_list(client, args):
+    filters = {"domain": args.domain, "prefix": args.prefix, "suffix": args.suffix, "type": args.type,
+               "ip": args.ip, "cidr": args.cidr, "zone": args.zone}
+    for record in client.iter_records(limit=args.limit, **filters):
+        if args.format == "json":
+            print(json.dumps(record, ensure_ascii=False))
+        else:
+            print(f"{record['domain']} [{record['type']}] -> {record['ip']}")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="esb-dns", description="DNS API 批量客户端（一个连接、流水线发送）")
+    parser.add_argument("--server", default=os.environ.get("DNS_API_SERVER", DEFAULT_SERVER), help="服务器地址")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("DNS_API_PORT", DEFAULT_PORT)), help="服务器端口")
+    parser.add_argument("--timeout", type=float, default=30, help="连接和单个响应的超时（秒）")
+    parser.add_argument("--retries", type=int, default=5, help="繁忙、限流或连接中断时的最大重试次数")
+    parser.add_argument("--pipeline", type=int, default=DEFAULT_PIPELINE, help="同时等待响应的请求数")
+    parser.add_argument("--format", choices=("json", "text"), default="json", help="输出格式（每个结果一行）")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for name, help_text in (("add", "添加记录"), ("delete", "删除记录"), ("update", "更新记录"),
+                            ("upsert", "添加或更新记录（已一致时不做修改）")):
+        command = commands.add_parser(name, help=help_text)
+        # delete 没有 IP 参数，build_requests 统一按未指定处理
+        command.set_defaults(address=None, ip=None)
+        command.add_argument("domain", nargs="?", help="域名（批量时用 -f）")
+        if name != "delete":
+            command.add_argument("address", nargs="?", help="IP 地址")
+            command.add_argument("--ip", help="输入行中没有 IP 时使用的地址")
+        command.add_argument("-f", "--file", help="批量输入文件，\"-\" 为标准输入（每行 \"域名 [IP]\"）")
+        command.add_argument("--atomic", action="store_true",
+                             help="合并为 apply_changes 请求：每批全部成功或全部不生效")
+    for name, help_text in (("set-txt", "发布 DNS-01 验证令牌（每行 \"域名 令牌\"）"),
+                            ("clear-txt", "清理 DNS-01 验证令牌（每行一个域名）")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("-f", "--file", default="-", help="输入文件，默认读取标准输入")
+    command = commands.add_parser("list", help="列出记录（自动分页）")
+    for key in ("domain", "prefix", "suffix", "type", "ip", "cidr", "zone"):
+        command.add_argument(f"--{key}")
+    command.add_argument("--limit", type=int, help="每页记录数")
+    args = parser.parse_args(argv)
+
+    client = DNSAPIClient(args.server, args.port, timeout=args.timeout, retries=args.retries,
+                          pipeline=args.pipeline)
+    try:
+        with client:
+            if args.command == "list":
+                return run_list(client, args)
+            if args.command in ("set-txt", "clear-txt"):
+                requests = build_txt_requests(args)
+            else:
+                if not args.domain and not args.file:
+                    parser.error("需要域名参数或 -f 输入文件")
+                requests = build_requests(args)
+            if not requests:
+                print("没有读取到任何请求", file=sys.stderr)
+                return 2
+            responses = client.execute(request for request, _ in requests)
+    except (ValueError, OSError, DNSAPIError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+
+    failed = 0
+    for (_, fields), resp in zip(requests, responses):
+        print_result(args, fields, resp)
+        failed += resp.get("status") != "success"
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -371,6 +371,56 @@ update_domain() {
     return 0
 }
 
+# 添加或更新域名记录：不存在时添加，已存在时更新，记录已一致时服务器不做任何修改
+upsert_domain() {
+    local domain="$1"
+    local ip="$2"
+    
+    # Validate inputs
+    if [[ -z "$domain" || -z "$ip" ]]; then
+        log "错误: 域名和IP都必须提供"
+        return 1
+    fi
+    
+    local json
+    json=$(jq -n --arg action "upsert_domain" --arg d "$domain" --arg i "$ip" \
+        '{action:$action, domain:$d, ip:$i}')
+    
+    resp=$(send_request "$json")
+    if [[ $? -ne 0 ]]; then
+        return 1
+    fi
+    
+    log "服务器原始响应: $resp"
+
+    # 提取 JSON 纯净部分
+    local json_resp
+    json_resp=$(echo "$resp" | grep -o '{.*}')  
+
+    if [[ -z "$json_resp" ]]; then
+        log "解析失败，未找到有效 JSON，服务器返回: $resp"
+        return 1
+    fi
+
+    # 解析 status 和 message
+    local st msg
+    st=$(echo "$json_resp" | jq -r '.status' 2>/dev/null || echo "无法获取 status")
+    msg=$(echo "$json_resp" | jq -r '.message' 2>/dev/null || echo "无法获取 message")
+
+    if [[ "$st" == "无法获取 status" || "$msg" == "无法获取 message" ]]; then
+        log "解析失败，服务器返回: $resp"
+        return 1
+    fi
+
+    if [[ "$st" != "success" ]]; then
+        log "添加或更新失败: $msg"
+        return 1
+    fi
+    
+    log "添加或更新成功: $msg"
+    return 0
+}
+
 # New function: list domains
 list_domains() {
     local json
@@ -409,6 +459,269 @@ list_domains() {
     return 0
 }
 
+# 按域名、IP 或网段在服务器端查找记录，不拉取整个区域
+# 参数含 "/" 时按网段 (cidr) 查找，是 IP 时按 IP 查找，否则按域名精确查找
+lookup_domain() {
+    local target="$1"
+    local key
+    
+    if [[ -z "$target" ]]; then
+        log "错误: 请提供域名、IP 或网段"
+        return 1
+    fi
+    
+    if [[ "$target" == */* ]]; then
+        key="cidr"
+    elif [[ "$target" =~ ^[0-9.]+$ || "$target" == *:* ]]; then
+        key="ip"
+    else
+        key="domain"
+    fi
+    
+    local json
+    json=$(jq -n --arg action "list_domains" --arg key "$key" --arg value "$target" \
+        '{action:$action, limit:10000} + {($key):$value}')
+    
+    resp=$(send_request "$json")
+    if [[ $? -ne 0 ]]; then
+        return 1
+    fi
+    
+    local json_resp
+    json_resp=$(echo "$resp" | grep -o '{.*}')
+    
+    if [[ -z "$json_resp" ]]; then
+        log "解析失败，未找到有效 JSON，服务器返回: $resp"
+        return 1
+    fi
+    
+    local st
+    st=$(echo "$json_resp" | jq -r '.status' 2>/dev/null || echo "无法获取 status")
+    
+    if [[ "$st" != "success" ]]; then
+        local msg
+        msg=$(echo "$json_resp" | jq -r '.message' 2>/dev/null || echo "无法获取 message")
+        log "查找失败: $msg"
+        return 1
+    fi
+    
+    # 没有匹配的记录时返回 1，便于脚本判断域名是否存在
+    if [[ "$(echo "$json_resp" | jq '.domains | length')" == "0" ]]; then
+        echo "未找到匹配 $target 的记录"
+        return 1
+    fi
+    echo "$json_resp" | jq -r '.domains[] | "\(.domain) [\(.type)] -> \(.ip)"' 2>/dev/null
+    return 0
+}
+
+# 批量变更: 从文件或标准输入读取 "操作 域名 [IP]"，每行一项，一次请求提交
+# 操作为 add / update / delete，全部成功或全部不生效
+apply_changes() {
+    local input="${1:--}"
+    local json
+    json=$(jq -R -s '
+        split("\n")
+        | map(select(test("^\\s*(#|$)") | not) | split(" ") | map(select(length > 0)))
+        | map({op: .[0], domain: .[1]} + (if .[2] then {ip: .[2]} else {} end))
+        | {action: "apply_changes", changes: .}' "$input")
+    
+    if [[ -z "$json" || "$(echo "$json" | jq '.changes | length')" == "0" ]]; then
+        log "错误: 没有读取到任何变更"
+        return 1
+    fi
+    
+    resp=$(send_request "$json" 30)
+    if [[ $? -ne 0 ]]; then
+        return 1
+    fi
+    
+    log "服务器原始响应: $resp"
+    
+    local json_resp
+    json_resp=$(echo "$resp" | grep -o '{.*}')
+    
+    if [[ -z "$json_resp" ]]; then
+        log "解析失败，未找到有效 JSON，服务器返回: $resp"
+        return 1
+    fi
+    
+    local st msg
+    st=$(echo "$json_resp" | jq -r '.status' 2>/dev/null || echo "无法获取 status")
+    msg=$(echo "$json_resp" | jq -r '.message' 2>/dev/null || echo "无法获取 message")
+    
+    if [[ "$st" != "success" ]]; then
+        log "批量变更失败(未做任何修改): $msg"
+        return 1
+    fi
+    
+    log "批量变更成功: $msg"
+    echo "$json_resp" | jq -r '.results[]' 2>/dev/null
+    return 0
+}
+
+# 逐个域名批量处理: 从文件或标准输入读取 "域名 [IP]"，每个域名单独成功或失败
+# 由 esb-dns 在一个连接中流水线发送，不再为每个域名启动 jq 和 nc；繁忙或限流时自动重试
+bulk_domains() {
+    local op="$1"
+    local input="${2:--}"
+    local esb_dns
+    esb_dns="$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/esb-dns"
+    if [[ ! -x "$esb_dns" ]]; then
+        esb_dns=$(command -v esb-dns) || { log "错误: 找不到 esb-dns"; return 1; }
+    fi
+    
+    "$esb_dns" --server "$DNS_API_SERVER" --port "$DNS_API_PORT" --format text "$op" -f "$input"
+}
+
+# 批量发布 ACME DNS-01 验证令牌：每行 "<域名> <令牌>"，通配符域名 *.example.com 与 example.com 共用同一个名称
+# 所有令牌一次提交、一次 reload；同一域名的多个令牌会同时保留
+acme_set_txt() {
+    local input="${1:--}"
+    local json
+    json=$(jq -R -s '
+        split("\n")
+        | map(select(test("^\\s*(#|$)") | not) | split(" ") | map(select(length > 0)))
+        | map({domain: ("_acme-challenge." + (.[0] | sub("^\\*\\."; ""))), value: .[1]})
+        | {action: "set_txt", records: .}' "$input")
+    
+    if [[ -z "$json" || "$(echo "$json" | jq '.records | length')" == "0" ]]; then
+        log "错误: 没有读取到任何令牌"
+        return 1
+    fi
+    
+    send_txt_request "$json" "发布验证令牌"
+}
+
+# 批量清理 ACME DNS-01 验证令牌：每行一个域名
+acme_clear_txt() {
+    local input="${1:--}"
+    local json
+    json=$(jq -R -s '
+        split("\n")
+        | map(select(test("^\\s*(#|$)") | not) | gsub("\\s"; "") | "_acme-challenge." + sub("^\\*\\."; ""))
+        | {action: "clear_txt", domains: .}' "$input")
+    
+    if [[ -z "$json" || "$(echo "$json" | jq '.domains | length')" == "0" ]]; then
+        log "错误: 没有读取到任何域名"
+        return 1
+    fi
+    
+    send_txt_request "$json" "清理验证令牌"
+}
+
+send_txt_request() {
+    local json="$1"
+    local what="$2"
+    
+    resp=$(send_request "$json" 30)
+    if [[ $? -ne 0 ]]; then
+        return 1
+    fi
+    
+    log "服务器原始响应: $resp"
+    
+    local json_resp
+    json_resp=$(echo "$resp" | grep -o '{.*}')
+    
+    if [[ -z "$json_resp" ]]; then
+        log "解析失败，未找到有效 JSON，服务器返回: $resp"
+        return 1
+    fi
+    
+    local st msg
+    st=$(echo "$json_resp" | jq -r '.status' 2>/dev/null || echo "无法获取 status")
+    msg=$(echo "$json_resp" | jq -r '.message' 2>/dev/null || echo "无法获取 message")
+    
+    if [[ "$st" != "success" ]]; then
+        log "${what}失败(未做任何修改): $msg"
+        return 1
+    fi
+    
+    log "${what}成功: $msg"
+    echo "$json_resp" | jq -r '.results[]?' 2>/dev/null
+    return 0
+}
+
+# 查看最近的提交历史（序列号、时间、变更数）和可用快照；服务器管理多个区域时需指定区域
+list_history() {
+    local limit="${1:-20}"
+    local zone="$2"
+    local json
+    json=$(jq -n --arg action "list_history" --argjson limit "$limit" --arg zone "$zone" \
+        '{action:$action, limit:$limit} + (if $zone != "" then {zone:$zone} else {} end)')
+    
+    resp=$(send_request "$json")
+    if [[ $? -ne 0 ]]; then
+        return 1
+    fi
+    
+    local json_resp
+    json_resp=$(echo "$resp" | grep -o '{.*}')
+    
+    if [[ -z "$json_resp" ]]; then
+        log "解析失败，未找到有效 JSON，服务器返回: $resp"
+        return 1
+    fi
+    
+    local st
+    st=$(echo "$json_resp" | jq -r '.status' 2>/dev/null || echo "无法获取 status")
+    
+    if [[ "$st" != "success" ]]; then
+        local msg
+        msg=$(echo "$json_resp" | jq -r '.message' 2>/dev/null || echo "无法获取 message")
+        log "获取变更历史失败: $msg"
+        return 1
+    fi
+    
+    echo "提交历史:"
+    echo "$json_resp" | jq -r '.commits[] | "#\(.seq) 序列号 \(.serial) \(.time) (\(.changes) 项变更)"' 2>/dev/null
+    echo "快照:"
+    echo "$json_resp" | jq -r '.snapshots[] | "#\(.seq) 序列号 \(.serial)"' 2>/dev/null
+    return 0
+}
+
+# 把区域恢复到某个历史序列号时的内容（以新的序列号提交）
+rollback_to_serial() {
+    local serial="$1"
+    local zone="$2"
+    
+    if [[ ! "$serial" =~ ^[0-9]+$ ]]; then
+        log "错误: 序列号必须是数字"
+        return 1
+    fi
+    
+    local json
+    json=$(jq -n --arg action "rollback_to_serial" --argjson serial "$serial" --arg zone "$zone" \
+        '{action:$action, serial:$serial} + (if $zone != "" then {zone:$zone} else {} end)')
+    
+    resp=$(send_request "$json" 30)
+    if [[ $? -ne 0 ]]; then
+        return 1
+    fi
+    
+    log "服务器原始响应: $resp"
+    
+    local json_resp
+    json_resp=$(echo "$resp" | grep -o '{.*}')
+    
+    if [[ -z "$json_resp" ]]; then
+        log "解析失败，未找到有效 JSON，服务器返回: $resp"
+        return 1
+    fi
+    
+    local st msg
+    st=$(echo "$json_resp" | jq -r '.status' 2>/dev/null || echo "无法获取 status")
+    msg=$(echo "$json_resp" | jq -r '.message' 2>/dev/null || echo "无法获取 message")
+    
+    if [[ "$st" != "success" ]]; then
+        log "恢复失败: $msg"
+        return 1
+    fi
+    
+    log "恢复成功: $msg"
+    return 0
+}
+
 
 
 
@@ -466,9 +779,49 @@ main() {
             fi
             update_domain "$2" "$3"
             ;;
+        upsert|set)
+            if [[ $# -lt 3 ]]; then
+                echo "用法: $0 upsert <域名> <IP地址>"
+                return 1
+            fi
+            upsert_domain "$2" "$3"
+            ;;
         list|ls)
             list_domains
             ;;
+        lookup|find)
+            if [[ $# -lt 2 ]]; then
+                echo "用法: $0 lookup <域名|IP|网段>"
+                return 1
+            fi
+            lookup_domain "$2"
+            ;;
+        batch)
+            apply_changes "${2:--}"
+            ;;
+        bulk)
+            if [[ ! "$2" =~ ^(add|update|upsert|delete)$ ]]; then
+                echo "用法: $0 bulk <add|update|upsert|delete> [文件]"
+                return 1
+            fi
+            bulk_domains "$2" "${3:--}"
+            ;;
+        acme-set)
+            acme_set_txt "${2:--}"
+            ;;
+        acme-clear)
+            acme_clear_txt "${2:--}"
+            ;;
+        history)
+            list_history "${2:-20}" "$3"
+            ;;
+        rollback)
+            if [[ $# -lt 2 ]]; then
+                echo "用法: $0 rollback <序列号> [区域]"
+                return 1
+            fi
+            rollback_to_serial "$2" "$3"
+            ;;
         server)
             if [[ $# -lt 2 ]]; then
                 echo "用法: $0 server <服务器地址> [端口]"
@@ -481,7 +834,15 @@ main() {
             echo "  $0 add <域名> <IP地址>     - 添加新域名记录"
             echo "  $0 delete <域名>           - 删除域名记录"
             echo "  $0 update <域名> <IP地址>  - 更新域名记录"
+            echo "  $0 upsert <域名> <IP地址>  - 添加或更新域名记录(已一致时不做修改)"
             echo "  $0 list                   - 列出所有域名记录"
+            echo "  $0 lookup <域名|IP|网段>   - 查找域名记录，或哪些域名指向某个 IP/网段"
+            echo "  $0 batch [文件]            - 批量提交变更(每行: add|update|delete 域名 [IP])"
+            echo "  $0 bulk <操作> [文件]      - 逐个域名批量 add/update/upsert/delete(每行: 域名 [IP])"
+            echo "  $0 acme-set [文件]         - 批量发布 DNS-01 验证令牌(每行: 域名 令牌)"
+            echo "  $0 acme-clear [文件]       - 批量清理 DNS-01 验证令牌(每行: 域名)"
+            echo "  $0 history [条数] [区域]   - 查看最近的提交历史和快照"
+            echo "  $0 rollback <序列号> [区域] - 恢复到某个历史序列号的内容"
             echo "  $0 server <地址> [端口]    - 设置服务器地址和端口"
             echo "  $0 help                   - 显示帮助信息"
             ;;
@@ -208,6 +208,28 @@ add_domain() {
     return 0
 }
 
+# 添加或更新域名记录（续期时记录通常已存在且一致，服务器不会做任何修改）
+upsert_domain() {
+    local domain=$1
+    local ip=$2
+    local json
+    json=$(jq -n --arg action "upsert_domain" --arg d "$domain" --arg i "$ip" \
+         '{action:$action, domain:$d, ip:$i}')
+    echo "向DNS服务器($DNS_API_SERVER:$DNS_API_PORT)发送添加或更新请求: $json"
+    resp=$(echo "$json" | nc "$DNS_API_SERVER" "$DNS_API_PORT")
+    echo "服务器响应: $resp"
+    # 检查 status
+    local st msg
+    st=$(echo "$resp" | jq -r '.status' 2>/dev/null || true)
+    msg=$(echo "$resp" | jq -r '.message' 2>/dev/null || true)
+    if [ "$st" != "success" ]; then
+        echo "添加或更新失败: $msg"
+        return 1
+    fi
+    echo "添加或更新成功: $msg"
+    return 0
+}
+
 # 申请测试证书 (Let's Encrypt 测试服务器)
 issue_test_cert() {
     local domain=$1
@@ -224,7 +246,7 @@ issue_test_cert() {
 
         
         echo "检测到公网IP: $public_ip"
-        if ! add_domain "$domain" "$public_ip"; then
+        if ! upsert_domain "$domain" "$public_ip"; then
             echo "无法添加域名记录，继续尝试申请证书..."
             # 这里可以选择继续或返回失败
         fi
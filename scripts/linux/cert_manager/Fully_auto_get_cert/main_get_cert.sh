@@ -74,7 +74,7 @@ issue_test_cert() {
 
         
         echo "检测到公网IP: $public_ip"
-        if ! add_domain "$domain" "$public_ip"; then
+        if ! upsert_domain "$domain" "$public_ip"; then
             echo "无法添加域名记录，继续尝试申请证书..."
             # 这里可以选择继续或返回失败
         fi